@@ -1,22 +1,25 @@
-import torch
-from transformers import AutoTokenizer, AutoModel
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"))
+from embedding_service import EmbeddingService, TransformerEncoder, command_path_text
 
 # 加載模型：這是一個專門理解資安領域語義的 BERT
-tokenizer = AutoTokenizer.from_pretrained("jackaduma/CybersecurityBERT")
-model = AutoModel.from_pretrained("jackaduma/CybersecurityBERT")
+# 向量快取在 embeddings.sqlite，相同的 (command, path) 只會跑一次模型
+service = EmbeddingService(
+    TransformerEncoder("jackaduma/CybersecurityBERT", max_length=128, pooling="cls"),
+    cache_path="embeddings.sqlite",
+)
 
-def get_log_embedding(log_entry):
+def get_log_embeddings(log_entries):
     """
     運作邏輯：
-    1. 將 JSON 的關鍵資訊（如：執行的指令、路徑）結合成一個字串。
-    2. 透過 BERT 提取特徵，取 [CLS] Token 作為整條日誌的代表向量。
+    1. 將每筆 JSON 的關鍵資訊（如：執行的指令、路徑）結合成一個字串，重複的字串只算一次。
+    2. 未快取的字串以 padded batch 透過 BERT 提取特徵，取 [CLS] Token 作為整條日誌的代表向量。
+    返回 (筆數, 768) 的 numpy 陣列。
     """
-    # 範例日誌格式處理
-    text = f"cmd: {log_entry.get('command', 'N/A')} path: {log_entry.get('path', 'N/A')}"
-    
-    inputs = tokenizer(text, return_tensors="pt", truncation=True, max_length=128)
-    with torch.no_grad():
-        outputs = model(**inputs)
-    
-    # 返回一個 768 維的 numpy 陣列
-    return outputs.last_hidden_state[0, 0, :].numpy()
\ No newline at end of file
+    return service.embed_entries(log_entries, text_fn=command_path_text)
+
+def get_log_embedding(log_entry):
+    """單筆版本（相容原本的介面），返回一個 768 維的 numpy 陣列"""
+    return get_log_embeddings([log_entry])[0]
@@ -0,0 +1,74 @@
+import os
+import sys
+import pickle
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "utils"))
+from audit_follow import RESUME_KEY, follow_audit_log
+
+
+class Crash(Exception):
+    pass
+
+
+def interleaved_audit_lines(start, stop):
+    """
+    Events whose EOE record only arrives after the next event's first lines,
+    so the assembler is never empty between lines.
+    """
+    lines = []
+    for i in range(start, stop):
+        msg = f"audit(1700000000.{i:03d}:{i + 1})"
+        lines.append(f'type=SYSCALL msg={msg}: arch=c000003e syscall=257 success=yes exit=3 '
+                     f'ppid=1 pid={100 + i} comm="cat" exe="/usr/bin/cat" key="T1059"\n')
+        lines.append(f'type=PATH msg={msg}: item=0 name="/tmp/f{i}" inode={1000 + i} nametype=NORMAL\n')
+        if i > 0:
+            lines.append(f'type=EOE msg=audit(1700000000.{i - 1:03d}:{i}): \n')
+    return lines
+
+
+def stop_after(calls, crash=False):
+    """stop() for tail_lines: returns True (or raises Crash) on its `calls`-th call"""
+    count = [0]
+
+    def stop():
+        count[0] += 1
+        if count[0] >= calls:
+            if crash:
+                raise Crash()
+            return True
+        return False
+    return stop
+
+
+def edge_set(G):
+    return sorted((u, v, d["timestamp"]) for u, v, d in G.edges(data=True))
+
+
+def test_resume_after_crash_applies_every_event_once(tmp_path):
+    log = tmp_path / "audit.log"
+    lines = interleaved_audit_lines(0, 200)
+    half = len(lines) // 2
+    log.write_text("".join(lines[:half]))
+
+    # Checkpoint after every line, then die before the final flush / save
+    crashed_pkl = str(tmp_path / "crashed.pkl")
+    with pytest.raises(Crash):
+        follow_audit_log(str(log), crashed_pkl, checkpoint_interval=0, poll_interval=0.01,
+                         idle_flush=60, stop=stop_after(2, crash=True))
+    with open(crashed_pkl, "rb") as f:
+        checkpoint = pickle.load(f)
+    assert checkpoint.number_of_edges() > 0
+    assert checkpoint.graph[RESUME_KEY]["assembler"]["pending"]
+
+    with open(log, "a") as f:
+        f.writelines(lines[half:])
+    resumed = follow_audit_log(str(log), crashed_pkl, checkpoint_interval=0, poll_interval=0.01,
+                               idle_flush=60, stop=stop_after(2))
+
+    clean = follow_audit_log(str(log), str(tmp_path / "clean.pkl"), poll_interval=0.01,
+                             idle_flush=60, stop=stop_after(2))
+    assert clean.G.number_of_edges() == 200
+    assert edge_set(resumed.G) == edge_set(clean.G)
+    assert RESUME_KEY not in resumed.G.graph
@@ -0,0 +1,28 @@
+import os
+import sys
+import time
+
+import networkx as nx
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "utils"))
+from graph_layout import compute_positions
+
+
+def chain(n):
+    G = nx.MultiDiGraph()
+    nx.add_path(G, [f"n{i}" for i in range(n)])
+    return G
+
+
+def test_layout_cache_is_bounded_and_keeps_recent_entries(tmp_path):
+    cache = str(tmp_path / "g.layouts")
+    first, cached = compute_positions(chain(2), cache, max_entries=3)
+    assert not cached
+    for n in range(3, 8):
+        time.sleep(0.01)
+        compute_positions(chain(n), cache, max_entries=3)
+        time.sleep(0.01)
+        assert compute_positions(chain(2), cache, max_entries=3)[1]   # 常用的那份一直留著
+    assert len(os.listdir(cache)) == 3
+    assert compute_positions(chain(2), cache, max_entries=3) == (first, True)
+    assert not compute_positions(chain(3), cache, max_entries=3)[1]
@@ -0,0 +1,48 @@
+import os
+import sys
+
+import numpy as np
+import networkx as nx
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "utils"))
+from graph_store import NO_TIMESTAMP, CompactGraphBuilder, CompactProvenanceGraph, parse_timestamp
+
+
+@pytest.mark.parametrize("value, expected", [
+    (1700000000, 1700000000),
+    ("1700000000", 1700000000),
+    ("-5", -5),
+    (np.int64(42), 42),
+    (1700000000.5, 1700000000),
+    ("1700000000.5", 1700000000),
+    (None, NO_TIMESTAMP),
+    ("", NO_TIMESTAMP),
+    (float("nan"), NO_TIMESTAMP),
+])
+def test_parse_timestamp(value, expected):
+    assert parse_timestamp(value) == expected
+
+
+@pytest.mark.parametrize("value", ["yesterday", "inf", float("inf"), object()])
+def test_unparseable_timestamp_raises(value):
+    with pytest.raises(ValueError):
+        parse_timestamp(value)
+
+
+def test_builder_keeps_float_and_negative_timestamps():
+    b = CompactGraphBuilder()
+    for i, ts in enumerate(["1700000000.5", "-3", "", "7"]):
+        b.add_row("p", "proc", "process", f"f{i}", "file", "file", "open", ts, "benign")
+    G = b.build()
+    assert G.edge_timestamp.tolist() == [1700000000, -3, NO_TIMESTAMP, 7]
+    with pytest.raises(ValueError):
+        b.add_row("p", "proc", "process", "f9", "file", "file", "open", "noon", "benign")
+
+
+def test_from_networkx_keeps_numpy_timestamps():
+    G = nx.MultiDiGraph()
+    G.add_node("a", label="a", type="process")
+    G.add_node("b", label="b", type="file")
+    G.add_edge("a", "b", relation="open", timestamp=np.int64(99), label="benign")
+    assert CompactProvenanceGraph.from_networkx(G).edge_timestamp.tolist() == [99]
@@ -0,0 +1,82 @@
+import os
+import sys
+import random
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "utils"))
+from graph_store import CompactGraphBuilder
+from provenance_trace import trace_backward, trace_forward, trace_to_networkx
+
+
+def build(edges):
+    """edges: [(src, dst, timestamp or None)]"""
+    b = CompactGraphBuilder()
+    for u, v, t in edges:
+        b.add_row(u, u, "process", v, v, "file", "write", "" if t is None else str(t), "benign")
+    return b.build()
+
+
+def brute_force(edges, poi, backward, max_hops):
+    """逐層 BFS 所有 (節點, 時間界線) 狀態，回傳 {邊序號: 最短 hops}"""
+    inf = float("inf")
+    frontier = {(poi, inf if backward else -inf)}
+    seen = set(frontier)
+    best = {}
+    hops = 0
+    while frontier and (max_hops is None or hops < max_hops):
+        nxt = set()
+        for node, bound in frontier:
+            for e, (u, v, t) in enumerate(edges):
+                if (v if backward else u) != node or t is None:
+                    continue
+                if (t <= bound) if backward else (t >= bound):
+                    best.setdefault(e, hops + 1)
+                    state = (u if backward else v, t)
+                    if state not in seen:
+                        seen.add(state)
+                        nxt.add(state)
+        frontier = nxt
+        hops += 1
+    return best
+
+
+def test_forward_hops_are_shortest():
+    G = build([("p", "a", 1), ("a", "b", 2), ("p", "b", 5), ("b", "c", 6)])
+    hops = {(s.source, s.target): s.hops for s in trace_forward(G, "p")}
+    assert hops == {("p", "a"): 1, ("p", "b"): 1, ("a", "b"): 2, ("b", "c"): 2}
+
+
+@pytest.mark.parametrize("backward", [False, True])
+def test_matches_brute_force(backward):
+    rng = random.Random(7)
+    for _ in range(300):
+        nodes = [f"n{i}" for i in range(rng.randint(2, 6))]
+        edges = [(rng.choice(nodes), rng.choice(nodes), rng.randint(0, 8))
+                 for _ in range(rng.randint(1, 12))]
+        poi = rng.choice([u for e in edges for u in e[:2]])
+        max_hops = rng.choice([None, 1, 2, 3])
+        trace = trace_backward if backward else trace_forward
+        steps = list(trace(build(edges), poi, max_hops=max_hops))
+        assert {s.edge: s.hops for s in steps} == brute_force(edges, poi, backward, max_hops)
+        assert [s.hops for s in steps] == sorted(s.hops for s in steps)
+
+
+def test_backward_respects_time_order():
+    G = build([("x", "y", 10), ("y", "z", 5), ("w", "y", 1)])
+    assert {(s.source, s.target) for s in trace_backward(G, "z")} == {("y", "z"), ("w", "y")}
+
+
+def test_time_window_without_reference_time_raises():
+    G = build([("p", "a", None), ("a", "b", 3)])
+    with pytest.raises(ValueError):
+        list(trace_forward(G, "p", time_window=10))
+    assert [s.target for s in trace_forward(G, "p", time_window=10, since=0, include_untimed=True)] == ["a", "b"]
+
+
+def test_trace_to_networkx_node_hops():
+    G = build([("p", "a", 1), ("a", "b", 2), ("p", "b", 5), ("b", "c", 6)])
+    H = trace_to_networkx(G, trace_forward(G, "p"))
+    assert dict(H.nodes(data="hops")) == {"p": 0, "a": 1, "b": 1, "c": 2}
+    H = trace_to_networkx(G, trace_backward(G, "c"))
+    assert dict(H.nodes(data="hops")) == {"c": 0, "b": 1, "p": 2, "a": 2}
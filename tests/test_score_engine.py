@@ -0,0 +1,19 @@
+import os
+import sys
+import warnings
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "utils"))
+from graph_store import CompactGraphBuilder
+from score_engine import compute_scores
+
+
+def test_decay_degree_ignores_untimed_edges_without_overflow():
+    b = CompactGraphBuilder()
+    for i, ts in enumerate(["100", "", "3700", ""]):
+        b.add_row("p", "proc", "process", f"f{i}", "file", "file", "open", ts, "benign")
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        scores = compute_scores(b.build(), ["decay_degree"], {"decay_degree": {"half_life": 3600}})
+    np.testing.assert_allclose(scores["decay_degree"], [1.5, 0.5, 0.0, 1.0, 0.0])
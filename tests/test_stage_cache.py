@@ -0,0 +1,63 @@
+import os
+import sys
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "utils"))
+from stage_cache import StageCache
+from campaign_to_txt import convert_json_to_txt
+from pipeline import run_full_pipeline
+
+
+def write_campaign(path, n_events, seed):
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n_events):
+            f.write(json.dumps({
+                "srcNode": {"UUID": f"p{seed}", "Type": "Process", "Cmdline": f"proc{seed}.exe"},
+                "dstNode": {"UUID": f"f{seed}-{i}", "Type": "File", "Name": f"C:\\f{i}.txt"},
+                "relation": "WRITE", "timestamp": 1700000000 + i,
+                "label": "T1059" if i == 0 else "benign",
+            }) + "\n")
+
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def test_in_place_rewrite_does_not_change_cache(tmp_path):
+    cache = StageCache(str(tmp_path / "cache"))
+    out = str(tmp_path / "out.txt")
+
+    def produce():
+        with open(out, "w") as f:
+            f.write("original")
+
+    assert not cache.run("s", "k" * 64, out, produce)["cached"]
+    with open(out, "w") as f:        # 其他寫入端就地覆寫同一個路徑
+        f.write("rewritten")
+    assert cache.run("s", "k" * 64, out, produce)["cached"]
+    assert read(out) == b"original"
+
+    with open(out, "w") as f:        # 命中後放回的檔案同樣不可與快取共用
+        f.write("rewritten again")
+    assert cache.run("s", "k" * 64, out, produce)["cached"]
+    assert read(out) == b"original"
+
+
+def test_pipeline_rerun_after_external_rewrite(tmp_path):
+    c1, c2 = str(tmp_path / "c1.json"), str(tmp_path / "c2.json")
+    write_campaign(c1, 5, 1)
+    write_campaign(c2, 7, 2)
+    out = str(tmp_path / "out")
+    cache_dir = str(tmp_path / "cache")
+
+    run_full_pipeline(c1, out, fileName="f", cacheDir=cache_dir)
+    txt = os.path.join(out, "txt", "f.txt")
+    expected = read(txt)
+    convert_json_to_txt(c2, txt)
+    assert read(txt) != expected
+
+    run_full_pipeline(c1, out, fileName="f", cacheDir=cache_dir)
+    assert read(txt) == expected
+    with open(os.path.join(out, "fmanifest.json"), encoding="utf-8") as f:
+        assert all(stage["cached"] for stage in json.load(f)["stages"])
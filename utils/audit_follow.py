@@ -0,0 +1,270 @@
+import os
+import json
+import time
+import pickle
+from collections import deque
+
+import networkx as nx
+
+from campaign_to_txt import event_to_row
+from process_audit_log import AuditEventAssembler, iter_audit_records, process_event_group
+from graph_reduction import StreamReducer
+
+# Key in G.graph under which a checkpoint stores its resume point (file offset
+# and the assembler's in-flight events); removed again when the graph is loaded
+RESUME_KEY = 'follow_resume'
+
+
+def tail_lines(path: str, poll_interval: float = 0.5, offset: int = 0,
+               idle_callback=None, stop=None):
+    """
+    Follows a growing file like `tail -F` and yields (line, offset, read_time)
+    for every complete line. `offset` is the byte position after the line, so
+    it can be stored and used to resume.
+
+    Truncation restarts from the beginning of the file; rotation (a new inode
+    at `path`) drains the old file and then switches to the new one.
+    `idle_callback` is called after every poll that produced no new data, and
+    the generator stops once `stop()` returns True.
+    """
+    f = None
+    inode = None
+    partial = b''
+    while stop is None or not stop():
+        if f is None:
+            try:
+                f = open(path, 'rb')
+            except FileNotFoundError:
+                time.sleep(poll_interval)
+                continue
+            inode = os.fstat(f.fileno()).st_ino
+            if offset > os.fstat(f.fileno()).st_size:
+                offset = 0
+            f.seek(offset)
+            partial = b''
+
+        chunk = f.read(1 << 16)
+        if chunk:
+            now = time.monotonic()
+            data = partial + chunk
+            lines = data.split(b'\n')
+            partial = lines.pop()
+            for raw in lines:
+                offset += len(raw) + 1
+                yield raw.decode('utf-8', errors='replace') + '\n', offset, now
+            continue
+
+        # No new data: detect truncation / rotation, then wait
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            st = None
+        if st is not None and st.st_ino != inode:
+            f.close()
+            f, offset = None, 0
+            continue
+        if st is not None and st.st_size < offset + len(partial):
+            f.seek(0)
+            offset, partial = 0, b''
+            continue
+        if idle_callback is not None:
+            idle_callback()
+        time.sleep(poll_interval)
+
+    if f is not None:
+        f.close()
+
+
+class LatencyStats:
+    """
+    Keeps the most recent `window` latency samples (seconds) and reports
+    percentiles over them.
+    """
+
+    def __init__(self, window: int = 10000):
+        self.samples = deque(maxlen=window)
+        self.count = 0
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+        self.count += 1
+
+    def summary(self) -> dict:
+        if not self.samples:
+            return {'count': self.count}
+        s = sorted(self.samples)
+
+        def pct(p):
+            return s[min(len(s) - 1, int(p * len(s)))]
+
+        return {
+            'count': self.count,
+            'p50_ms': pct(0.50) * 1000,
+            'p95_ms': pct(0.95) * 1000,
+            'p99_ms': pct(0.99) * 1000,
+            'max_ms': s[-1] * 1000,
+        }
+
+
+class IncrementalProvenanceGraph:
+    """
+    In-memory provenance graph that is updated one event at a time with the
+    same node/edge attributes as build_provenance_graph.
+    """
+
+    def __init__(self, G: nx.MultiDiGraph = None):
+        self.G = G if G is not None else nx.MultiDiGraph()
+
+    def add_event(self, event: dict) -> bool:
+        """
+        Adds an event (as produced by process_event_group). Returns True if
+        an edge was added.
+        """
+        if not event or not event.get('srcNode'):
+            return False
+        src_uuid, src_label, src_type, dst_uuid, dst_label, dst_type, relation, timestamp, label = event_to_row(event)
+        G = self.G
+        if not G.has_node(src_uuid):
+            G.add_node(src_uuid, label=src_label, type=src_type)
+        if dst_uuid is None:
+            return False
+        if not G.has_node(dst_uuid):
+            G.add_node(dst_uuid, label=dst_label, type=dst_type)
+        G.add_edge(src_uuid, dst_uuid, relation=relation, timestamp=timestamp, label=label)
+        return True
+
+    def checkpoint(self, pkl_path: str, state: dict = None, resume_state: dict = None):
+        """
+        Atomically writes the graph pickle, plus a `<pkl_path>.state.json`
+        sidecar (file offset, counters, latency) for monitoring.
+
+        `resume_state` is pickled together with the graph (in G.graph), so the
+        edges and the offset they were read up to are always written as one.
+        """
+        tmp = pkl_path + '.tmp'
+        if resume_state is not None:
+            self.G.graph[RESUME_KEY] = resume_state
+        try:
+            with open(tmp, 'wb') as f:
+                pickle.dump(self.G, f)
+        finally:
+            self.G.graph.pop(RESUME_KEY, None)
+        os.replace(tmp, pkl_path)
+        if state is not None:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(state, f, indent=2)
+            os.replace(tmp, pkl_path + '.state.json')
+
+
+def follow_audit_log(
+    input_path: str,
+    pkl_path: str,
+    checkpoint_interval: float = 10.0,
+    poll_interval: float = 0.5,
+    idle_flush: float = 2.0,
+    resume: bool = True,
+    stop=None,
+    reduce: str = None,
+    **assembler_kwargs
+) -> IncrementalProvenanceGraph:
+    """
+    Tails a growing audit.log and keeps an in-memory provenance graph up to
+    date. The graph is checkpointed to `pkl_path` every `checkpoint_interval`
+    seconds, so detection stages can load near-real-time data.
+
+    Pending events are flushed after `idle_flush` seconds without new lines.
+    End-to-end latency (first record line read -> edge in graph) is tracked
+    and reported at every checkpoint.
+
+    With `resume=True`, an existing checkpoint is reused together with the
+    file offset it was read up to and the events that were still being
+    assembled at that point, so nothing is parsed or applied twice after a
+    restart.
+
+    With `reduce='cpr'` or `'fd'`, redundant edges are dropped before they
+    reach the graph (see graph_reduction.StreamReducer). The reducer state is
+    not checkpointed, so after a resume the reduction starts fresh (it can only
+    keep more edges, never drop a needed one).
+    """
+    state_path = pkl_path + '.state.json'
+    graph = IncrementalProvenanceGraph()
+    assembler = AuditEventAssembler(**assembler_kwargs)
+    offset = 0
+    if resume and os.path.exists(pkl_path) and os.path.exists(state_path):
+        with open(pkl_path, 'rb') as f:
+            graph = IncrementalProvenanceGraph(pickle.load(f))
+        saved = graph.G.graph.pop(RESUME_KEY, None)
+        if saved is not None:
+            offset = saved['offset']
+            assembler.set_state(saved['assembler'])
+        else:
+            # Checkpoints written before the resume state moved into the pickle
+            with open(state_path, 'r', encoding='utf-8') as f:
+                offset = json.load(f).get('offset', 0)
+        print(f"Resuming from {pkl_path} at byte {offset}")
+
+    reducer = StreamReducer(reduce) if reduce else None
+    latency = LatencyStats()
+    first_seen = {}              # msg_id -> monotonic time its group was opened
+    counters = {'lines': 0, 'events': 0, 'edges': 0, 'reduced': 0}
+    last_line = [time.monotonic()]
+    last_checkpoint = time.monotonic()
+    read_pos = [offset]          # offset after the last line read
+
+    def apply(groups):
+        now = time.monotonic()
+        for group in groups:
+            counters['events'] += 1
+            event = process_event_group(group)
+            if reducer and event and event.get('srcNode') and not reducer.keep_row(event_to_row(event)):
+                counters['reduced'] += 1
+            elif graph.add_event(event):
+                counters['edges'] += 1
+            t0 = first_seen.pop(group['msg_id'], None)
+            if t0 is not None:
+                latency.add(now - t0)
+
+    def state():
+        return {'input': input_path, 'offset': read_pos[0], **counters,
+                'latency': latency.summary()}
+
+    saved_events = [-1]
+
+    def save():
+        saved_events[0] = counters['events']
+        graph.checkpoint(pkl_path, state(),
+                         {'offset': read_pos[0], 'assembler': assembler.get_state()})
+        lat = latency.summary()
+        print(f"Checkpoint {pkl_path}: {graph.G.number_of_nodes()} nodes, "
+              f"{graph.G.number_of_edges()} edges, latency p50={lat.get('p50_ms', 0):.1f}ms "
+              f"p95={lat.get('p95_ms', 0):.1f}ms")
+
+    def on_idle():
+        nonlocal last_checkpoint
+        if assembler.pending and time.monotonic() - last_line[0] >= idle_flush:
+            apply(assembler.flush())
+        if (time.monotonic() - last_checkpoint >= checkpoint_interval
+                and counters['events'] != saved_events[0]):
+            save()
+            last_checkpoint = time.monotonic()
+
+    try:
+        for line, pos, read_time in tail_lines(input_path, poll_interval, offset, on_idle, stop):
+            counters['lines'] += 1
+            last_line[0] = read_time
+            read_pos[0] = pos
+            for msg_type, msg_id, data_str in iter_audit_records((line,)):
+                # Records of an already closed event open no group and are
+                # never applied, so they must not leave an entry behind
+                if assembler.opens_group(msg_type, msg_id):
+                    first_seen.setdefault(msg_id, read_time)
+                apply(assembler.add(msg_type, msg_id, data_str))
+            if time.monotonic() - last_checkpoint >= checkpoint_interval:
+                save()
+                last_checkpoint = time.monotonic()
+    except KeyboardInterrupt:
+        pass
+
+    apply(assembler.flush())
+    save()
+    return graph
@@ -0,0 +1,182 @@
+# utils/batch_ingest.py
+
+import os
+import glob
+import json
+import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+from campaign_to_txt import event_to_row, write_tsv_rows
+from process_audit_log import parse_audit_log, convert_events_to_tsv
+
+# 注意：Windows 使用 spawn 啟動子行程，呼叫端必須放在 if __name__ == "__main__": 之下
+
+
+def shard_byte_ranges(input_path: str, n_shards: int) -> list:
+    """
+    把 newline-delimited 檔案切成 n_shards 個位元組區間 [start, end)。
+    每個邊界都往後對齊到下一個換行，保證每一行完整落在某一個 shard 內。
+    """
+    size = os.path.getsize(input_path)
+    n_shards = max(1, min(n_shards, size or 1))
+    bounds = [0]
+    with open(input_path, "rb") as f:
+        for k in range(1, n_shards):
+            offset = size * k // n_shards
+            if offset <= bounds[-1]:
+                continue
+            f.seek(offset - 1)
+            f.readline()              # 跳到 offset 之後（含）的第一個行首
+            pos = f.tell()
+            if pos >= size:
+                break
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    bounds.append(size)
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+
+def _iter_range_rows(input_path: str, start: int, end: int):
+    with open(input_path, "rb") as f:
+        f.seek(start)
+        pos = start
+        while pos < end:
+            line = f.readline()
+            if not line:
+                break
+            pos += len(line)
+            yield event_to_row(json.loads(line))
+
+
+def _convert_range(args) -> int:
+    input_path, start, end, part_path, chunk_size = args
+    with open(part_path, "w", encoding="utf-8", newline="") as out:
+        return write_tsv_rows(_iter_range_rows(input_path, start, end), out, chunk_size)
+
+
+def _merge_parts(part_paths: list, output_path: str):
+    """依 shard 順序串接各分段輸出，結果與單執行緒版逐位元組相同"""
+    with open(output_path, "wb") as out:
+        for part in part_paths:
+            with open(part, "rb") as f:
+                shutil.copyfileobj(f, out, 1 << 20)
+            os.remove(part)
+
+
+def convert_json_to_txt_sharded(
+    input_path: str,
+    output_path: str,
+    workers: int = None,
+    shards: int = None,
+    chunk_size: int = 10000
+) -> int:
+    """
+    把單一大型 JSON 檔依位元組區間切片，交給 process pool 平行轉成 TSV，
+    再依 shard 順序合併。回傳總列數。
+    """
+    workers = workers or os.cpu_count() or 1
+    ranges = shard_byte_ranges(input_path, shards or workers)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    parts = [f"{output_path}.part{i:04d}" for i in range(len(ranges))]
+    tasks = [(input_path, s, e, p, chunk_size) for (s, e), p in zip(ranges, parts)]
+
+    if workers == 1 or len(tasks) == 1:
+        counts = [_convert_range(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            counts = list(pool.map(_convert_range, tasks))
+
+    _merge_parts(parts, output_path)
+    total = sum(counts)
+    print(f"✅ Converted to txt ({len(ranges)} shards, {total} rows): {output_path}")
+    return total
+
+
+def _txt_name(input_path: str) -> str:
+    return os.path.splitext(os.path.basename(input_path))[0] + ".txt"
+
+
+def convert_campaign_files(
+    input_paths: list,
+    output_dir: str,
+    workers: int = None,
+    shards_per_file: int = 1,
+    chunk_size: int = 10000
+) -> list:
+    """
+    平行轉換多個 campaign JSON（例如 pathSAGAM1..M10）。
+    所有檔案的所有 shard 一起排進同一個 process pool，大檔與小檔可以互相填補。
+    回傳輸出 TSV 路徑，順序與 input_paths 相同。
+    """
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+
+    outputs, plan, tasks = [], [], []
+    for input_path in input_paths:
+        out_path = os.path.join(output_dir, _txt_name(input_path))
+        ranges = shard_byte_ranges(input_path, shards_per_file)
+        parts = [f"{out_path}.part{i:04d}" for i in range(len(ranges))]
+        tasks.extend((input_path, s, e, p, chunk_size) for (s, e), p in zip(ranges, parts))
+        outputs.append(out_path)
+        plan.append(parts)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(_convert_range, tasks))
+
+    for parts, out_path in zip(plan, outputs):
+        _merge_parts(parts, out_path)
+        print(f"✅ Converted to txt: {out_path}")
+    return outputs
+
+
+def _parse_audit_file(args) -> str:
+    input_path, output_path = args
+    convert_events_to_tsv(parse_audit_log(input_path), output_path)
+    return output_path
+
+
+def parse_audit_logs(input_paths: list, output_dir: str, workers: int = None) -> list:
+    """
+    平行解析多個 Linux audit log 成 TSV（以檔案為單位）。
+    audit 事件由多行 record 組成，切 byte-range 可能把同一事件拆到兩個 shard，
+    所以 audit log 只做檔案層級的平行化。
+    """
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    tasks = [(p, os.path.join(output_dir, _txt_name(p))) for p in input_paths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_parse_audit_file, tasks))
+
+
+def ingest_directory(
+    input_dir: str,
+    output_dir: str,
+    pattern: str = "*.json",
+    kind: str = "campaign",
+    workers: int = None,
+    shards_per_file: int = 1
+) -> list:
+    """
+    掃描資料夾（依檔名排序，確保順序固定）並批次轉成 TSV。
+      - kind='campaign': newline-delimited JSON
+      - kind='audit':    Linux audit log
+    """
+    input_paths = sorted(glob.glob(os.path.join(input_dir, pattern)))
+    if kind == "audit":
+        return parse_audit_logs(input_paths, output_dir, workers)
+    return convert_campaign_files(input_paths, output_dir, workers, shards_per_file)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Batch-convert campaign JSON / audit logs to TSV in parallel.")
+    parser.add_argument("input_dir", help="Directory containing the input files.")
+    parser.add_argument("output_dir", help="Directory for the output TSV files.")
+    parser.add_argument("--pattern", default="*.json", help="Glob pattern for input files.")
+    parser.add_argument("--kind", choices=["campaign", "audit"], default="campaign")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Number of worker processes.")
+    parser.add_argument("-s", "--shards", type=int, default=1, help="Byte-range shards per campaign file.")
+    args = parser.parse_args()
+
+    ingest_directory(args.input_dir, args.output_dir, args.pattern, args.kind,
+                     args.workers, args.shards)
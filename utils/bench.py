@@ -0,0 +1,347 @@
+# utils/bench.py
+"""
+效能基準測試（合成資料，不需要真實 campaign）。
+
+用法：
+    python bench.py audit --events 50000
+    python bench.py scores --edges 2000000
+    python bench.py reduce --edges 1000000
+    python bench.py export --edges 500000
+    python bench.py labels --nodes 500000
+    python bench.py iforest --rows 1000000 --dim 32
+"""
+
+import os
+import time
+import shlex
+import random
+import argparse
+import tempfile
+
+
+def _timeit(fn, *args, repeat: int = 3):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+# --------------------------------------------------------------------------------
+# audit log tokenizer
+
+def make_synthetic_audit_log(path: str, n_events: int, seed: int = 42) -> int:
+    """寫出 n_events 個 auditd 事件（SYSCALL/CWD/PATH/PROCTITLE/EOE），回傳行數"""
+    rng = random.Random(seed)
+    exes = ["/usr/bin/ls", "/usr/bin/cat", "/usr/bin/bash", "/usr/sbin/sshd", "/tmp/dropper"]
+    n_lines = 0
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n_events):
+            ts = f"{1700000000 + i // 10}.{i % 1000:03d}:{i + 1}"
+            exe = rng.choice(exes)
+            pid = rng.randint(100, 60000)
+            name = rng.choice(["/etc/passwd", "/tmp/x y.sh", "/var/log/syslog"])
+            # 含空白的路徑 auditd 會以 hex 編碼且不加引號
+            name_field = name.encode().hex().upper() if " " in name else f'"{name}"'
+            f.write(f'type=SYSCALL msg=audit({ts}): arch=c000003e syscall={rng.choice([2, 59, 257])} '
+                    f'success=yes exit=3 a0=7ffd a1=0 a2=1b6 a3=0 items=1 ppid={pid - 1} pid={pid} '
+                    f'auid=1000 uid=0 gid=0 euid=0 suid=0 fsuid=0 egid=0 sgid=0 fsgid=0 tty=pts0 '
+                    f'ses=1 comm="{os.path.basename(exe)}" exe="{exe}" key="T1059"\n')
+            f.write(f'type=CWD msg=audit({ts}): cwd="/root"\n')
+            f.write(f'type=PATH msg=audit({ts}): item=0 name={name_field} inode={rng.randint(1, 10**6)} '
+                    f'dev=08:01 mode=0100644 ouid=0 ogid=0 rdev=00:00 nametype=NORMAL cap_fp=0 cap_fi=0\n')
+            f.write(f'type=PROCTITLE msg=audit({ts}): proctitle={"bash -c id".encode().hex().upper()}\n')
+            f.write(f'type=EOE msg=audit({ts}): \n')
+            n_lines += 5
+    return n_lines
+
+
+def _legacy_tokenize(lines):
+    """舊版作法：每個 data string shlex.split，SYSCALL 與 PATH 再各切一次"""
+    from process_audit_log import AUDIT_MSG_REGEX
+    n = 0
+    for line in lines:
+        match = AUDIT_MSG_REGEX.match(line)
+        if not match:
+            continue
+        msg_type, _, data_str = match.groups()
+        passes = 2 if ('syscall=' in data_str or (' name=' in data_str and 'nametype=' in data_str)) else 1
+        for _ in range(passes):
+            try:
+                parsed = {p.split('=', 1)[0]: p.split('=', 1)[1].strip('"')
+                          for p in shlex.split(data_str) if '=' in p}
+            except ValueError:
+                parsed = {}
+            n += len(parsed)
+    return n
+
+
+def _fast_tokenize(lines):
+    from process_audit_log import AUDIT_MSG_REGEX, parse_audit_record
+    n = 0
+    for line in lines:
+        match = AUDIT_MSG_REGEX.match(line)
+        if not match:
+            continue
+        msg_type, _, data_str = match.groups()
+        n += len(parse_audit_record(data_str, msg_type))
+    return n
+
+
+def _count_events(path):
+    from process_audit_log import parse_audit_log
+    return sum(1 for e in parse_audit_log(path) if e)
+
+
+def bench_audit(n_events: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "audit.log")
+        n_lines = make_synthetic_audit_log(path, n_events)
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+
+        t_old, _ = _timeit(_legacy_tokenize, lines)
+        t_new, _ = _timeit(_fast_tokenize, lines)
+        t_parse, n_ev = _timeit(_count_events, path, repeat=1)
+
+    print(f"synthetic audit log: {n_events} events, {n_lines} lines")
+    print(f"  shlex tokenizer : {n_lines / t_old:>12,.0f} lines/s")
+    print(f"  record parser   : {n_lines / t_new:>12,.0f} lines/s  ({t_old / t_new:.1f}x)")
+    print(f"  parse_audit_log : {n_lines / t_parse:>12,.0f} lines/s  ({n_ev} events)")
+
+
+# --------------------------------------------------------------------------------
+# node scoring
+
+def make_synthetic_graph(n_nodes: int, n_edges: int, attack_ratio: float = 0.01, seed: int = 42):
+    """直接以亂數陣列組出 CompactProvenanceGraph（不經過 TSV）"""
+    import numpy as np
+    from graph_store import CompactProvenanceGraph, StringTable
+
+    rng = np.random.default_rng(seed)
+    # 度數呈長尾分布，接近真實 provenance graph
+    src = (rng.zipf(1.5, n_edges) % n_nodes).astype(np.int32)
+    dst = rng.integers(0, n_nodes, n_edges, dtype=np.int32)
+    return CompactProvenanceGraph(
+        node_ids=StringTable(f"node-{i}" for i in range(n_nodes)),
+        node_label=(np.arange(n_nodes) % 1000).astype(np.int32),
+        node_type=(np.arange(n_nodes) % 4).astype(np.int32),
+        labels=StringTable(f"label-{i}" for i in range(1000)),
+        types=StringTable(["process", "file", "registry", "network"]),
+        edge_src=src,
+        edge_dst=dst,
+        edge_relation=rng.integers(0, 8, n_edges, dtype=np.int32),
+        edge_label=(rng.random(n_edges) < attack_ratio).astype(np.int32),
+        edge_timestamp=np.sort(rng.integers(1_700_000_000, 1_700_100_000, n_edges)),
+        relations=StringTable(f"rel-{i}" for i in range(8)),
+        edge_labels=StringTable(["benign", "T1059.001_attack"]),
+    )
+
+
+def _legacy_node_scores(G):
+    """舊版 compute_node_scores 的逐節點迴圈（nx.MultiDiGraph）"""
+    import pandas as pd
+    node_info = []
+    max_base_score = 0
+    for node in G.nodes():
+        indeg = G.in_degree(node)
+        outdeg = G.out_degree(node)
+        base_score = indeg + outdeg
+        max_base_score = max(max_base_score, base_score)
+        has_attack = any(
+            d.get("label", "").lower() != "benign" for _, _, d in G.in_edges(node, data=True)
+        ) or any(
+            d.get("label", "").lower() != "benign" for _, _, d in G.out_edges(node, data=True)
+        )
+        node_info.append((node, indeg, outdeg, base_score, has_attack))
+    max_base_score = max_base_score or 1
+    return pd.DataFrame([{
+        "node_uuid": node,
+        "node_label": G.nodes[node].get("label", "Unknown"),
+        "node_type": G.nodes[node].get("type", "Unknown"),
+        "indegree": indeg,
+        "outdegree": outdeg,
+        "base_score": base,
+        "final_score": base / max_base_score + 1 if att else base / max_base_score,
+    } for node, indeg, outdeg, base, att in node_info])
+
+
+def bench_scores(n_edges: int, n_nodes: int, legacy: bool):
+    from node_score import score_nodes
+
+    C = make_synthetic_graph(n_nodes, n_edges)
+    print(f"synthetic graph: {n_nodes} nodes, {n_edges} edges")
+    t_vec, df_vec = _timeit(score_nodes, C)
+    print(f"  vectorized (compact) : {t_vec:8.3f} s")
+
+    if legacy:
+        G = C.to_networkx()
+        t_nxvec, df_nxvec = _timeit(score_nodes, G, repeat=1)
+        t_old, df_old = _timeit(_legacy_node_scores, G, repeat=1)
+        print(f"  vectorized (networkx): {t_nxvec:8.3f} s")
+        print(f"  legacy loop          : {t_old:8.3f} s  ({t_old / t_vec:.0f}x slower than compact)")
+        same = df_old.to_csv(index=False) == df_vec.to_csv(index=False) == df_nxvec.to_csv(index=False)
+        print(f"  identical CSV        : {same}")
+
+
+# --------------------------------------------------------------------------------
+# CPR / FD graph reduction
+
+def bench_reduce(n_edges: int, n_nodes: int):
+    import numpy as np
+    from graph_reduction import cpr_groups, fd_keep
+
+    C = make_synthetic_graph(n_nodes, n_edges)
+    src = np.asarray(C.edge_src, dtype=np.int64)
+    dst = np.asarray(C.edge_dst, dtype=np.int64)
+    rel = np.asarray(C.edge_relation, dtype=np.int64)
+    print(f"synthetic graph: {n_nodes} nodes, {n_edges} edges (time-ordered)")
+    t_cpr, group = _timeit(cpr_groups, src, dst, rel, repeat=1)
+    t_fd, keep = _timeit(fd_keep, src, dst, repeat=1)
+    print(f"  CPR : {t_cpr:8.3f} s  ratio {(group.max(initial=-1) + 1) / max(n_edges, 1):.3f}")
+    print(f"  FD  : {t_fd:8.3f} s  ratio {keep.sum() / max(n_edges, 1):.3f}")
+
+
+# --------------------------------------------------------------------------------
+# Cytoscape JSON export
+
+def _legacy_export(G, path):
+    """舊版 export_cytoscape_json：先組出整份串列再 json.dump(indent=2)"""
+    import json
+    from generate_graph import cytoscape_node_data, cytoscape_edge_data
+    cy_data = {"nodes": [{"data": d} for d in cytoscape_node_data(G)],
+               "edges": [{"data": d} for d in cytoscape_edge_data(G)]}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(cy_data, f, indent=2, ensure_ascii=False)
+
+
+def bench_export(n_edges: int, n_nodes: int):
+    import contextlib
+    from generate_graph import export_cytoscape_json
+
+    G = make_synthetic_graph(n_nodes, n_edges).to_networkx()
+    print(f"synthetic graph: {n_nodes} nodes, {n_edges} edges")
+    variants = [
+        ("legacy json.dump", "legacy.json", None),
+        ("streaming indent=2", "graph.json", {}),
+        ("compact", "compact.json", {"compact": True}),
+        ("compact + gzip", "compact.json.gz", {"compact": True, "compress": "gzip"}),
+        ("columnar", "graph.ndjson", {"encoding": "columnar"}),
+        ("columnar + gzip", "graph.ndjson.gz", {"encoding": "columnar", "compress": "gzip"}),
+        ("columnar + deflate", "graph.ndjson.deflate", {"encoding": "columnar", "compress": "deflate"}),
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, file_name, options in variants:
+            path = os.path.join(tmp, file_name)
+            with contextlib.redirect_stdout(None):
+                if options is None:
+                    t, _ = _timeit(_legacy_export, G, path, repeat=1)
+                else:
+                    t, _ = _timeit(lambda: export_cytoscape_json(G, path, **options), repeat=1)
+            print(f"  {name:20s}: {t:8.3f} s  {os.path.getsize(path) / 1e6:9.2f} MB")
+        same = open(os.path.join(tmp, "legacy.json"), "rb").read() == open(os.path.join(tmp, "graph.json"), "rb").read()
+        print(f"  identical indent=2  : {same}")
+
+
+# --------------------------------------------------------------------------------
+# node label rendering
+
+def make_synthetic_labels(n: int, distinct: int = 2000, seed: int = 42) -> list:
+    """(raw label, shape)：command line 與路徑依 zipf 分布重複出現，接近真實節點"""
+    rng = random.Random(seed)
+    exes = ["powershell.exe", "cmd.exe", "svchost.exe", "rundll32.exe", "python", "bash"]
+    pool = []
+    for i in range(distinct):
+        kind = i % 3
+        if kind == 0:
+            exe = rng.choice(exes)
+            path = f'"C:\\Windows\\System32\\{exe}"' if rng.random() < 0.5 else f"/usr/bin/{exe}"
+            pool.append((f"{path} -arg{i} --flag \"quoted {i}\"", "ellipse"))
+        elif kind == 1:
+            pool.append((f"C:\\Users\\u{i % 50}\\AppData\\file{i}.dat", "rectangle"))
+        else:
+            pool.append((f"HKLM\\Software\\Vendor{i % 20}\\Key{i}", "pentagon"))
+    weights = [1 / (k + 1) for k in range(distinct)]
+    return rng.choices(pool, weights=weights, k=n)
+
+
+def bench_labels(n_nodes: int):
+    from generate_graph import sanitize_label, abbreviate_by_shape, render_label, label_cache_info, clear_label_cache
+
+    labels = make_synthetic_labels(n_nodes)
+    print(f"synthetic labels: {n_nodes} nodes, {len(set(labels))} distinct")
+
+    def uncached():
+        return [(abbreviate_by_shape(sanitize_label(raw), shape), sanitize_label(raw)) for raw, shape in labels]
+
+    def cached():
+        clear_label_cache()
+        return [render_label(raw, shape) for raw, shape in labels]
+
+    t_old, old = _timeit(uncached, repeat=1)
+    t_new, new = _timeit(cached, repeat=1)
+    info = label_cache_info()
+    print(f"  uncached       : {t_old:8.3f} s")
+    print(f"  render_label   : {t_new:8.3f} s  ({t_old / t_new:.1f}x)")
+    print(f"  cache          : {info.hits} hits, {info.misses} misses, {info.currsize}/{info.maxsize} entries")
+    print(f"  identical      : {old == new}")
+
+
+def bench_iforest(n_rows: int, dim: int, n_jobs: int):
+    import numpy as np
+    from isolation_forest import IsolationForest
+
+    rng = np.random.default_rng(42)
+    X = rng.normal(size=(n_rows, dim)).astype(np.float32)
+    n_anomalies = max(n_rows // 1000, 1)
+    X[:n_anomalies] += 4.0      # 前 0.1% 為植入的異常點
+    print(f"synthetic rows: {n_rows} x {dim}, {n_anomalies} planted anomalies")
+
+    t_serial, forest = _timeit(lambda: IsolationForest(seed=0, n_jobs=1).fit(X), repeat=1)
+    t_pool, pooled = _timeit(lambda: IsolationForest(seed=0, n_jobs=n_jobs).fit(X), repeat=1)
+    t_score, scores = _timeit(forest.score_samples, X, repeat=1)
+    flagged = scores >= np.quantile(scores, 1.0 - n_anomalies / n_rows)
+    print(f"  fit (1 process): {t_serial:8.3f} s")
+    print(f"  fit ({n_jobs} procs)  : {t_pool:8.3f} s  (same forest: {np.array_equal(pooled.split_value, forest.split_value)})")
+    print(f"  score_samples  : {t_score:8.3f} s  ({n_rows / t_score:,.0f} rows/s)")
+    print(f"  mean score     : anomalies {scores[:n_anomalies].mean():.3f}, normal {scores[n_anomalies:].mean():.3f}")
+    print(f"  recall@top     : {flagged[:n_anomalies].mean():.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks on synthetic data.")
+    sub = parser.add_subparsers(dest="target", required=True)
+    p_audit = sub.add_parser("audit", help="audit record tokenizer (lines/sec)")
+    p_audit.add_argument("--events", type=int, default=50000)
+    p_scores = sub.add_parser("scores", help="compute_node_scores on a large graph")
+    p_scores.add_argument("--edges", type=int, default=2_000_000)
+    p_scores.add_argument("--nodes", type=int, default=200_000)
+    p_scores.add_argument("--no-legacy", action="store_true", help="skip the (slow) networkx loop")
+    p_reduce = sub.add_parser("reduce", help="CPR / FD reduction on integer edge arrays")
+    p_reduce.add_argument("--edges", type=int, default=1_000_000)
+    p_reduce.add_argument("--nodes", type=int, default=200_000)
+    p_export = sub.add_parser("export", help="Cytoscape JSON export (streaming / compact / columnar)")
+    p_export.add_argument("--edges", type=int, default=500_000)
+    p_export.add_argument("--nodes", type=int, default=100_000)
+    p_labels = sub.add_parser("labels", help="node label sanitize / abbreviation (render_label cache)")
+    p_labels.add_argument("--nodes", type=int, default=500_000)
+    p_iforest = sub.add_parser("iforest", help="vectorized Isolation Forest fit / score throughput")
+    p_iforest.add_argument("--rows", type=int, default=1_000_000)
+    p_iforest.add_argument("--dim", type=int, default=32)
+    p_iforest.add_argument("--jobs", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    if args.target == "audit":
+        bench_audit(args.events)
+    elif args.target == "scores":
+        bench_scores(args.edges, args.nodes, not args.no_legacy)
+    elif args.target == "reduce":
+        bench_reduce(args.edges, args.nodes)
+    elif args.target == "export":
+        bench_export(args.edges, args.nodes)
+    elif args.target == "labels":
+        bench_labels(args.nodes)
+    elif args.target == "iforest":
+        bench_iforest(args.rows, args.dim, args.jobs)
@@ -1,6 +1,17 @@
+import io
+import re
+import csv
 import json
 import pandas as pd
 import os
+from graph_reduction import StreamReducer
+
+# TSV 欄位順序（build_provenance_graph 依此順序拆欄）
+TSV_COLUMNS = [
+    "src_uuid", "src_label", "src_type",
+    "dst_uuid", "dst_label", "dst_type",
+    "relation", "timestamp", "label",
+]
 
 def get_node_label(node_dict: dict) -> str:
     if node_dict is None:
@@ -26,31 +37,97 @@ def get_node_type(node_dict: dict) -> str:
         return None
     return node_dict.get("Type", "Unknown")
 
-def convert_json_to_txt(input_path: str, output_path: str):
-    rows = []
+def event_to_row(event: dict) -> list:
+    """把一筆 JSON 事件轉成 TSV 的一列（順序同 TSV_COLUMNS）"""
+    src_node = event.get("srcNode")
+    dst_node = event.get("dstNode")
+    return [
+        get_node_uuid(src_node),
+        get_node_label(src_node),
+        get_node_type(src_node),
+        get_node_uuid(dst_node),
+        get_node_label(dst_node),
+        get_node_type(dst_node),
+        event.get("relation"),
+        event.get("timestamp"),
+        event.get("label"),
+    ]
+
+def iter_campaign_rows(input_path: str):
+    """逐行讀取 newline-delimited JSON，逐筆產生 TSV 列"""
     with open(input_path, "r", encoding="utf-8") as f:
         for line in f:
-            event = json.loads(line)
-            src_node = event.get("srcNode")
-            dst_node = event.get("dstNode")
-            relation = event.get("relation")
-            timestamp = event.get("timestamp")
-            label = event.get("label")
-
-            row = {
-                "src_uuid": get_node_uuid(src_node),
-                "src_label": get_node_label(src_node),
-                "src_type": get_node_type(src_node),
-                "dst_uuid": get_node_uuid(dst_node),
-                "dst_label": get_node_label(dst_node),
-                "dst_type": get_node_type(dst_node),
-                "relation": relation,
-                "timestamp": timestamp,
-                "label": label
-            }
-            rows.append(row)
-
-    df = pd.DataFrame(rows)
+            yield event_to_row(json.loads(line))
+
+def tsv_writer(f):
+    """與 DataFrame.to_csv(sep="\\t") 相同 dialect 的 csv.writer"""
+    return csv.writer(f, delimiter="\t", quotechar='"',
+                      quoting=csv.QUOTE_MINIMAL, lineterminator=os.linesep)
+
+def write_tsv_rows(rows, f, chunk_size: int = 10000) -> int:
+    """
+    將列分批寫入已開啟的文字檔 f，回傳寫入列數。
+    使用與 DataFrame.to_csv(sep="\\t") 相同的 csv dialect（QUOTE_MINIMAL、
+    os.linesep 換行、None 寫成空字串），所以輸出與 pandas 版逐位元組相同；
+    記憶體只保留 chunk_size 列。
+    """
+    writer = tsv_writer(f)
+    count = 0
+    buf = []
+    for row in rows:
+        buf.append(row)
+        if len(buf) >= chunk_size:
+            writer.writerows(buf)
+            count += len(buf)
+            buf.clear()
+    if buf:
+        writer.writerows(buf)
+        count += len(buf)
+    return count
+
+# 會讓 csv 加引號或斷行的字元
+_TSV_SPECIAL = re.compile(r'[\t"\r\n]')
+
+def iter_tsv_fields(rows):
+    """
+    不經過檔案，產生「寫成 TSV 再由 build_provenance_graph 讀回」時的欄位（全為字串），
+    包含 None -> ""、含引號欄位被 csv 加上的引號、整行 strip() 等行為，
+    所以記憶體內建的圖與檔案流程完全相同。欄位數不是 9 的行同樣會被建圖略過。
+    """
+    for row in rows:
+        fields = ["" if v is None else str(v) for v in row]
+        if any(_TSV_SPECIAL.search(v) for v in fields):
+            buf = io.StringIO()
+            tsv_writer(buf).writerow(row)
+            for line in io.StringIO(buf.getvalue(), newline=None):
+                yield line.strip().split('\t')
+        else:
+            yield "\t".join(fields).strip().split('\t')
+
+def convert_json_to_txt(input_path: str, output_path: str,
+                        stream: bool = True, chunk_size: int = 10000,
+                        reduce: str = None):
+    """
+    JSON -> TSV。
+    stream=True（預設）時邊解析邊分批寫出，尖峰記憶體取決於 chunk_size
+    而非檔案大小；stream=False 保留原本先整批建 DataFrame 的作法。
+    reduce='cpr' 或 'fd' 時在寫出前做串流簡化（見 graph_reduction.StreamReducer），
+    多餘的邊不會進 TSV，後續建圖、計分與輸出的工作量也隨之減少。
+
+    註：若整欄皆為整數但夾雜缺值（例如少數事件沒有 timestamp），pandas 會把
+    該欄轉成 float 而寫出 "123.0"；串流版維持整數寫法，下游 int() 才能解析。
+    """
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    df.to_csv(output_path, sep="\t", index=False, header=False, encoding="utf-8")
+    rows = iter_campaign_rows(input_path)
+    reducer = StreamReducer(reduce) if reduce else None
+    if reducer:
+        rows = reducer.filter_rows(rows)
+    if stream:
+        with open(output_path, "w", encoding="utf-8", newline="") as out:
+            write_tsv_rows(rows, out, chunk_size)
+    else:
+        df = pd.DataFrame(list(rows), columns=TSV_COLUMNS)
+        df.to_csv(output_path, sep="\t", index=False, header=False, encoding="utf-8")
+    if reducer:
+        print(f"✅ {reducer.summary()}")
     print(f"✅ Converted to txt: {output_path}")
@@ -0,0 +1,298 @@
+# utils/embedding_service.py
+"""
+日誌條目的批次語意嵌入：同一批內相同的文字只算一次，依長度排序後以 padded batch
+在 CPU thread pool 上跑模型，向量以 (模型, 文字 sha256) 為 key 存在 sqlite 快取。
+整個 campaign 先以 embed_campaign 一次算完（之後只剩查表），不必每一步對單筆日誌做 forward。
+
+encoder 為可替換的物件，只需提供：
+    name: str                       寫進快取 key，換模型或 pooling 方式時必須不同
+    encode(texts: list) -> ndarray  (len(texts), dim) 的向量，會在多個 thread 同時呼叫
+TransformerEncoder（HF transformers，同 test.py 的 CybersecurityBERT）與
+SentenceTransformerEncoder（同 main.ipynb 的 SecureBERT）為內建實作，皆在建立時才匯入套件。
+"""
+
+import os
+import json
+import sqlite3
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+
+SQLITE_MAX_PARAMS = 500             # 每次 IN (...) 查詢的 key 數（舊版 sqlite 上限 999）
+
+
+def command_path_text(log_entry: dict) -> str:
+    """test.py 原本的格式：只取指令與路徑"""
+    return f"cmd: {log_entry.get('command', 'N/A')} path: {log_entry.get('path', 'N/A')}"
+
+
+def _flatten(value, key: str, out: dict):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            _flatten(v, f"{key}.{k}" if key else str(k), out)
+    else:
+        out[key] = value
+
+
+def _normalize(entry: dict) -> dict:
+    """同 pd.json_normalize 的單筆攤平：先放頂層非巢狀欄位，再依序展開巢狀 dict"""
+    flat = {k: v for k, v in entry.items() if not isinstance(v, dict)}
+    nested = {}
+    _flatten({k: v for k, v in entry.items() if isinstance(v, dict)}, "", nested)
+    flat.update(nested)
+    return flat
+
+
+def flat_entry_text(log_entry: dict) -> str:
+    """
+    main.ipynb extractFeature 的格式：巢狀欄位以 '.' 攤平（同 pd.json_normalize），
+    每個欄位一行 "key:value"，但不必為每筆日誌建一個 DataFrame。
+    """
+    return "".join(f"{k}:{v}\n" for k, v in _normalize(log_entry).items())
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8", "surrogatepass")).digest()
+
+
+class EmbeddingCache:
+    """
+    sqlite 上的向量快取：embeddings(model, key, dim, vec)，vec 為 float32 bytes。
+    path=None 時使用記憶體內資料庫（只在同一個 EmbeddingService 的生命週期內去重）。
+    只在建立它的 thread 上使用；encode 的 worker thread 不碰資料庫。
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        if path and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path or ":memory:")
+        if path:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, key BLOB NOT NULL, dim INTEGER NOT NULL, vec BLOB NOT NULL,"
+            " PRIMARY KEY (model, key)) WITHOUT ROWID"
+        )
+        self.conn.commit()
+
+    def get_many(self, model: str, keys: list) -> dict:
+        """{key: 向量}，沒有快取的 key 不會出現在結果中"""
+        found = {}
+        for i in range(0, len(keys), SQLITE_MAX_PARAMS):
+            chunk = keys[i:i + SQLITE_MAX_PARAMS]
+            rows = self.conn.execute(
+                f"SELECT key, vec FROM embeddings WHERE model = ? AND key IN ({','.join('?' * len(chunk))})",
+                [model, *chunk],
+            )
+            for key, vec in rows:
+                found[key] = np.frombuffer(vec, dtype=np.float32)
+        return found
+
+    def put_many(self, model: str, keys: list, vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        dim = vectors.shape[1]
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO embeddings (model, key, dim, vec) VALUES (?, ?, ?, ?)",
+            ((model, key, dim, vec.tobytes()) for key, vec in zip(keys, vectors)),
+        )
+        self.conn.commit()
+
+    def count(self, model: str = None) -> int:
+        if model is None:
+            return self.conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        return self.conn.execute("SELECT COUNT(*) FROM embeddings WHERE model = ?", (model,)).fetchone()[0]
+
+    def close(self):
+        self.conn.close()
+
+
+class TransformerEncoder:
+    """
+    HF transformers 模型（預設同 test.py 的 CybersecurityBERT），pooling='cls' 取 [CLS] token，
+    'mean' 取 attention mask 內的平均。padded batch 的 [CLS] 向量與逐筆計算相同。
+    fast tokenizer 不能被多個 thread 同時呼叫，tokenize 以 lock 保護，forward 則可並行。
+    torch_threads 設定每個 forward 內部的執行緒數（搭配 EmbeddingService 的 workers，避免超額訂閱）。
+    """
+
+    def __init__(self, model_name: str = "jackaduma/CybersecurityBERT", max_length: int = 128,
+                 pooling: str = "cls", torch_threads: int = None):
+        import torch
+        from transformers import AutoTokenizer, AutoModel
+        if pooling not in ("cls", "mean"):
+            raise ValueError(f"unknown pooling: {pooling!r}")
+        if torch_threads:
+            torch.set_num_threads(torch_threads)
+        self.torch = torch
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        self.model = AutoModel.from_pretrained(model_name).eval()
+        self.max_length = max_length
+        self.pooling = pooling
+        self.name = f"{model_name}|{pooling}|{max_length}"
+        self._tokenizer_lock = threading.Lock()
+
+    def encode(self, texts: list) -> np.ndarray:
+        with self._tokenizer_lock:
+            inputs = self.tokenizer(list(texts), return_tensors="pt", truncation=True,
+                                    max_length=self.max_length, padding=True)
+        with self.torch.inference_mode():
+            hidden = self.model(**inputs).last_hidden_state
+            if self.pooling == "cls":
+                vectors = hidden[:, 0, :]
+            else:
+                mask = inputs["attention_mask"].unsqueeze(-1).to(hidden.dtype)
+                vectors = (hidden * mask).sum(1) / mask.sum(1).clamp(min=1)
+        return vectors.float().numpy()
+
+
+class SentenceTransformerEncoder:
+    """
+    sentence-transformers 模型（預設同 main.ipynb 的 SecureBERT2.0 bi-encoder）。
+    可傳入模型名稱，或已載入的 SentenceTransformer 物件（此時必須給 name 作為快取 key）。
+    """
+
+    def __init__(self, model="cisco-ai/SecureBERT2.0-biencoder", name: str = None):
+        if isinstance(model, str):
+            from sentence_transformers import SentenceTransformer
+            name = name or model
+            model = SentenceTransformer(model, device="cpu")
+        elif name is None:
+            raise ValueError("name is required when passing a loaded model")
+        self.model = model
+        self.name = name
+
+    def encode(self, texts: list) -> np.ndarray:
+        return np.asarray(self.model.encode(list(texts), batch_size=len(texts),
+                                            convert_to_numpy=True, show_progress_bar=False),
+                          dtype=np.float32)
+
+
+class EmbeddingService:
+    """
+    批次嵌入：
+      1. 批內去重（相同文字只保留一份）；
+      2. 查快取，只把沒算過的文字交給 encoder；
+      3. 未命中的文字依長度排序後切成 batch_size 的 batch（同一批長度相近，padding 最少），
+         在 workers 個 thread 上執行 encoder.encode（torch 在運算時釋放 GIL），
+         最多 2 * workers 個 batch 同時在途，算完的 batch 立即寫入快取；
+      4. 依原本的順序組回 (n, dim) 的 float32 矩陣。
+    stats 記錄累計的文字數、去重後數量、快取命中、實際 encode 的數量與 batch 數。
+    """
+
+    def __init__(self, encoder, cache_path: str = None, batch_size: int = 32, workers: int = None):
+        self.encoder = encoder
+        self.cache = EmbeddingCache(cache_path)
+        self.batch_size = batch_size
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.dim = None
+        self.stats = {"texts": 0, "unique": 0, "cache_hits": 0, "encoded": 0, "batches": 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.cache.close()
+
+    def _encode_missing(self, texts: list, keys: list) -> dict:
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        result = {}
+        model = self.encoder.name
+
+        def collect(done):
+            for future in done:
+                batch, vectors = future.result()
+                batch_keys = [keys[i] for i in batch]
+                self.cache.put_many(model, batch_keys, vectors)
+                result.update(zip(batch_keys, np.asarray(vectors, dtype=np.float32)))
+
+        def run(batch):
+            return batch, self.encoder.encode([texts[i] for i in batch])
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = set()
+            for batch in batches:
+                if len(pending) >= 2 * self.workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(pool.submit(run, batch))
+            collect(wait(pending)[0])
+        self.stats["encoded"] += len(texts)
+        self.stats["batches"] += len(batches)
+        return result
+
+    def embed_texts(self, texts) -> np.ndarray:
+        """文字串列 -> (n, dim) float32 矩陣"""
+        texts = list(texts)
+        position = {}                               # 文字 -> 去重後的編號
+        inverse = np.fromiter((position.setdefault(t, len(position)) for t in texts),
+                              dtype=np.int64, count=len(texts))
+        unique = list(position)
+        keys = [text_key(t) for t in unique]
+        vectors = self.cache.get_many(self.encoder.name, keys)
+        self.stats["texts"] += len(texts)
+        self.stats["unique"] += len(unique)
+        self.stats["cache_hits"] += len(vectors)
+
+        missing = [i for i, k in enumerate(keys) if k not in vectors]
+        if missing:
+            vectors.update(self._encode_missing([unique[i] for i in missing], [keys[i] for i in missing]))
+        if not unique:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        matrix = np.stack([vectors[k] for k in keys])
+        self.dim = matrix.shape[1]
+        return matrix[inverse]
+
+    def embed_entries(self, log_entries, text_fn=command_path_text) -> np.ndarray:
+        """日誌條目（dict）串列 -> (n, dim) 矩陣，text_fn 決定送進模型的文字"""
+        return self.embed_texts(text_fn(entry) for entry in log_entries)
+
+    def embed_campaign(self, input_path: str, out_path: str = None, text_fn=flat_entry_text,
+                       chunk_size: int = 100000):
+        """
+        一次算完整個 campaign（newline-delimited JSON）的向量，第 i 列對應第 i 筆日誌。
+        每 chunk_size 筆為一段，跨段的重複文字由快取處理。
+        out_path 為 .npy 時寫成可 np.load(mmap_mode='r') 的檔案並回傳路徑，否則回傳矩陣。
+        """
+        with open(input_path, "r", encoding="utf-8") as f:
+            total = sum(1 for line in f if line.strip())
+
+        out, parts, row = None, [], 0
+        with open(input_path, "r", encoding="utf-8") as f:
+            chunk = []
+            for line in f:
+                if line.strip():
+                    chunk.append(text_fn(json.loads(line)))
+                if len(chunk) >= chunk_size:
+                    out, row = self._store_chunk(chunk, out, out_path, parts, total, row)
+                    chunk = []
+            if chunk or row == 0:
+                out, row = self._store_chunk(chunk, out, out_path, parts, total, row)
+
+        print(f"✅ Embedded {total} log entries from {input_path} "
+              f"({self.stats['encoded']} encoded, {self.stats['cache_hits']} from cache)")
+        if out_path is None:
+            return np.concatenate(parts) if parts else np.zeros((0, self.dim or 0), dtype=np.float32)
+        out.flush()
+        del out
+        return out_path
+
+    def _store_chunk(self, chunk, out, out_path, parts, total, row):
+        vectors = self.embed_texts(chunk)
+        if out_path is None:
+            parts.append(vectors)
+            return out, row + len(vectors)
+        if out is None:
+            if os.path.dirname(out_path):
+                os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            if os.path.lexists(out_path):
+                os.remove(out_path)
+            out = np.lib.format.open_memmap(out_path, mode="w+", dtype=np.float32,
+                                            shape=(total, self.dim or vectors.shape[1]))
+        out[row:row + len(vectors)] = vectors
+        return out, row + len(vectors)
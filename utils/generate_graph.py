@@ -1,24 +1,48 @@
 import os
+import io
+import gzip
+import zlib
 import json
-import pickle
+import numpy as np
 import pandas as pd
 import networkx as nx
+from graph_store import load_graph, as_networkx, as_compact, NO_TIMESTAMP
+from graph_layout import apply_layout, default_layout_cache
 from collections import defaultdict
+from functools import lru_cache
 import shlex
 import re
 
+LABEL_CACHE_SIZE = 1 << 16
+
+_EXE_RE = re.compile(r'\.(exe|com|bat)$', flags=re.IGNORECASE)
+_SHLEX_SPECIAL = re.compile(r"[\"'\\]")
+_SHLEX_WHITESPACE = re.compile(r"[ \t\r\n]+")
+
+
 def shorten_label(text, max_len=40):
     """把文字每 max_len 字元拆行"""
     return '\n'.join(text[i:i + max_len] for i in range(0, len(text), max_len))
 
 
-def sanitize_label(text):
+def sanitize_label(text: str) -> str:
     """轉義特殊字元，保留換行"""
     text = text.replace("\\", "\\\\")
     text = text.replace('"', "'")
     text = text.replace("'", "\\'")
     return text.strip()
 
+
+def _split_command(txt: str) -> list:
+    """shlex.split；沒有引號與反斜線時結果就是依空白切開，不必走 shlex 的逐字元 lexer"""
+    if not _SHLEX_SPECIAL.search(txt):
+        return [tok for tok in _SHLEX_WHITESPACE.split(txt) if tok]
+    try:
+        return shlex.split(txt)
+    except ValueError:
+        return txt.split()
+
+
 def abbreviate_by_shape(raw: str, shape: str) -> str:
     """
     根據節點 shape 做不同的縮寫：
@@ -48,15 +72,12 @@ def abbreviate_by_shape(raw: str, shape: str) -> str:
     # Process (command line or path)
     if shape == "ellipse":
         # 1) 拆 command-line tokens
-        try:
-            tokens = shlex.split(txt)
-        except ValueError:
-            tokens = txt.split()
+        tokens = _split_command(txt)
         # 2) 找第一個看起來像可執行檔的 token
         exe = None
         for tok in tokens:
             t = tok.strip('"')
-            if re.search(r'\.(exe|com|bat)$', t, flags=re.IGNORECASE):
+            if _EXE_RE.search(t):
                 exe = t
                 break
         # 3) fallback：找不到就用第一個 token
@@ -69,98 +90,108 @@ def abbreviate_by_shape(raw: str, shape: str) -> str:
     return txt
 
 
-import os
-import json
-import pickle
-import pandas as pd
-import networkx as nx
-from collections import defaultdict
-import shlex
-import re
-
-def sanitize_label(text: str) -> str:
-    """轉義特殊字元，保留換行"""
-    text = text.replace("\\", "\\\\")
-    text = text.replace('"', "'")
-    text = text.replace("'", "\\'")
-    return text.strip()
-
-def abbreviate_by_shape(raw: str, shape: str) -> str:
+@lru_cache(maxsize=LABEL_CACHE_SIZE)
+def render_label(raw: str, shape: str) -> tuple:
     """
-    根據節點 shape 做不同的縮寫：
-     - pentagon (registry)：\ 切，保留第一跟最後
-     - rectangle (file)：\ 切，保留最後；若只有 C:\，就回傳原本
-     - ellipse (process)：先 shlex.split 取第一個 token，再取 basename
-     - others：不動
+    (縮寫, 完整 label)：sanitize_label 後再 abbreviate_by_shape。
+    同樣的 command line / 路徑在圖中會重複出現上千次，以 (raw, shape) 為 key 做有上限的 LRU 快取，
+    Cytoscape 與 Graphviz 匯出共用。命中率見 label_cache_info()。
     """
-    txt = raw.strip().strip('"')
-    
-    # Registry
-    if shape == "pentagon":
-        parts = txt.split("\\")
-        if len(parts) >= 2:
-            return f"{parts[0]}\\{parts[-1]}"
-        else:
-            return txt
+    safe = sanitize_label(raw)
+    return abbreviate_by_shape(safe, shape), safe
 
-    # File
-    if shape == "rectangle":
-        parts = txt.split("\\")
-        if len(parts) >= 2:
-            return parts[-1]
-        else:
-            return txt
 
-    # Process (command line or path)
-    if shape == "ellipse":
-        # 1) 拆 command-line tokens
-        try:
-            tokens = shlex.split(txt)
-        except ValueError:
-            tokens = txt.split()
-        # 2) 找第一個看起來像可執行檔的 token
-        exe = None
-        for tok in tokens:
-            t = tok.strip('"')
-            if re.search(r'\.(exe|com|bat)$', t, flags=re.IGNORECASE):
-                exe = t
-                break
-        # 3) fallback：找不到就用第一個 token
-        if not exe and tokens:
-            exe = tokens[0].strip('"')
-        # 4) 取 basename
-        return os.path.basename(exe) if exe else txt
+def label_cache_info():
+    """render_label 快取的 hits / misses / maxsize / currsize"""
+    return render_label.cache_info()
 
-    # 其它類型不動
-    return txt
 
-# --------------------------------------------------------------------------------
+def set_label_cache_size(maxsize: int = LABEL_CACHE_SIZE):
+    """調整快取上限（None 為不設上限）；會清空目前的快取"""
+    global render_label
+    render_label = lru_cache(maxsize=maxsize)(render_label.__wrapped__)
 
-def export_cytoscape_json(G: nx.Graph, json_path: str):
-    cy_nodes = []
-    cy_edges = []
 
-    # 節點改寫：sanitize + abbreviate_by_shape
+def clear_label_cache():
+    render_label.cache_clear()
+
+
+def export_graphviz(G: nx.Graph, path: str, layout: str = "dot", rankdir: str = "LR"):
+    """以 pydot 輸出 .png / .svg（節點重編號為 n0, n1, …，label 每 40 字元換行）"""
+    from networkx.drawing.nx_pydot import to_pydot
+    H = nx.MultiDiGraph() if G.is_multigraph() else nx.DiGraph()
+    old2new = {}
+    for idx, (n, d) in enumerate(G.nodes(data=True)):
+        _, safe = render_label(str(d.get("label", n)), d.get("shape"))
+        label = shorten_label(safe)
+        node_id = f"n{idx}"
+        old2new[n] = node_id
+        H.add_node(node_id, label=label, shape=d.get("shape"), fillcolor=d.get("color"), style="filled")
+    for u, v, d in G.edges(data=True):
+        _, rel = render_label(d.get("relation", ""), None)
+        H.add_edge(old2new[u], old2new[v], label=rel)
+    pg = to_pydot(H)
+    pg.set_prog(layout)
+    pg.set_graph_defaults(
+        dpi="300",
+        overlap="false",
+        splines="polyline",
+        concentrate="true",
+        rankdir=rankdir,
+        nodesep="0.3",
+        ranksep="0.5",
+        margin="0.2"
+    )
+    ext = path.lower().rsplit('.', 1)[-1]
+    if ext == "png": pg.write_png(path)
+    elif ext == "svg": pg.write_svg(path, encoding='utf-8')
+    else: raise ValueError("Only support .png or .svg")
+    print(f"✅ Exported graph image to {path}")
+
+
+# --------------------------------------------------------------------------------
+
+def cytoscape_node_data(G: nx.Graph):
+    """
+    逐一產生 Cytoscape 節點的 data（render_label：sanitize + abbreviate_by_shape），略過空 id。
+    節點屬性 cy_data（dict）會附加在 data 後面（例如 LOD 匯出的 cluster 大小）。
+    """
     for n, d in G.nodes(data=True):
         if not n:
             continue
 
-        raw = str(d.get("label", n))
-        safe = sanitize_label(raw)
         shape = d.get("shape", "ellipse")  # pentagon/rectangle/ellipse/…
-        abbr = abbreviate_by_shape(safe, shape)
-
-        cy_nodes.append({
-            "data": {
-                "id": str(n),
-                "label": abbr,
-                "fullLabel": safe,
-                "color": d.get("color", "skyblue"),
-                "shape": shape
-            }
-        })
-
-    # 邊 (不動)
+        abbr, safe = render_label(str(d.get("label", n)), shape)
+
+        node_data = {
+            "id": str(n),
+            "label": abbr,
+            "fullLabel": safe,
+            "color": d.get("color", "skyblue"),
+            "shape": shape
+        }
+        if "cy_data" in d:
+            node_data.update(d["cy_data"])
+        yield node_data
+
+
+def cytoscape_node_positions(G: nx.Graph):
+    """
+    與 cytoscape_node_data 同順序，逐一產生節點的 position（{"x", "y"}，見 graph_layout.apply_layout）
+    或 None（沒有座標）。
+    """
+    for n, d in G.nodes(data=True):
+        if not n:
+            continue
+        position = d.get("position")
+        if position is not None and not isinstance(position, dict):
+            x, y = position
+            position = {"x": x, "y": y}
+        yield position
+
+
+def cytoscape_edge_data(G: nx.Graph):
+    """逐一產生 Cytoscape 邊的 data；攻擊邊的 relation 後面加上 [TTP]，cy_data 同節點"""
     for u, v, d in G.edges(data=True):
         if not u or not v:
             continue
@@ -171,24 +202,324 @@ def export_cytoscape_json(G: nx.Graph, json_path: str):
         edge_data = {"source": str(u), "target": str(v), "label": rel}
         if "timestamp" in d:
             edge_data["timestamp"] = d["timestamp"]
-        cy_edges.append({"data": edge_data})
+        if "cy_data" in d:
+            edge_data.update(d["cy_data"])
+        yield edge_data
+
+
+CY_COLUMNAR_FORMAT = "cytoscape-columnar"
+CY_COLUMNAR_VERSION = 1
+
+_NODE_FIELDS = ("id", "label", "fullLabel", "color", "shape")
+_EDGE_FIELDS = ("source", "target", "label", "timestamp")
+
+_json_scalar = json.JSONEncoder(ensure_ascii=False).encode
+_json_compact = json.JSONEncoder(ensure_ascii=False, separators=(",", ":")).encode
+
+
+class _DeflateWriter(io.RawIOBase):
+    """zlib 格式（HTTP Content-Encoding: deflate / 瀏覽器 DecompressionStream("deflate")）"""
 
-    cy_data = {"nodes": cy_nodes, "edges": cy_edges}
+    def __init__(self, path: str, level: int):
+        self.raw = open(path, "wb")
+        self.z = zlib.compressobj(level)
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.raw.write(self.z.compress(b))
+        return len(b)
+
+    def close(self):
+        if not self.closed:
+            self.raw.write(self.z.flush())
+            self.raw.close()
+        super().close()
+
+
+def _open_export(path: str, compress: str = None, level: int = 6):
+    """以文字模式開啟輸出檔；compress 為 None、'gzip' 或 'deflate'"""
+    if compress is None:
+        return open(path, "w", encoding="utf-8", newline="")
+    if compress == "gzip":
+        # mtime=0：同樣的內容得到同樣的位元組（stage cache 比對用）
+        raw = gzip.GzipFile(path, "wb", compresslevel=level, mtime=0)
+    elif compress == "deflate":
+        raw = io.BufferedWriter(_DeflateWriter(path, level), 1 << 16)
+    else:
+        raise ValueError(f"Unknown compress: {compress!r} (None, 'gzip' or 'deflate')")
+    return io.TextIOWrapper(raw, encoding="utf-8", newline="")
+
+
+def _indented_object(obj: dict) -> str:
+    """
+    dict 在 json.dump(indent=2) 輸出中位於第 3 層時的樣子；值都是純量時直接拼字串，
+    有巢狀的值時回傳 None 交給 json.dumps。
+    """
+    if any(isinstance(v, (dict, list, tuple)) for v in obj.values()):
+        return None
+    if not obj:
+        return "{}"
+    fields = ",\n".join(f"        {_json_scalar(str(k))}: {_json_scalar(v)}" for k, v in obj.items())
+    return "{\n" + fields + "\n      }"
+
+
+def _indented_element(data: dict, position: dict = None) -> str:
+    """
+    {"data": data[, "position": position]} 在 json.dump(indent=2) 輸出中的樣子（位於第 2 層串列內），
+    與 json.dumps 的結果逐位元組相同。
+    """
+    body = _indented_object(data)
+    pos = _indented_object(position) if position is not None and body is not None else "{}"
+    if body is None or pos is None:
+        element = {"data": data} if position is None else {"data": data, "position": position}
+        return "    " + json.dumps(element, indent=2, ensure_ascii=False).replace("\n", "\n    ")
+    if position is None:
+        return '    {\n      "data": ' + body + "\n    }"
+    return '    {\n      "data": ' + body + ',\n      "position": ' + pos + "\n    }"
+
+
+def _compact_element(data: dict, position: dict = None) -> str:
+    return _json_compact({"data": data} if position is None else {"data": data, "position": position})
+
+
+def _write_elements(f, key: str, items, compact: bool, first: bool, buffer_size: int = 1 << 16) -> int:
+    """把一個 Cytoscape 元素串列（(data, position 或 None) 序列）邊產生邊寫出，回傳元素數"""
+    if compact:
+        f.write(("{" if first else ",") + f'"{key}":[')
+        sep, render = ",", _compact_element
+    else:
+        f.write(("{\n" if first else ",\n") + f'  "{key}": [')
+        sep, render = ",\n", _indented_element
+    count = size = 0
+    parts = []
+    for data, position in items:
+        text = render(data, position)
+        parts.append(sep + text if count else ("" if compact else "\n") + text)
+        size += len(text)
+        count += 1
+        if size >= buffer_size:
+            f.write("".join(parts))
+            parts.clear()
+            size = 0
+    f.write("".join(parts))
+    f.write("]" if compact or not count else "\n  ]")
+    return count
+
+
+class _ColumnTable:
+    """欄位值的字串表：新值依出現順序編號，每個 chunk 只帶出新增的部分"""
+
+    def __init__(self):
+        self.codes = {}
+        self.new = []
+
+    def encode(self, value) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.codes)
+            self.new.append(value)
+        return code
+
+    def take_new(self) -> list:
+        new, self.new = self.new, []
+        return new
+
+
+def _extra_column(batch: list, fields: tuple) -> dict:
+    """cy_data 帶進來的其他欄位放在 "data" 欄（每個元素一個 dict 或 null）；整個 chunk 都沒有時省略"""
+    extra = [{k: v for k, v in d.items() if k not in fields} for d in batch]
+    if not any(extra):
+        return {}
+    return {"data": [e or None for e in extra]}
+
+
+def _position_columns(positions: list) -> dict:
+    """節點座標放在 "x" / "y" 欄（沒有座標的為 null）；整個 chunk 都沒有時省略"""
+    if not any(p is not None for p in positions):
+        return {}
+    return {"x": [p["x"] if p is not None else None for p in positions],
+            "y": [p["y"] if p is not None else None for p in positions]}
+
+
+def _write_columnar(f, G: nx.Graph, chunk_size: int) -> tuple:
+    """
+    欄式 NDJSON：每行一個 JSON 物件，前端可以逐行解碼、邊下載邊加進圖中。
+      {"type": "header", "format": "cytoscape-columnar", "version": 1, "chunk": N}
+      {"type": "nodes", "id": [...], "label": [...], "fullLabel": [...],
+       "color": [碼], "shape": [碼], "tables": {"color": [新值], "shape": [新值]}}
+      {"type": "edges", "source": [節點序號], "target": [節點序號], "label": [碼],
+       "timestamp": [值或 null]（null 視為沒有 timestamp；整個 chunk 都沒有時省略）,
+       "tables": {"label": [新值]}}
+      {"type": "end", "nodes": 節點數, "edges": 邊數}
+    節點或邊帶有 cy_data 時，該 chunk 另有 "data" 欄（見 _extra_column），解碼時併入 data；
+    節點有座標時另有 "x" / "y" 欄（見 _position_columns），解碼為元素的 position。
+    重複度高的欄位（color、shape、邊 label）以字串表編碼，表只增不減，
+    每個 chunk 附上這次新增的值；source / target 是節點在 nodes 行中的序號（從 0 起算）。
+    """
+    f.write(_json_compact({"type": "header", "format": CY_COLUMNAR_FORMAT,
+                           "version": CY_COLUMNAR_VERSION, "chunk": chunk_size}) + "\n")
+    tables = {name: _ColumnTable() for name in ("color", "shape", "label")}
+    index = {}
+
+    def chunks(items):
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= chunk_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    for batch in chunks(zip(cytoscape_node_data(G), cytoscape_node_positions(G))):
+        positions = [p for _, p in batch]
+        batch = [d for d, _ in batch]
+        ids = [d["id"] for d in batch]
+        for i in ids:
+            index.setdefault(i, len(index))
+        color, shape = tables["color"], tables["shape"]
+        f.write(_json_compact({
+            "type": "nodes",
+            "id": ids,
+            "label": [d["label"] for d in batch],
+            "fullLabel": [d["fullLabel"] for d in batch],
+            "color": [color.encode(d["color"]) for d in batch],
+            "shape": [shape.encode(d["shape"]) for d in batch],
+            **_extra_column(batch, _NODE_FIELDS),
+            **_position_columns(positions),
+            "tables": {"color": color.take_new(), "shape": shape.take_new()},
+        }) + "\n")
+    n_nodes = len(index)
+
+    n_edges = 0
+    label = tables["label"]
+    for batch in chunks(cytoscape_edge_data(G)):
+        line = {
+            "type": "edges",
+            "source": [index[d["source"]] for d in batch],
+            "target": [index[d["target"]] for d in batch],
+            "label": [label.encode(d["label"]) for d in batch],
+        }
+        if any("timestamp" in d for d in batch):
+            line["timestamp"] = [d.get("timestamp") for d in batch]
+        line.update(_extra_column(batch, _EDGE_FIELDS))
+        line["tables"] = {"label": label.take_new()}
+        f.write(_json_compact(line) + "\n")
+        n_edges += len(batch)
+
+    f.write(_json_compact({"type": "end", "nodes": n_nodes, "edges": n_edges}) + "\n")
+    return n_nodes, n_edges
+
+
+def cytoscape_file_name(stem: str, encoding: str = "cytoscape", compress: str = None) -> str:
+    """輸出檔名：columnar 用 .ndjson，壓縮時再加 .gz / .deflate"""
+    name = stem + (".ndjson" if encoding == "columnar" else ".json")
+    return name + {"gzip": ".gz", "deflate": ".deflate"}.get(compress, "")
+
+
+def export_cytoscape_json(
+    G: nx.Graph,
+    json_path: str,
+    compact: bool = False,
+    compress: str = None,
+    encoding: str = "cytoscape",
+    chunk_size: int = 10000,
+    compress_level: int = 6
+):
+    """
+    匯出 Cytoscape JSON。節點與邊邊產生邊寫出，不先組出整份 cy_nodes / cy_edges，
+    記憶體只跟緩衝區大小有關。
+
+    Args:
+        compact: False 時輸出與 json.dump(..., indent=2) 逐位元組相同；
+                 True 時不縮排（separators=(",", ":")），檔案小得多
+        compress: None、'gzip' 或 'deflate'（zlib 格式）壓縮輸出
+        encoding: 'cytoscape'（{"nodes": [...], "edges": [...]}）或
+                  'columnar'（欄式 NDJSON，見 _write_columnar，可用 read_cytoscape_columnar 讀回）
+        chunk_size: columnar 每行的元素數
+    """
+    if encoding not in ("cytoscape", "columnar"):
+        raise ValueError(f"Unknown encoding: {encoding!r} ('cytoscape' or 'columnar')")
     os.makedirs(os.path.dirname(json_path), exist_ok=True)
-    with open(json_path, "w", encoding="utf-8") as f:
-        json.dump(cy_data, f, indent=2, ensure_ascii=False)
+    with _open_export(json_path, compress, compress_level) as f:
+        if encoding == "columnar":
+            _write_columnar(f, G, chunk_size)
+        else:
+            _write_elements(f, "nodes", zip(cytoscape_node_data(G), cytoscape_node_positions(G)),
+                            compact, first=True)
+            _write_elements(f, "edges", ((data, None) for data in cytoscape_edge_data(G)),
+                            compact, first=False)
+            f.write("}" if compact else "\n}")
     print(f"✅ Exported Cytoscape JSON to {json_path}")
 
 
+def read_cytoscape_columnar(path: str, compress: str = None) -> dict:
+    """把 columnar 輸出還原成 {"nodes": [...], "edges": [...]}（前端解碼邏輯的參考實作）"""
+    if compress == "gzip":
+        f = gzip.open(path, "rt", encoding="utf-8")
+    elif compress == "deflate":
+        with open(path, "rb") as raw:
+            f = io.StringIO(zlib.decompress(raw.read()).decode("utf-8"))
+    else:
+        f = open(path, "r", encoding="utf-8")
+    tables = {"color": [], "shape": [], "label": []}
+    nodes, edges, ids = [], [], []
+    with f:
+        header = json.loads(f.readline())
+        if header.get("format") != CY_COLUMNAR_FORMAT:
+            raise ValueError(f"{path}: not a {CY_COLUMNAR_FORMAT} file")
+        for line in f:
+            chunk = json.loads(line)
+            for name, values in chunk.get("tables", {}).items():
+                tables[name].extend(values)
+            if chunk["type"] == "nodes":
+                ids.extend(chunk["id"])
+                extra = chunk.get("data") or [None] * len(chunk["id"])
+                xs = chunk.get("x") or [None] * len(chunk["id"])
+                ys = chunk.get("y") or [None] * len(chunk["id"])
+                for i, label, full, color, shape, more, x, y in zip(
+                        chunk["id"], chunk["label"], chunk["fullLabel"], chunk["color"], chunk["shape"],
+                        extra, xs, ys):
+                    data = {"id": i, "label": label, "fullLabel": full,
+                            "color": tables["color"][color], "shape": tables["shape"][shape]}
+                    data.update(more or {})
+                    node = {"data": data}
+                    if x is not None:
+                        node["position"] = {"x": x, "y": y}
+                    nodes.append(node)
+            elif chunk["type"] == "edges":
+                stamps = chunk.get("timestamp")
+                extra = chunk.get("data")
+                for k, (s, t, label) in enumerate(zip(chunk["source"], chunk["target"], chunk["label"])):
+                    data = {"source": ids[s], "target": ids[t], "label": tables["label"][label]}
+                    if stamps is not None and stamps[k] is not None:
+                        data["timestamp"] = stamps[k]
+                    if extra is not None and extra[k]:
+                        data.update(extra[k])
+                    edges.append({"data": data})
+    return {"nodes": nodes, "edges": edges}
+
+
 
 def generate_full_graph(
     graph_pkl_path: str,
     json_out: str,
     image_out: str = None,
-    layout: str = "dot"
+    layout: str = "dot",
+    compact: bool = False,
+    compress: str = None,
+    encoding: str = "cytoscape",
+    positions: bool = False,
+    layout_cache: str = None
 ):
-    with open(graph_pkl_path, "rb") as f:
-        G = pickle.load(f)
+    """
+    完整圖；compact / compress / encoding 見 export_cytoscape_json。
+    positions=True 時以 graph_layout 預先算好座標寫進 position（前端用 preset layout），
+    座標快取在 layout_cache（預設為圖檔旁的 <graph>.layouts/），圖沒變時直接沿用。
+    """
+    G = as_networkx(load_graph(graph_pkl_path))
 
     for n in G.nodes():
         G.nodes[n].setdefault("label", G.nodes[n].get("label", n))
@@ -201,156 +532,164 @@ def generate_full_graph(
             "network":  "diamond"
         }.get(t, "ellipse"))
 
-    export_cytoscape_json(G, json_out)
+    if positions:
+        apply_layout(G, layout_cache or default_layout_cache(graph_pkl_path))
+
+    export_cytoscape_json(G, json_out, compact=compact, compress=compress, encoding=encoding)
 
     if image_out:
-        from networkx.drawing.nx_pydot import to_pydot
-        def export_graphviz(G, path, layout, rankdir="LR"):
-            H = nx.MultiDiGraph() if G.is_multigraph() else nx.DiGraph()
-            old2new = {}
-            for idx, (n, d) in enumerate(G.nodes(data=True)):
-                raw = str(d.get("label", n))
-                safe = sanitize_label(raw)
-                label = shorten_label(safe)
-                node_id = f"n{idx}"
-                old2new[n] = node_id
-                H.add_node(node_id, label=label, shape=d.get("shape"), fillcolor=d.get("color"), style="filled")
-            for u, v, d in G.edges(data=True):
-                rel = sanitize_label(d.get("relation", ""))
-                H.add_edge(old2new[u], old2new[v], label=rel)
-            pg = to_pydot(H)
-            pg.set_prog(layout)
-            pg.set_graph_defaults(
-                dpi="300",
-                overlap="false",
-                splines="polyline",
-                concentrate="true",
-                rankdir=rankdir,
-                nodesep="0.3",
-                ranksep="0.5",
-                margin="0.2"
-            )
-            ext = path.lower().rsplit('.', 1)[-1]
-            if ext == "png": pg.write_png(path)
-            elif ext == "svg": pg.write_svg(path, encoding='utf-8')
-            else: raise ValueError("Only support .png or .svg")
-            print(f"✅ Exported graph image to {path}")
         os.makedirs(os.path.dirname(image_out), exist_ok=True)
         export_graphviz(G, image_out, layout)
 
 
+SHAPE_BY_TYPE = {"process": "ellipse", "file": "rectangle", "registry": "pentagon", "network": "diamond"}
+
+
+def select_attack_subgraph(G0, score: np.ndarray, top_k: int):
+    """
+    在 CompactProvenanceGraph 上選出攻擊子圖的節點（皆為 bool 遮罩）：
+      - attack：label 不是 "benign" 的邊的兩端
+      - seeds：attack 與其所有祖先（一次多源反向 BFS，取代逐節點 nx.ancestors）
+      - expanded：seeds 的出邊鄰居中，非 benign 邊的目標全部保留，
+        其餘 benign 目標依 score 由高到低（同分依首次出現順序）各取 top_k 個
+    回傳 (attack, expanded, keep)。
+    """
+    n = G0.number_of_nodes()
+    src, dst = np.asarray(G0.edge_src), np.asarray(G0.edge_dst)
+    nonbenign = G0.edge_label_mask(lambda s: s != "benign")
+
+    attack = np.zeros(n, dtype=bool)
+    attack[src[nonbenign]] = True
+    attack[dst[nonbenign]] = True
+    seeds = G0.reachable(np.flatnonzero(attack), reverse=True)
+
+    # seeds 的所有出邊，依 CSR 順序（同一來源內為插入順序）
+    eids = G0.gather_edges(np.flatnonzero(seeds))
+    u, v, nb = src[eids].astype(np.int64), dst[eids].astype(np.int64), nonbenign[eids]
+
+    expanded = np.zeros(n, dtype=bool)
+    expanded[v[nb]] = True
+
+    # 每個 (u, v) 只留第一次出現；u 已經以非 benign 邊連到的 v 不再列入 benign 候選
+    pair = u * n + v
+    nonb_pairs = np.unique(pair[nb])
+    cand = ~nb & ~np.isin(pair, nonb_pairs)
+    pair_c, first = np.unique(pair[cand], return_index=True)
+    pos = np.flatnonzero(cand)[first]
+    cu, cv = u[pos], v[pos]
+
+    # 依 (u, -score, 首次出現位置) 排序後，每個 u 取前 top_k 名
+    order = np.lexsort((pos, -score[cv], cu))
+    cu, cv = cu[order], cv[order]
+    group_start = np.flatnonzero(np.r_[True, cu[1:] != cu[:-1]])
+    rank = np.arange(len(cu)) - np.repeat(group_start, np.diff(np.r_[group_start, len(cu)]))
+    expanded[cv[rank < top_k]] = True
+
+    return attack, expanded, seeds | expanded
+
+
+def build_attack_view(G0, keep: np.ndarray, attack: np.ndarray, expanded: np.ndarray,
+                      ttp_name_map: dict) -> nx.MultiDiGraph:
+    """
+    一次建出匯出用的子圖：節點重編號為 n0, n1, …（依原圖順序），
+    邊順序同 nx.MultiDiGraph 的 edges()（依來源節點、鄰居首次出現、插入順序）。
+    攻擊 TTP label 轉成 "ID NAME"。
+    """
+    src, dst = np.asarray(G0.edge_src), np.asarray(G0.edge_dst)
+    kept_nodes = np.flatnonzero(keep)
+    new_id = np.full(G0.number_of_nodes(), -1, dtype=np.int64)
+    new_id[kept_nodes] = np.arange(len(kept_nodes))
+
+    G = nx.MultiDiGraph()
+    labels, types, ids = G0.labels, G0.types, G0.node_ids
+    for i, old in enumerate(kept_nodes.tolist()):
+        ntype = types[G0.node_type[old]]
+        G.add_node(f"n{i}",
+                   label=str(labels[G0.node_label[old]]),
+                   type=ntype,
+                   color="skyblue",
+                   attack_flag=bool(attack[old]),
+                   expanded_flag=bool(expanded[old]),
+                   shape=SHAPE_BY_TYPE.get(ntype.lower(), "ellipse"))
+
+    # 每個不同的 edge label 只轉換一次
+    ttp_labels = []
+    for raw_ttp in G0.edge_labels.to_list():
+        # 如果這是一個攻擊 TTP，就做 mapping
+        if raw_ttp and raw_ttp.lower() != "benign":
+            ttp_id = raw_ttp.split("_", 1)[0]
+            ttp_labels.append(f"{ttp_id} {ttp_name_map.get(ttp_id, ttp_id)}")
+        else:
+            ttp_labels.append(raw_ttp)
+
+    eids = np.flatnonzero(keep[src] & keep[dst])
+    if len(eids):
+        u, v = new_id[src[eids]], new_id[dst[eids]]
+        _, inverse = np.unique(u * len(kept_nodes) + v, return_inverse=True)
+        pair_first = np.full(inverse.max() + 1, len(eids))
+        np.minimum.at(pair_first, inverse, np.arange(len(eids)))
+        eids = eids[np.lexsort((eids, pair_first[inverse], u))]
+
+    relations = G0.relations.to_list()
+    for e in eids.tolist():
+        attrs = {"relation": relations[G0.edge_relation[e]],
+                 "label": ttp_labels[G0.edge_label[e]]}
+        ts = int(G0.edge_timestamp[e])
+        if ts != NO_TIMESTAMP:
+            attrs["timestamp"] = ts
+        G.add_edge(f"n{new_id[src[e]]}", f"n{new_id[dst[e]]}", **attrs)
+    return G
+
+
 def generate_attack_graph(
     graph_pkl_path: str,
     score_csv_path: str,
     json_out: str,
     image_out: str = None,
     top_k: int = 5,
-    layout: str = "dot"
+    layout: str = "dot",
+    rank_by: str = "final_score",
+    compact: bool = False,
+    compress: str = None,
+    encoding: str = "cytoscape",
+    positions: bool = False,
+    layout_cache: str = None
 ):
-    
+    """
+    攻擊子圖：所有攻擊節點及其祖先，再從每個節點擴散 top_k 個分數最高的 benign 鄰居。
+    rank_by 為分數 CSV 中用來排序 benign 鄰居的欄位（例如 compute_node_scores
+    以 extra_scores 產生的 "pagerank"）。
+    score_csv_path 也可以直接傳入 score_nodes 回傳的 DataFrame（記憶體內流程）。
+    compact / compress / encoding 見 export_cytoscape_json；positions / layout_cache 見 generate_full_graph
+    （座標依子圖本身計算與快取，只改 top_k 等參數時子圖不同會重新排版）。
+    """
+
     # 0. 先讀 enterprise_techniques.csv
     #    假設這份 CSV 放在專案根目錄下
     csv_path = os.path.join(os.path.dirname(__file__), os.pardir, "enterprise_techniques.csv")
     df_map = pd.read_csv(csv_path, encoding="utf-8")
     ttp_name_map = dict(zip(df_map["TTP ID"], df_map["TTP NAME"]))
 
-    # 1. 讀原始圖與分數
-    with open(graph_pkl_path, "rb") as f:
-        G0 = pickle.load(f)
-    df = pd.read_csv(score_csv_path)
-    score = dict(zip(df["node_uuid"], df["final_score"]))
-
-    # 2. 找到所有非 benign 的 edges 當 seeds
-    attack = {u for u, v, d in G0.edges(data=True) if d.get("label") != "benign"} | {v for u, v, d in G0.edges(data=True) if d.get("label") != "benign"}
-    seeds = set(attack)
-    for a in list(attack):
-        seeds |= nx.ancestors(G0, a)
-
-    # 3. Top-K benign 節點擴散
-    expanded = set()
-    for u in seeds:
-        nonb, ben = [], []
-        for _, v, d in G0.out_edges(u, data=True):
-            (nonb if d.get("label")!="benign" else ben).append((v, score.get(v,0)))
-        nonb = [v for v, _ in dict.fromkeys(nonb)]
-        ben = sorted(dict.fromkeys(ben), key=lambda x: score.get(x,0), reverse=True)
-        chosen = nonb + [v for v in ben if v not in nonb][:top_k]
-        expanded.update(chosen)
-
-    keep = seeds | expanded
-    G_sub = G0.subgraph(keep).copy()
-
-    # 4. 不做任何合併，保留原始每一條 edge
-    G_clean = nx.MultiDiGraph()
-    G_clean.add_nodes_from(G_sub.nodes(data=True))
-    for u, v, d in G_sub.edges(data=True):
-        rel = d.get("relation", "")
-        raw_ttp = d.get("label", "")       # e.g. "T1566.001_1afae…"
-        
-        # 如果這是一個攻擊 TTP，就做 mapping
-        if raw_ttp and raw_ttp.lower() != "benign":
-            # 先拆出前半段 ID
-            ttp_id = raw_ttp.split("_", 1)[0]
-            # 從 map 裡找 NAME，找不到就保留原 ID
-            ttp_name = ttp_name_map.get(ttp_id, ttp_id)
-            # 你可以決定要顯示 "ID_NAME" 或只顯示 "NAME"
-            new_ttp_label = f"{ttp_id} {ttp_name}"
-        else:
-            new_ttp_label = raw_ttp
-
-        attrs = {
-            "relation": rel,
-            # 用新字串
-            "label": new_ttp_label
-        }
-        if "timestamp" in d and d["timestamp"] is not None:
-            attrs["timestamp"] = d["timestamp"]
-
-        G_clean.add_edge(u, v, **attrs)
+    # 1. 讀原始圖與分數（分數依節點索引放進陣列，不在 CSV 的節點為 0）
+    G0 = as_compact(load_graph(graph_pkl_path))
+    df = score_csv_path if isinstance(score_csv_path, pd.DataFrame) else pd.read_csv(score_csv_path)
+    node_ids = G0.node_ids.to_list()
+    score = pd.Series(df[rank_by].values, index=df["node_uuid"].astype(str))
+    score = score[~score.index.duplicated()]
+    score = score.reindex([str(x) for x in node_ids]).fillna(0).to_numpy(dtype=np.float64)
 
+    # 2~3. 攻擊節點、祖先與 Top-K benign 擴散
+    attack, expanded, keep = select_attack_subgraph(G0, score, top_k)
 
-    # 5. 重編號並設定節點屬性
-    mapping = {old: f"n{i}" for i, old in enumerate(G_clean.nodes())}
-    G = nx.relabel_nodes(G_clean, mapping, copy=True)
-    inv = {v: k for k, v in mapping.items()}
-    for n in G.nodes():
-        old = inv[n]
-        G.nodes[n]["label"] = str(G0.nodes[old].get("label", old))
-        # G.nodes[n]["color"] = "red" if old in attack else ("orange" if old in expanded else "skyblue")
-        G.nodes[n]["color"] = "skyblue"
-        G.nodes[n]["attack_flag"] = old in attack
-        G.nodes[n]["expanded_flag"] = old in expanded
-        
-        t = G0.nodes[old].get("type", "").lower()
-        G.nodes[n]["shape"] = {"process":"ellipse","file":"rectangle","registry":"pentagon","network":"diamond"}.get(t, "ellipse")
-
+    # 4~5. 直接建出重編號後的子圖（保留原始每一條 edge，不做任何合併）
+    G = build_attack_view(G0, keep, attack, expanded, ttp_name_map)
 
-    # 6. 輸出 Cytoscape JSON
-    export_cytoscape_json(G, json_out)
+    # 6. 輸出 Cytoscape JSON（可選預先排版）
+    if positions:
+        apply_layout(G, layout_cache or default_layout_cache(graph_pkl_path))
+    export_cytoscape_json(G, json_out, compact=compact, compress=compress, encoding=encoding)
 
     # 7. 可選輸出圖檔
     if image_out:
-        from networkx.drawing.nx_pydot import to_pydot
         os.makedirs(os.path.dirname(image_out), exist_ok=True)
-        def export_graphviz(G, path, layout, rankdir="LR"):
-            H = nx.MultiDiGraph() if G.is_multigraph() else nx.DiGraph()
-            old2new = {}
-            for idx,(n,d) in enumerate(G.nodes(data=True)):
-                raw = str(d.get("label",n))
-                safe = sanitize_label(raw)
-                label = shorten_label(safe)
-                node_id = f"n{idx}";
-                old2new[n] = node_id
-                H.add_node(node_id, label=label, shape=d.get("shape"), fillcolor=d.get("color"), style="filled")
-            for u,v,d in G.edges(data=True):
-                rel = sanitize_label(d.get("relation",""))
-                H.add_edge(old2new[u], old2new[v], label=rel)
-            pg = to_pydot(H)
-            pg.set_prog(layout)
-            pg.set_graph_defaults(dpi="300", overlap="false", splines="polyline", concentrate="true", rankdir=rankdir, nodesep="0.3", ranksep="0.5", margin="0.2")
-            ext = path.lower().rsplit('.',1)[-1]
-            if ext == "png": pg.write_png(path)
-            elif ext == "svg": pg.write_svg(path, encoding='utf-8')
-            else: raise ValueError("Only support .png or .svg")
-            print(f"✅ Exported graph image to {path}")
         export_graphviz(G, image_out, layout)
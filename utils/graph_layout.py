@@ -0,0 +1,167 @@
+# utils/graph_layout.py
+"""
+伺服器端預先計算的節點座標：匯出時寫進 Cytoscape JSON 的 position，
+前端用 preset layout 直接畫，不必在瀏覽器排版，也不必每次呼叫 Graphviz。
+
+座標依圖的指紋（節點 id、邊與參數）快取在圖檔旁的目錄，圖沒變時重新匯出直接沿用。
+"""
+
+import os
+import hashlib
+import numpy as np
+import networkx as nx
+
+LAYOUT_VERSION = 1
+# 每個座標快取目錄最多保留幾份座標（依最後使用時間淘汰）
+LAYOUT_CACHE_ENTRIES = 8
+
+
+def _longest_path_layers(a: np.ndarray, b: np.ndarray, n: int) -> np.ndarray:
+    """a < b 的邊（依 b 排序）上的最長路徑分層：layer[b] = max(layer[a] + 1)"""
+    layer = [0] * n
+    for u, v in zip(a.tolist(), b.tolist()):
+        if layer[u] >= layer[v]:
+            layer[v] = layer[u] + 1
+    return np.asarray(layer, dtype=np.int64)
+
+
+def _rank_within_layers(layer: np.ndarray, key: np.ndarray, layer_start: np.ndarray) -> np.ndarray:
+    """各層內依 key 由小到大編號（同值依節點順序）"""
+    order = np.lexsort((np.arange(len(layer)), key, layer))
+    rank = np.empty(len(layer), dtype=np.int64)
+    rank[order] = np.arange(len(layer)) - layer_start[layer[order]]
+    return rank
+
+
+def layered_layout(src: np.ndarray, dst: np.ndarray, n: int, sweeps: int = 8, max_rows: int = 100,
+                   layer_gap: float = 150.0, node_gap: float = 40.0) -> tuple:
+    """
+    適合大型、近似 DAG 的 provenance graph 的分層排版（由左到右，同 Graphviz rankdir=LR）：
+      1. 邊一律由節點順序較前的一端指向較後的一端（節點順序約為首次出現的時間），得到 DAG，
+         重複的邊與自迴圈只算一次；
+      2. 最長路徑分層，決定 x；
+      3. 重心法（barycenter）減少交叉：每輪整批計算所有節點相鄰節點的平均位置，
+         再於各層內重新排序，前後向交替 sweeps 輪（全部以 numpy 向量化，每輪 O(E)）；
+      4. 超過 max_rows 個節點的層折成多欄（每欄約 sqrt(層大小) 列），避免單一層過長。
+    回傳 (x, y) 兩個 float 陣列。
+    """
+    src, dst = np.asarray(src, dtype=np.int64), np.asarray(dst, dtype=np.int64)
+    if n == 0:
+        return np.zeros(0), np.zeros(0)
+    a, b = np.minimum(src, dst), np.maximum(src, dst)
+    keep = a != b
+    pair = np.unique(b[keep] * n + a[keep])         # 依 b 排序
+    a, b = pair % n, pair // n
+
+    layer = _longest_path_layers(a, b, n)
+    size = np.bincount(layer)
+    layer_start = np.r_[0, np.cumsum(size)[:-1]]
+    center = (size - 1) / 2.0
+
+    # 初始順序為節點順序，之後以相鄰節點的平均位置重排
+    pos = _rank_within_layers(layer, np.arange(n), layer_start) - center[layer]
+    degree_in = np.bincount(b, minlength=n)
+    degree_out = np.bincount(a, minlength=n)
+    for i in range(sweeps):
+        if i % 2 == 0:
+            total = np.bincount(b, weights=pos[a], minlength=n)
+            count = degree_in
+        else:
+            total = np.bincount(a, weights=pos[b], minlength=n)
+            count = degree_out
+        bary = np.where(count > 0, total / np.maximum(count, 1), pos)
+        pos = _rank_within_layers(layer, bary, layer_start) - center[layer]
+
+    # 折欄：rows 為每欄列數，欄依層序排在一起
+    rank = (pos + center[layer]).astype(np.int64)
+    rows = np.where(size > max_rows, np.maximum(max_rows, np.ceil(np.sqrt(size))), np.maximum(size, 1)).astype(np.int64)
+    columns = -(-size // rows)
+    column_start = np.r_[0, np.cumsum(columns)[:-1]]
+    col, row = np.divmod(rank, rows[layer])
+    height = np.minimum(size, rows)[layer]
+    x = (column_start[layer] + col) * layer_gap
+    y = (row - (height - 1) / 2.0) * node_gap
+    return x.astype(np.float64), y.astype(np.float64)
+
+
+def _graph_arrays(G: nx.Graph) -> tuple:
+    """nx 圖 -> (節點串列, src, dst)，節點依 G.nodes() 的順序編號"""
+    nodes = list(G.nodes())
+    index = {v: i for i, v in enumerate(nodes)}
+    m = G.number_of_edges()
+    src = np.fromiter((index[u] for u, _ in G.edges()), dtype=np.int64, count=m)
+    dst = np.fromiter((index[v] for _, v in G.edges()), dtype=np.int64, count=m)
+    return nodes, src, dst
+
+
+def graph_fingerprint(nodes: list, src: np.ndarray, dst: np.ndarray, params: dict) -> str:
+    """節點 id（依順序）、邊與排版參數的 sha256；任何一項不同就重新排版"""
+    h = hashlib.sha256(f"layout-v{LAYOUT_VERSION}:{sorted(params.items())}".encode("utf-8"))
+    h.update("\0".join(str(v) for v in nodes).encode("utf-8", "surrogatepass"))
+    h.update(np.ascontiguousarray(src, dtype=np.int64).tobytes())
+    h.update(np.ascontiguousarray(dst, dtype=np.int64).tobytes())
+    return h.hexdigest()
+
+
+def _prune_layout_cache(cache_dir: str, keep: int):
+    """只保留最近用到的 keep 份座標（命中時會更新 mtime），其餘刪除"""
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".npz") and ".tmp" not in name:
+            path = os.path.join(cache_dir, name)
+            try:
+                entries.append((os.path.getmtime(path), path))
+            except OSError:
+                continue
+    entries.sort(reverse=True)
+    for _, path in entries[keep:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def compute_positions(G: nx.Graph, cache_dir: str = None, max_entries: int = LAYOUT_CACHE_ENTRIES,
+                      **params) -> tuple:
+    """
+    G 的節點座標 {node: (x, y)}，參數見 layered_layout。
+    cache_dir 不為 None 時以 graph_fingerprint 為檔名快取在其中（<fingerprint>.npz），
+    同一張圖再次匯出直接讀回；目錄內最多保留 max_entries 份（LRU），圖或參數一直變也不會無限成長。
+    回傳 (positions, 是否命中快取)。
+    """
+    nodes, src, dst = _graph_arrays(G)
+    path = None
+    if cache_dir is not None:
+        path = os.path.join(cache_dir, graph_fingerprint(nodes, src, dst, params) + ".npz")
+        try:
+            with np.load(path) as cached:
+                x, y = cached["x"], cached["y"]
+            if len(x) == len(nodes):
+                os.utime(path)
+                return dict(zip(nodes, zip(x.tolist(), y.tolist()))), True
+        except (OSError, KeyError, ValueError):
+            pass
+
+    x, y = layered_layout(src, dst, len(nodes), **params)
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp = f"{path}.tmp{os.getpid()}.npz"
+        np.savez(tmp, x=x, y=y)
+        os.replace(tmp, path)
+        _prune_layout_cache(cache_dir, max_entries)
+    return dict(zip(nodes, zip(x.tolist(), y.tolist()))), False
+
+
+def apply_layout(G: nx.Graph, cache_dir: str = None, **params) -> bool:
+    """把座標寫進節點屬性 position（export_cytoscape_json 會輸出），回傳是否命中快取"""
+    positions, cached = compute_positions(G, cache_dir, **params)
+    for v, (x, y) in positions.items():
+        G.nodes[v]["position"] = {"x": round(x, 1), "y": round(y, 1)}
+    return cached
+
+
+def default_layout_cache(graph_path) -> str:
+    """圖檔（pkl 或 mmap 目錄）旁的座標快取目錄；記憶體內的圖物件沒有檔案時回傳 None"""
+    if isinstance(graph_path, (str, os.PathLike)):
+        return os.fspath(graph_path).rstrip("/\\") + ".layouts"
+    return None
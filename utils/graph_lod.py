@@ -0,0 +1,456 @@
+# utils/graph_lod.py
+"""
+多解析度（level-of-detail）匯出：節點先依 process tree、檔案目錄或類型分群，
+輸出一張 cluster 層級的總覽圖（overview），每個 cluster 再各有一張細節 tile，
+前端先畫總覽、點開 cluster 時才載入對應的 tile。
+
+輸出目錄：
+    index.json       cluster 清單（名稱、大小、tile 檔名…）與輸出設定
+    overview.json    總覽：每個 cluster 一個節點，cluster 之間的邊合併成一條（帶條數）
+    clusters.npy     每個節點所屬的 cluster（export_lod_tile 隨需產生 tile 用）
+    tiles/c<k>.json  cluster k 的細節：cluster 內的節點與邊，
+                     對外的邊接到代表其他 cluster 的 proxy 節點（id 同總覽的 cluster:<j>）
+"""
+
+import io
+import os
+import re
+import json
+import shutil
+import contextlib
+from collections import Counter
+import numpy as np
+import networkx as nx
+from graph_store import load_graph, as_compact
+from graph_layout import apply_layout
+from generate_graph import (SHAPE_BY_TYPE, abbreviate_by_shape, cytoscape_file_name,
+                            export_cytoscape_json, export_graphviz, _split_command, _EXE_RE)
+
+CLUSTER_MODES = ("process_tree", "directory", "type")
+LOD_FORMAT_VERSION = 1
+
+
+# --------------------------------------------------------------------------------
+# 分群 key：每個節點一個 tuple，越前面越粗；cluster 取 key 的某個前綴
+
+def _first_touch(G0, mask_a: np.ndarray, mask_b: np.ndarray) -> np.ndarray:
+    """
+    對每個 mask_b 節點，找時間上第一條與 mask_a 節點（不同於自己）相連的邊，
+    回傳該 mask_a 端點（沒有則為 -1）。
+    """
+    n = G0.number_of_nodes()
+    order = G0.edges_by_time()
+    src, dst = np.asarray(G0.edge_src)[order], np.asarray(G0.edge_dst)[order]
+    # 同一條邊兩個方向都可能成立：依時間展開成 (b 端, a 端) 的序列
+    fwd = mask_a[src] & mask_b[dst] & (src != dst)
+    bwd = mask_b[src] & mask_a[dst] & (src != dst)
+    pos = np.concatenate([np.flatnonzero(fwd), np.flatnonzero(bwd)])
+    b_end = np.concatenate([dst[fwd], src[bwd]])
+    a_end = np.concatenate([src[fwd], dst[bwd]])
+    first = np.full(n, -1, dtype=np.int64)
+    if len(pos):
+        seq = np.lexsort((pos, b_end))
+        b_sorted = b_end[seq]
+        head = np.r_[True, b_sorted[1:] != b_sorted[:-1]]
+        first[b_sorted[head]] = a_end[seq][head]
+    return first
+
+
+def _process_chains(parent: np.ndarray, is_process: np.ndarray, max_depth: int) -> dict:
+    """
+    process -> 由根到自己的祖先序列（最多 max_depth 層，超過的併入最深的那層）。
+    parent 若形成環，從走到的第一個重複節點斷開，使其成為根。
+    """
+    chains = {}
+    for start in np.flatnonzero(is_process).tolist():
+        while start not in chains:
+            path, on_path = [], set()
+            x = start
+            while x != -1 and x not in chains and x not in on_path:
+                on_path.add(x)
+                path.append(x)
+                x = int(parent[x])
+            if x in on_path:            # 環：從 x 斷開後重走
+                parent[x] = -1
+                continue
+            base = () if x == -1 else chains[x]
+            for p in reversed(path):
+                if len(base) < max_depth:
+                    base = base + (p,)
+                chains[p] = base
+    return chains
+
+
+def _path_components(label: str, ntype: str) -> tuple:
+    """
+    檔案 / registry / process（可執行檔）所在的目錄，依 \\ 或 / 切開；Windows 路徑不分大小寫。
+    network 節點取位址的前幾段（10.0.3.17 -> ("10", "0", "3")）。
+    """
+    txt = label.strip().strip('"')
+    if ntype == "network":
+        return tuple(p for p in re.split(r"[.:]", txt)[:-1] if p)
+    if ntype == "process":
+        tokens = _split_command(txt)
+        exe = next((t.strip('"') for t in tokens if _EXE_RE.search(t.strip('"'))), None)
+        txt = exe or (tokens[0].strip('"') if tokens else txt)
+    if "\\" in txt:
+        parts = [p.casefold() for p in txt.split("\\") if p]
+    elif "/" in txt:
+        parts = [p for p in txt.split("/") if p]
+    else:
+        return ()
+    return tuple(parts[:-1])
+
+
+def node_cluster_keys(G0, by: str = "process_tree", max_depth: int = 8) -> list:
+    """
+    每個節點的分群 key（tuple，由粗到細）：
+      - process_tree：process 為其祖先序列（parent 為時間上第一個碰到它的 process）；
+        其他節點跟著第一個碰到它的 process，沒有的話依類型歸成 ("[type]",)
+      - directory：所在目錄的路徑（process 取可執行檔的目錄）；network 為 ("[network]", 位址前幾段)，
+        其他不像路徑的節點為 ("[type]",)
+      - type：(類型,) 再接目錄路徑 / 位址前幾段
+    """
+    if by not in CLUSTER_MODES:
+        raise ValueError(f"Unknown cluster mode: {by!r} ({', '.join(CLUSTER_MODES)})")
+    n = G0.number_of_nodes()
+    types = [t.lower() for t in G0.types.to_list()]
+    node_type = [types[t] for t in np.asarray(G0.node_type).tolist()]
+    fallback = [(f"[{t or 'unknown'}]",) for t in node_type]
+
+    if by == "process_tree":
+        is_process = np.array([t == "process" for t in node_type], dtype=bool)
+        parent = _first_touch(G0, is_process, is_process)
+        chains = _process_chains(parent, is_process, max_depth)
+        owner = np.where(is_process, np.arange(n), _first_touch(G0, is_process, ~is_process))
+        return [chains[o] if o >= 0 else fallback[i] for i, o in enumerate(owner.tolist())]
+
+    labels = G0.labels.to_list()
+    keys = []
+    for i, l in enumerate(np.asarray(G0.node_label).tolist()):
+        parts = _path_components(labels[l], node_type[i])[:max_depth]
+        if by == "type":
+            keys.append((node_type[i] or "unknown",) + parts)
+        elif node_type[i] == "network" or not parts:
+            keys.append(fallback[i] + parts)
+        else:
+            keys.append(parts)
+    return keys
+
+
+def assign_clusters(keys: list, max_cluster_nodes: int = 500) -> tuple:
+    """
+    以最短、且節點數不超過 max_cluster_nodes 的 key 前綴分群（key 用完就停在最細的一層），
+    所以大群自動往下一層拆開。回傳 (每個節點的 cluster 編號, 各 cluster 的 key 前綴)，
+    cluster 依其第一個節點的順序編號。
+    """
+    counts = Counter(key[:d] for key in keys for d in range(1, len(key) + 1))
+    prefix_of = {}
+    prefixes = []
+    cluster = np.empty(len(keys), dtype=np.int32)
+    for i, key in enumerate(keys):
+        d = 1
+        while d < len(key) and counts[key[:d]] > max_cluster_nodes:
+            d += 1
+        prefix = key[:d]
+        c = prefix_of.get(prefix)
+        if c is None:
+            c = prefix_of[prefix] = len(prefixes)
+            prefixes.append(prefix)
+        cluster[i] = c
+    return cluster, prefixes
+
+
+def _prefix_names(G0, prefixes: list, by: str) -> list:
+    """(簡短名稱, 完整名稱)：process tree 以各層 process 的縮寫相連，目錄以 \\ 相連"""
+    names = []
+    labels, node_label = G0.labels, G0.node_label
+    for prefix in prefixes:
+        if by == "process_tree" and prefix and isinstance(prefix[0], int):
+            parts = [abbreviate_by_shape(labels[node_label[p]], "ellipse") for p in prefix]
+            names.append((parts[-1], " > ".join(parts)))
+        else:
+            full = "\\".join(prefix)
+            names.append((prefix[-1] if prefix else "", full))
+    return names
+
+
+# --------------------------------------------------------------------------------
+# 總覽與 tile
+
+def _cluster_summary(G0, cluster: np.ndarray, k: int, attack: np.ndarray) -> dict:
+    """各 cluster 的節點數、內部邊數、碰到的攻擊邊數與主要類型"""
+    src, dst = np.asarray(G0.edge_src), np.asarray(G0.edge_dst)
+    cs, cd = cluster[src], cluster[dst]
+    internal = cs == cd
+    n_types = len(G0.types)
+    type_count = np.bincount(cluster.astype(np.int64) * n_types + np.asarray(G0.node_type),
+                             minlength=k * n_types).reshape(k, n_types)
+    return {
+        "size": np.bincount(cluster, minlength=k),
+        "internal_edges": np.bincount(cs[internal], minlength=k),
+        "attack_edges": np.bincount(cs[attack], minlength=k) + np.bincount(cd[attack & ~internal], minlength=k),
+        "main_type": type_count.argmax(axis=1),
+    }
+
+
+def _aggregate_edges(G0, eids: np.ndarray, a: np.ndarray, b: np.ndarray, attack: np.ndarray) -> list:
+    """
+    把 eids 依 (a, b)（與 eids 對齊的非負整數）合併，依 (a, b) 排序回傳
+    [(a, b, 條數, 攻擊條數, 最常見的 relation, 第一條攻擊邊的 label 或 "benign")]。
+    """
+    if len(eids) == 0:
+        return []
+    a, b = a.astype(np.int64), b.astype(np.int64)
+    rel = np.asarray(G0.edge_relation)[eids].astype(np.int64)
+    is_attack = attack[eids]
+    width = int(b.max()) + 1
+    pairs, inverse, count = np.unique(a * width + b, return_inverse=True, return_counts=True)
+    n_attack = np.bincount(inverse, weights=is_attack, minlength=len(pairs)).astype(np.int64)
+    # 每組最常見的 relation（同數取 relation 編號小的）
+    n_rel = int(rel.max()) + 1
+    pr, pr_count = np.unique(inverse * n_rel + rel, return_counts=True)
+    best = np.lexsort((pr % n_rel, -pr_count, pr // n_rel))
+    group = (pr // n_rel)[best]
+    head = np.r_[True, group[1:] != group[:-1]]
+    top_rel = np.empty(len(pairs), dtype=np.int64)
+    top_rel[group[head]] = (pr % n_rel)[best][head]
+    # 每組第一條攻擊邊（依 eids 順序）的 label
+    first_attack = np.full(len(pairs), -1, dtype=np.int64)
+    att = np.flatnonzero(is_attack)[::-1]
+    first_attack[inverse[att]] = eids[att]
+    relations, edge_labels, edge_label = G0.relations, G0.edge_labels, G0.edge_label
+    return [(p // width, p % width, c, na, relations[r],
+             edge_labels[edge_label[fa]] if fa >= 0 else "benign")
+            for p, c, na, r, fa in zip(pairs.tolist(), count.tolist(), n_attack.tolist(),
+                                       top_rel.tolist(), first_attack.tolist())]
+
+
+def cluster_node_id(c: int) -> str:
+    """總覽與 proxy 節點的 id（加上前綴，不會與原本的節點 uuid 相撞）"""
+    return f"cluster:{c}"
+
+
+def _aggregated_edge_attrs(count: int, n_attack: int, relation: str, label: str) -> dict:
+    return {"relation": f"{relation} x{count}" if count > 1 else relation,
+            "label": label, "cy_data": {"count": count, "attackCount": n_attack}}
+
+
+class LodView:
+    """
+    分群結果與建總覽 / tile 需要的共用資料（邊的 cluster 端點、攻擊遮罩、各 cluster 統計），
+    同一張圖產生多個 tile 時只算一次。
+    """
+
+    def __init__(self, G0, cluster: np.ndarray, names: list):
+        self.G0 = G0
+        self.cluster = np.asarray(cluster)
+        self.names = names
+        self.k = len(names)
+        self.src, self.dst = np.asarray(G0.edge_src), np.asarray(G0.edge_dst)
+        self.cs, self.cd = self.cluster[self.src], self.cluster[self.dst]
+        self.attack = G0.attack_edge_mask()
+        self.summary = _cluster_summary(G0, self.cluster, self.k, self.attack)
+        self.types = G0.types.to_list()
+
+    def cluster_info(self, c: int) -> dict:
+        s = self.summary
+        return {
+            "cluster": c,
+            "name": self.names[c][1],
+            "size": int(s["size"][c]),
+            "internalEdges": int(s["internal_edges"][c]),
+            "attackEdges": int(s["attack_edges"][c]),
+        }
+
+    def cluster_node(self, c: int, proxy: bool = False) -> tuple:
+        ntype = self.types[int(self.summary["main_type"][c])]
+        info = self.cluster_info(c)
+        if proxy:
+            info["proxy"] = True
+        return cluster_node_id(c), {
+            "label": self.names[c][0],
+            "color": "salmon" if info["attackEdges"] else "skyblue",
+            "shape": SHAPE_BY_TYPE.get(ntype.lower(), "ellipse"),
+            "cy_data": info,
+        }
+
+    def overview(self) -> nx.MultiDiGraph:
+        """cluster 層級的圖：每對 (cluster, cluster) 之間的邊合併成一條"""
+        H = nx.MultiDiGraph()
+        H.add_nodes_from(self.cluster_node(c) for c in range(self.k))
+        cross = np.flatnonzero(self.cs != self.cd)
+        for a, b, count, n_attack, rel, label in _aggregate_edges(
+                self.G0, cross, self.cs[cross], self.cd[cross], self.attack):
+            H.add_edge(cluster_node_id(a), cluster_node_id(b), **_aggregated_edge_attrs(count, n_attack, rel, label))
+        return H
+
+    def tile(self, c: int, nodes: np.ndarray = None, eids: np.ndarray = None) -> nx.MultiDiGraph:
+        """
+        cluster c 的細節圖：節點同 generate_full_graph（id 為原本的 uuid）並帶 cluster 編號；
+        cluster 內的邊原樣保留，對外的邊依 (節點, 方向, 對方 cluster) 合併後接到 proxy 節點 cluster:<j>。
+        nodes / eids（cluster 的節點與碰到它的邊，皆遞增）可由呼叫端先分組後傳入。
+        """
+        G0, cluster, src, dst = self.G0, self.cluster, self.src, self.dst
+        if nodes is None:
+            nodes = np.flatnonzero(cluster == c)
+        if eids is None:
+            eids = np.flatnonzero((self.cs == c) | (self.cd == c))
+        ids, labels, types = G0.node_ids, G0.labels, self.types
+        H = nx.MultiDiGraph()
+        for i in nodes.tolist():
+            ntype = types[G0.node_type[i]]
+            H.add_node(ids[i], label=labels[G0.node_label[i]], type=ntype, color="skyblue",
+                       shape=SHAPE_BY_TYPE.get(ntype.lower(), "ellipse"), cy_data={"cluster": c})
+
+        out_side = self.cs[eids] == c
+        in_side = self.cd[eids] == c
+        for e in eids[out_side & in_side].tolist():
+            H.add_edge(ids[src[e]], ids[dst[e]], **G0.edge_attrs(e))
+
+        outer = eids[out_side != in_side]
+        if len(outer):
+            outgoing = (self.cs[outer] == c).astype(np.int64)
+            inside = np.where(outgoing, src[outer], dst[outer]).astype(np.int64)
+            other = np.where(outgoing, self.cd[outer], self.cs[outer])
+            H.add_nodes_from(self.cluster_node(j, proxy=True) for j in np.unique(other).tolist())
+            for a, j, count, n_attack, rel, label in _aggregate_edges(
+                    G0, outer, inside * 2 + outgoing, other, self.attack):
+                node = ids[a // 2]
+                attrs = _aggregated_edge_attrs(count, n_attack, rel, label)
+                if a % 2:
+                    H.add_edge(node, cluster_node_id(j), **attrs)
+                else:
+                    H.add_edge(cluster_node_id(j), node, **attrs)
+        return H
+
+    def iter_tiles(self):
+        """依 cluster 編號逐一產生 (c, tile)；節點與邊先一次分組，不必每個 tile 掃整張圖"""
+        node_order = np.argsort(self.cluster, kind="stable")
+        node_bounds = np.searchsorted(self.cluster[node_order], np.arange(self.k + 1))
+        # 每條邊屬於 cs 的 tile，若跨 cluster 也屬於 cd 的 tile
+        cross = np.flatnonzero(self.cs != self.cd)
+        owner = np.concatenate([self.cs, self.cd[cross]])
+        edge = np.concatenate([np.arange(len(self.cs)), cross])
+        edge_order = np.lexsort((edge, owner))
+        edge_bounds = np.searchsorted(owner[edge_order], np.arange(self.k + 1))
+        for c in range(self.k):
+            nodes = node_order[node_bounds[c]:node_bounds[c + 1]]
+            eids = edge[edge_order[edge_bounds[c]:edge_bounds[c + 1]]]
+            yield c, self.tile(c, nodes, eids)
+
+
+# --------------------------------------------------------------------------------
+# 匯出
+
+def _export_options(compact, compress, encoding) -> dict:
+    return {"compact": compact, "compress": compress, "encoding": encoding}
+
+
+def _tile_path(out_dir: str, c: int, options: dict) -> str:
+    return os.path.join(out_dir, "tiles", cytoscape_file_name(f"c{c}", options["encoding"], options["compress"]))
+
+
+def generate_lod_graph(
+    graph_pkl_path,
+    out_dir: str,
+    cluster_by: str = "process_tree",
+    max_cluster_nodes: int = 500,
+    max_depth: int = 8,
+    tiles: bool = True,
+    image_out: str = None,
+    layout: str = "dot",
+    compact: bool = False,
+    compress: str = None,
+    encoding: str = "cytoscape",
+    positions: bool = False
+) -> str:
+    """
+    多解析度匯出（輸出目錄結構見模組說明），回傳 index.json 的路徑。
+
+    Args:
+        cluster_by: 'process_tree'、'directory' 或 'type'（見 node_cluster_keys）
+        max_cluster_nodes: cluster 超過此節點數就依 key 往下一層拆開
+        max_depth: key 的最大層數（process tree 深度 / 目錄層數）
+        tiles: False 時只輸出總覽與 index，tile 之後以 export_lod_tile 隨需產生
+        image_out: 以 Graphviz 畫出總覽圖（.png / .svg）
+        compact / compress / encoding: 見 export_cytoscape_json，總覽與 tile 共用
+        positions: 總覽與各 tile 各自以 graph_layout 預先排版，座標寫進 position
+    """
+    G0 = as_compact(load_graph(graph_pkl_path))
+    keys = node_cluster_keys(G0, cluster_by, max_depth)
+    cluster, prefixes = assign_clusters(keys, max_cluster_nodes)
+    view = LodView(G0, cluster, _prefix_names(G0, prefixes, cluster_by))
+    options = _export_options(compact, compress, encoding)
+
+    # 清掉上一次的輸出（舊的 tile 數量可能不同）
+    shutil.rmtree(os.path.join(out_dir, "tiles"), ignore_errors=True)
+    for name in os.listdir(out_dir) if os.path.isdir(out_dir) else ():
+        if name in ("index.json", "clusters.npy") or name.startswith("overview."):
+            os.remove(os.path.join(out_dir, name))
+    os.makedirs(os.path.join(out_dir, "tiles"), exist_ok=True)
+    np.save(os.path.join(out_dir, "clusters.npy"), cluster)
+    overview = view.overview()
+    if positions:
+        apply_layout(overview)
+    overview_name = cytoscape_file_name("overview", encoding, compress)
+    export_cytoscape_json(overview, os.path.join(out_dir, overview_name), **options)
+    if tiles:
+        # tile 可能有上千個，不逐一印出完成訊息（最後統一印一行）
+        with contextlib.redirect_stdout(io.StringIO()):
+            for c, tile in view.iter_tiles():
+                if positions:
+                    apply_layout(tile)
+                export_cytoscape_json(tile, _tile_path(out_dir, c, options), **options)
+
+    index = {
+        "format": LOD_FORMAT_VERSION,
+        "cluster_by": cluster_by,
+        "max_cluster_nodes": max_cluster_nodes,
+        "max_depth": max_depth,
+        "export": options,
+        "positions": bool(positions),
+        "nodes": G0.number_of_nodes(),
+        "edges": G0.number_of_edges(),
+        "overview": overview_name,
+        "clusters": [
+            dict(view.cluster_info(c), id=cluster_node_id(c), label=view.names[c][0],
+                 tile=os.path.relpath(_tile_path(out_dir, c, options), out_dir).replace(os.sep, "/"),
+                 tileReady=bool(tiles))
+            for c in range(view.k)
+        ],
+    }
+    index_path = os.path.join(out_dir, "index.json")
+    with open(index_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False, indent=2)
+
+    if image_out:
+        os.makedirs(os.path.dirname(image_out), exist_ok=True)
+        export_graphviz(overview, image_out, layout)
+    print(f"✅ Exported LOD graph: {view.k} clusters over {G0.number_of_nodes()} nodes to {out_dir}")
+    return index_path
+
+
+def export_lod_tile(graph_pkl_path, out_dir: str, cluster) -> str:
+    """
+    隨需產生單一 tile（例如 generate_lod_graph(..., tiles=False) 之後由前端點開 cluster 時呼叫）。
+    cluster 可為編號或 cluster_node_id（"cluster:<k>"）；分群與輸出設定取自 out_dir 內的 index.json / clusters.npy。
+    已存在時直接回傳路徑。
+    """
+    with open(os.path.join(out_dir, "index.json"), "r", encoding="utf-8") as f:
+        index = json.load(f)
+    c = int(str(cluster).rsplit(":", 1)[-1])
+    options = index["export"]
+    path = _tile_path(out_dir, c, options)
+    if os.path.exists(path):
+        return path
+    G0 = as_compact(load_graph(graph_pkl_path))
+    assignment = np.load(os.path.join(out_dir, "clusters.npy"))
+    if len(assignment) != G0.number_of_nodes():
+        raise ValueError(f"{out_dir} was exported from a different graph")
+    names = [(info["label"], info["name"]) for info in index["clusters"]]
+    tile = LodView(G0, assignment, names).tile(c)
+    if index.get("positions"):
+        apply_layout(tile)
+    export_cytoscape_json(tile, path, **options)
+    return path
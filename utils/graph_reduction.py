@@ -0,0 +1,392 @@
+# utils/graph_reduction.py
+
+import time
+
+import numpy as np
+
+
+# --------------------------------------------------------------------------------
+# 編碼：Cytoscape JSON 的邊 -> 整數陣列（依時間排序）
+
+def _time_order(edges) -> np.ndarray:
+    """
+    與 sorted(edges, key=timestamp 或 inf) 相同的穩定排序。
+    timestamp 全為整數時以 int64 lexsort（避免大整數轉 float 失真），否則退回 Python 排序。
+    """
+    ts = [e["data"].get("timestamp") for e in edges]
+    if all(t is None or (isinstance(t, (int, np.integer)) and not isinstance(t, bool)) for t in ts):
+        missing = np.fromiter((t is None for t in ts), dtype=bool, count=len(ts))
+        values = np.fromiter((0 if t is None else t for t in ts), dtype=np.int64, count=len(ts))
+        return np.lexsort((values, missing))
+    keys = [e["data"].get("timestamp", float("inf")) for e in edges]
+    return np.array(sorted(range(len(edges)), key=keys.__getitem__), dtype=np.int64)
+
+
+def encode_edges(edges, with_label: bool = True):
+    """
+    回傳 (order, src, dst, label)：order 為時間排序後的原始索引，
+    src/dst/label 為依該順序排列的整數編碼（label 不需要時為 None）。
+    """
+    order = _time_order(edges)
+    data = [e["data"] for e in edges]
+    codes = {}
+    intern = lambda v: codes.setdefault(v, len(codes))
+    # 依原始順序編碼（循序存取較快），再以 order 重排
+    src = np.array([intern(d["source"]) for d in data], dtype=np.int64)[order]
+    dst = np.array([intern(d["target"]) for d in data], dtype=np.int64)[order]
+    lab = None
+    if with_label:
+        labels = {}
+        lab = np.array([labels.setdefault(d["label"], len(labels)) for d in data], dtype=np.int64)[order]
+    return order, src, dst, lab
+
+
+# --------------------------------------------------------------------------------
+# 核心演算法（只處理整數陣列，可直接用在 CompactProvenanceGraph 的邊上）
+
+def cpr_groups(src: np.ndarray, dst: np.ndarray, label: np.ndarray) -> np.ndarray:
+    """
+    Causality-Preserving Reduction。輸入須已依時間排序，回傳每條邊所屬的合併群組編號
+    （群組依第一條邊出現順序編號）。同 (src, dst, label) 的邊，只有在兩者之間
+    src 沒有被寫入、dst 沒有往外送出時才合併到前一條。
+    """
+    m = len(src)
+    group = np.empty(m, dtype=np.int64)
+    n = int(max(src.max(initial=-1), dst.max(initial=-1))) + 1
+    last_write = [-1] * n          # node -> 最後一次成為 target 的位置
+    last_send = [-1] * n           # node -> 最後一次成為 source 的位置
+    last_for_pair = {}             # (src, dst, label) -> (群組編號, 開群組的位置)
+    n_groups = 0
+    for i, (s, t, l) in enumerate(zip(src.tolist(), dst.tolist(), label.tolist())):
+        key = (s, t, l)
+        info = last_for_pair.get(key)
+        if info is not None and last_write[s] < info[1] and last_send[t] < info[1]:
+            group[i] = info[0]
+        else:
+            group[i] = n_groups
+            last_for_pair[key] = (n_groups, i)
+            n_groups += 1
+        last_write[t] = i
+        last_send[s] = i
+    return group
+
+
+class FDReducer:
+    """
+    Full Dependence reduction 的增量版本：依到達順序逐條呼叫 keep(src, dst)，
+    若當下已保留的邊中 src 已可到達 dst（含 src == dst）就回傳 False（丟棄）。
+
+    已保留的圖只增不減，所以「可到達」一旦成立就永遠成立，可以逐步維護：
+      - 互相可到達的節點（強連通分量）以 union-find 合併成一個代表節點，
+        同一分量內的查詢 O(1)，搜尋只走分量之間的 DAG；
+      - DAG 上動態維護一組拓撲序（Pearce-Kelly）：order[s] > order[t] 時必定不可到達，
+        其餘查詢以雙向搜尋且只走 order 介於兩者之間的節點；
+      - 保留一條違反拓撲序的邊時只重排受影響區段，若形成環就把環上的分量合併；
+      - 已知可到達的 (src, dst) 會快取起來，重複的邊不必再搜尋。
+    """
+
+    def __init__(self, n: int = 0):
+        self.codes = {}                     # 節點 id -> 整數（keep 用；keep_codes 直接給整數）
+        self.parent = list(range(n))
+        self.order = list(range(n))         # 代表節點的拓撲序
+        self.out = [[] for _ in range(n)]   # 代表節點 -> 出邊端點（可能已過期，用時再 find）
+        self.inn = [[] for _ in range(n)]
+        self.stamp = [0] * n
+        self.dirty = set()                  # 合併過、鄰接串列待去重的代表節點
+        self.mark = 0                       # 最近一次使用的 stamp 值
+        self.reachable_pairs = set()
+
+    def _code(self, node) -> int:
+        code = self.codes.get(node)
+        if code is None:
+            code = self.codes[node] = len(self.parent)
+            self.parent.append(code)
+            self.order.append(code)
+            self.out.append([])
+            self.inn.append([])
+            self.stamp.append(0)
+        return code
+
+    def keep(self, src, dst) -> bool:
+        """任意可 hash 的節點 id"""
+        return self.keep_codes(self._code(src), self._code(dst))
+
+    def keep_codes(self, s: int, t: int) -> bool:
+        """節點已編碼為 0..n-1（n 於建構時給定）"""
+        rs, rt = self._find(s), self._find(t)
+        if rs == rt:
+            return False
+        pair = (s, t)
+        if pair in self.reachable_pairs:
+            return False
+        self.reachable_pairs.add(pair)
+        if self.out[rs] and self.inn[rt] and self._reaches(rs, rt):
+            return False
+        self._insert(rs, rt)
+        return True
+
+    def _find(self, x: int) -> int:
+        parent = self.parent
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    def _neighbours(self, u: int, adj: list) -> list:
+        if u in self.dirty:
+            self.dirty.discard(u)
+            find = self._find
+            self.out[u] = [v for v in {find(v) for v in self.out[u]} if v != u]
+            self.inn[u] = [v for v in {find(v) for v in self.inn[u]} if v != u]
+        return adj[u]
+
+    def _new_marks(self, k: int) -> range:
+        self.mark += k
+        return range(self.mark - k + 1, self.mark + 1)
+
+    def _search(self, start: int, adj: list, lo: int, hi: int, mark: int) -> list:
+        """由 start 沿 adj 走遍 order 在 [lo, hi] 內的代表節點，標記為 mark 並回傳"""
+        parent, order, stamp = self.parent, self.order, self.stamp
+        neighbours, find = self._neighbours, self._find
+        stamp[start] = mark
+        stack = [start]
+        seen = [start]
+        while stack:
+            for v in neighbours(stack.pop(), adj):
+                if parent[v] != v:
+                    v = find(v)
+                if stamp[v] != mark and lo <= order[v] <= hi:
+                    stamp[v] = mark
+                    stack.append(v)
+                    seen.append(v)
+        return seen
+
+    def _reaches(self, a: int, b: int) -> bool:
+        """
+        雙向搜尋 a ~> b：每次展開目前累計工作量（掃過的鄰接數）較小的一側，
+        碰頭即可到達；任一側走完仍未碰頭即不可到達，
+        所以高出度的 hub 不會被優先展開，失敗的代價也只取決於較小的一側。
+        """
+        parent, order, stamp = self.parent, self.order, self.stamp
+        out, inn = self.out, self.inn
+        neighbours, find = self._neighbours, self._find
+        lo, hi = order[a], order[b]
+        if lo > hi:
+            return False
+        fwd, bwd = self._new_marks(2)
+        stamp[a], stamp[b] = fwd, bwd
+        f_stack, b_stack = [a], [b]
+        f_work = b_work = 0
+        while f_stack and b_stack:
+            f_next = len(neighbours(f_stack[-1], out))
+            b_next = len(neighbours(b_stack[-1], inn))
+            if f_work + f_next <= b_work + b_next:
+                stack, adj, mine, other = f_stack, out, fwd, bwd
+                f_work += f_next
+            else:
+                stack, adj, mine, other = b_stack, inn, bwd, fwd
+                b_work += b_next
+            for v in adj[stack.pop()]:
+                if parent[v] != v:
+                    v = find(v)
+                mark = stamp[v]
+                if mark == other:
+                    return True
+                if mark != mine and lo <= order[v] <= hi:
+                    stamp[v] = mine
+                    stack.append(v)
+        return False
+
+    def _insert(self, a: int, b: int):
+        """加入 a -> b，必要時重排拓撲序；形成環時合併環上的分量"""
+        order, stamp, out, inn = self.order, self.stamp, self.out, self.inn
+        out[a].append(b)
+        inn[b].append(a)
+        lo, hi = order[b], order[a]
+        if lo > hi:
+            return
+        f_mark, b_mark, m_mark = self._new_marks(3)
+        fwd = self._search(b, out, lo, hi, f_mark)      # b 之後、受影響的節點
+        bwd = self._search(a, inn, lo, hi, b_mark)      # a 之前、受影響的節點
+        members = [v for v in fwd if stamp[v] == b_mark]
+        for v in members:
+            stamp[v] = m_mark
+        fwd_only = [v for v in fwd if stamp[v] == f_mark]
+        bwd_only = [v for v in bwd if stamp[v] == b_mark]
+        pool = sorted(order[v] for v in fwd + bwd_only)
+        key = order.__getitem__
+        ranked = sorted(bwd_only, key=key) + sorted(members, key=key) + sorted(fwd_only, key=key)
+        for v, o in zip(ranked, pool):
+            order[v] = o
+        if members:
+            root = max(members, key=lambda r: len(out[r]) + len(inn[r]))
+            for r in members:
+                if r != root:
+                    self.parent[r] = root
+                    out[root].extend(out[r])
+                    inn[root].extend(inn[r])
+                    out[r] = []
+                    inn[r] = []
+                    self.dirty.discard(r)
+            self.dirty.add(root)
+
+
+def fd_keep(src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    """
+    Full Dependence reduction（見 FDReducer）。輸入須已依時間排序，回傳保留的 bool mask。
+    """
+    n = int(max(src.max(initial=-1), dst.max(initial=-1))) + 1
+    keep = FDReducer(n).keep_codes
+    return np.fromiter((keep(s, t) for s, t in zip(src.tolist(), dst.tolist())),
+                       dtype=bool, count=len(src))
+
+
+# --------------------------------------------------------------------------------
+# 串流簡化（ingestion 階段：TSV 列 / 事件進圖之前先過濾）
+
+class CPRReducer:
+    """
+    CPR 的增量版本：keep(src, dst, key) 只在該邊會開新群組時回傳 True，
+    之後可合併進同一群組的邊直接丟棄（保留的是群組中最早的一條，與 reduce_cpr 的
+    timestamp = min 一致）。規則同 cpr_groups，節點 id 為任意可 hash 的值。
+    """
+
+    def __init__(self):
+        self.position = 0
+        self.last_write = {}            # node -> 最後一次成為 target 的位置
+        self.last_send = {}             # node -> 最後一次成為 source 的位置
+        self.last_for_pair = {}         # (src, dst, key) -> 開群組的位置
+
+    def keep(self, src, dst, key=None) -> bool:
+        i = self.position
+        self.position += 1
+        pair = (src, dst, key)
+        start = self.last_for_pair.get(pair)
+        merge = (start is not None
+                 and self.last_write.get(src, -1) < start
+                 and self.last_send.get(dst, -1) < start)
+        if not merge:
+            self.last_for_pair[pair] = i
+        self.last_write[dst] = i
+        self.last_send[src] = i
+        return not merge
+
+
+class StreamReducer:
+    """
+    套在 parser 與 build_provenance_graph 之間的串流過濾器，多餘的事件不會寫進 TSV / 圖。
+      - 'cpr'：同 (src, dst, relation, label) 且中間沒有干擾事件的重複邊只留第一條
+      - 'fd'：src 已可到達 dst 的邊丟棄；但非 benign（攻擊）標記的邊一律保留，
+              避免把攻擊邊簡化掉而影響後續計分；帶進新節點的邊也保留
+    事件須大致依時間順序到達（campaign JSON 與 audit log 本身即是）。
+    沒有 dst 的列（build_provenance_graph 只建節點）一律保留。
+    """
+
+    def __init__(self, method: str):
+        method = method.lower()
+        if method not in ("cpr", "fd"):
+            raise ValueError(f"Unknown reduction method: {method!r}; available: ['cpr', 'fd']")
+        self.method = method
+        self._reducer = CPRReducer() if method == "cpr" else FDReducer()
+        self.seen = 0
+        self.kept = 0
+
+    def keep_event(self, src, dst, relation, label) -> bool:
+        self.seen += 1
+        if dst is None or dst == "None":
+            kept = True
+        elif self.method == "cpr":
+            kept = self._reducer.keep(src, dst, (relation, label))
+        else:
+            codes = self._reducer.codes
+            # 第一次出現的節點（例如只有自我迴圈的 process）保留該列，節點才會進圖
+            new_node = src not in codes or dst not in codes
+            kept = (self._reducer.keep(src, dst) or new_node
+                    or str(label).lower() != "benign")
+        self.kept += kept
+        return kept
+
+    def keep_row(self, row) -> bool:
+        """row 為 campaign_to_txt.TSV_COLUMNS 順序的一列"""
+        return self.keep_event(row[0], row[3], row[6], row[8])
+
+    def filter_rows(self, rows):
+        for row in rows:
+            if self.keep_row(row):
+                yield row
+
+    def stats(self) -> dict:
+        return {
+            "method": self.method.upper(),
+            "edges_before": self.seen,
+            "edges_after": self.kept,
+            "ratio": self.kept / self.seen if self.seen else 1.0,
+        }
+
+    def summary(self) -> str:
+        st = self.stats()
+        return (f"{st['method']} reduction: kept {st['edges_after']} / {st['edges_before']} "
+                f"rows (ratio {st['ratio']:.3f})")
+
+
+# --------------------------------------------------------------------------------
+# Cytoscape JSON 介面（與原本 pipeline.reduce_cpr / reduce_fd 輸出相同）
+
+def _stats(method: str, before: int, after: int, seconds: float) -> dict:
+    return {
+        "method": method,
+        "edges_before": before,
+        "edges_after": after,
+        "ratio": after / before if before else 1.0,
+        "seconds": seconds,
+    }
+
+
+def reduce_cpr(graph_json, return_stats: bool = False):
+    """
+    對 Cytoscape JSON 的 edges 做 CPR；合併的邊把所有 timestamp 收進 data["timestamps"]。
+    不做 deepcopy：回傳新的 dict，nodes 與原圖共用，每條輸出邊的 data 是淺拷貝。
+    return_stats=True 時回傳 (graph, stats)，stats 含邊數、reduction ratio 與耗時。
+    """
+    t0 = time.perf_counter()
+    edges = graph_json["edges"]
+    order, src, dst, lab = encode_edges(edges)
+    group = cpr_groups(src, dst, lab)
+
+    new_edges = []
+    for i, g in zip(order.tolist(), group.tolist()):
+        d = edges[i]["data"]
+        ts = d.get("timestamp")
+        if g == len(new_edges):
+            new_edge = {"data": dict(d)}
+            if ts is not None:
+                new_edge["data"]["timestamps"] = [ts]
+            new_edges.append(new_edge)
+        elif ts is not None:
+            pdata = new_edges[g]["data"]
+            pdata.setdefault("timestamps", [pdata["timestamp"]])
+            pdata["timestamps"].append(ts)
+            pdata["timestamp"] = min(pdata["timestamps"])
+
+    out = dict(graph_json, edges=new_edges)
+    if return_stats:
+        return out, _stats("CPR", len(edges), len(new_edges), time.perf_counter() - t0)
+    return out
+
+
+def reduce_fd(graph_json, return_stats: bool = False):
+    """
+    對 Cytoscape JSON 的 edges 做 FD（只保留帶來新可到達關係的邊，依時間順序判斷）。
+    不做 deepcopy：回傳新的 dict，nodes 與原圖共用，保留的邊與其 data 為淺拷貝。
+    return_stats=True 時回傳 (graph, stats)。
+    """
+    t0 = time.perf_counter()
+    edges = graph_json["edges"]
+    order, src, dst, _ = encode_edges(edges, with_label=False)
+    keep = fd_keep(src, dst)
+    new_edges = [dict(edges[i], data=dict(edges[i]["data"])) for i in order[keep].tolist()]
+
+    out = dict(graph_json, edges=new_edges)
+    if return_stats:
+        return out, _stats("FD", len(edges), len(new_edges), time.perf_counter() - t0)
+    return out
@@ -0,0 +1,490 @@
+# utils/graph_store.py
+
+import os
+import json
+import math
+import pickle
+import numbers
+import numpy as np
+import networkx as nx
+
+# 沒有 timestamp（None、空字串或 NaN）
+NO_TIMESTAMP = np.iinfo(np.int64).min
+
+# 目錄格式（save_graph_dir / open_graph_dir）的識別與版本
+GRAPH_FORMAT = "fg-provenance-graph"
+GRAPH_FORMAT_VERSION = 1
+
+
+def parse_timestamp(value) -> int:
+    """
+    邊的 timestamp 轉成整數：整數與整數字串（可為負）原樣、浮點數與浮點字串
+    （例如 "1700000000.5"）取整數部分；None、空字串與 NaN 為 NO_TIMESTAMP。
+    其他值丟出 ValueError，不默默當成缺值（networkx 流程的 int(timestamp) 也會直接失敗）。
+    """
+    if value is None:
+        return NO_TIMESTAMP
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    number = value
+    if isinstance(value, str):
+        text = value.strip()
+        if not text:
+            return NO_TIMESTAMP
+        try:
+            return int(text)
+        except ValueError:
+            pass
+        try:
+            number = float(text)
+        except ValueError:
+            raise ValueError(f"Unparseable edge timestamp: {value!r}") from None
+    if isinstance(number, numbers.Real):
+        if math.isnan(number):
+            return NO_TIMESTAMP
+        if math.isfinite(number):
+            return int(number)
+    raise ValueError(f"Unparseable edge timestamp: {value!r}")
+
+
+class StringTable:
+    """字串 interning：字串 <-> 連續整數代碼"""
+
+    def __init__(self, strings=None):
+        self.strings = list(strings) if strings is not None else []
+        self.index = {s: i for i, s in enumerate(self.strings)}
+
+    def intern(self, s: str) -> int:
+        code = self.index.get(s)
+        if code is None:
+            code = self.index[s] = len(self.strings)
+            self.strings.append(s)
+        return code
+
+    def get_code(self, s: str, default: int = -1) -> int:
+        return self.index.get(s, default)
+
+    def __getitem__(self, code: int) -> str:
+        return self.strings[code]
+
+    def __len__(self) -> int:
+        return len(self.strings)
+
+    def __iter__(self):
+        return iter(self.strings)
+
+    def to_list(self) -> list:
+        return self.strings
+
+    def __getstate__(self):
+        return {"strings": self.strings}
+
+    def __setstate__(self, state):
+        self.__init__(state["strings"])
+
+
+class MappedStringTable:
+    """
+    唯讀字串表：UTF-8 位元組串接成一個 blob，offsets[i]:offsets[i+1] 為第 i 個字串。
+    兩者都以 memmap 開啟，查詢時才解碼；反查用的 dict 在第一次 get_code 時建立。
+    """
+
+    def __init__(self, blob: np.ndarray, offsets: np.ndarray):
+        self.blob = blob
+        self.offsets = offsets
+        self._index = None
+
+    def __getitem__(self, code: int) -> str:
+        start, end = self.offsets[code], self.offsets[code + 1]
+        return self.blob[start:end].tobytes().decode("utf-8")
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __iter__(self):
+        return (self[i] for i in range(len(self)))
+
+    def to_list(self) -> list:
+        raw = self.blob.tobytes()
+        o = self.offsets.tolist()
+        return [raw[o[i]:o[i + 1]].decode("utf-8") for i in range(len(o) - 1)]
+
+    def get_code(self, s: str, default: int = -1) -> int:
+        if self._index is None:
+            self._index = {v: i for i, v in enumerate(self.to_list())}
+        return self._index.get(s, default)
+
+
+class CompactProvenanceGraph:
+    """
+    以整數陣列儲存的 provenance graph（取代 nx.MultiDiGraph pickle）：
+      - 節點 i：node_ids[i] 為 UUID，node_label / node_type 為字串表代碼
+      - 邊 e：edge_src / edge_dst 為節點索引，edge_relation / edge_label 為
+        字串表代碼，edge_timestamp 為 int64（缺值為 NO_TIMESTAMP）
+      - out/in 兩組 CSR（indptr + edge id），第一次使用時才建立
+    節點與邊的順序和 build_provenance_graph 插入 nx 圖的順序相同。
+    """
+
+    def __init__(self, node_ids, node_label, node_type, labels, types,
+                 edge_src, edge_dst, edge_relation, edge_label, edge_timestamp,
+                 relations, edge_labels):
+        self.node_ids = node_ids
+        self.node_label = node_label
+        self.node_type = node_type
+        self.labels = labels
+        self.types = types
+        self.edge_src = edge_src
+        self.edge_dst = edge_dst
+        self.edge_relation = edge_relation
+        self.edge_label = edge_label
+        self.edge_timestamp = edge_timestamp
+        self.relations = relations
+        self.edge_labels = edge_labels
+        self._out = None
+        self._in = None
+
+    # ---------------------------------------------------------------- 基本資訊
+
+    def number_of_nodes(self) -> int:
+        return len(self.node_label)
+
+    def number_of_edges(self) -> int:
+        return len(self.edge_src)
+
+    def node_index(self, uuid: str) -> int:
+        return self.node_ids.get_code(uuid)
+
+    def node_uuid(self, i: int) -> str:
+        return self.node_ids[i]
+
+    def node_label_of(self, i: int) -> str:
+        return self.labels[self.node_label[i]]
+
+    def node_type_of(self, i: int) -> str:
+        return self.types[self.node_type[i]]
+
+    def nbytes(self) -> int:
+        """陣列部分佔用的位元組數（不含字串表）"""
+        arrays = [self.node_label, self.node_type, self.edge_src, self.edge_dst,
+                  self.edge_relation, self.edge_label, self.edge_timestamp]
+        for csr in (self._out, self._in):
+            if csr is not None:
+                arrays.extend(csr)
+        return int(sum(a.nbytes for a in arrays))
+
+    # ---------------------------------------------------------------- 鄰接
+
+    def _csr(self, key: np.ndarray):
+        n = self.number_of_nodes()
+        order = np.argsort(key, kind="stable")
+        indptr = np.zeros(n + 1, dtype=np.int64)
+        np.cumsum(np.bincount(key, minlength=n), out=indptr[1:])
+        return indptr, order.astype(np.int64, copy=False)
+
+    @property
+    def out_csr(self):
+        """(indptr, edge_ids)：節點 i 的出邊為 edge_ids[indptr[i]:indptr[i+1]]"""
+        if self._out is None:
+            self._out = self._csr(self.edge_src)
+        return self._out
+
+    @property
+    def in_csr(self):
+        if self._in is None:
+            self._in = self._csr(self.edge_dst)
+        return self._in
+
+    def out_edges(self, i: int) -> np.ndarray:
+        indptr, eids = self.out_csr
+        return eids[indptr[i]:indptr[i + 1]]
+
+    def in_edges(self, i: int) -> np.ndarray:
+        indptr, eids = self.in_csr
+        return eids[indptr[i]:indptr[i + 1]]
+
+    def successors(self, i: int) -> np.ndarray:
+        return np.unique(self.edge_dst[self.out_edges(i)])
+
+    def predecessors(self, i: int) -> np.ndarray:
+        return np.unique(self.edge_src[self.in_edges(i)])
+
+    def gather_edges(self, nodes: np.ndarray, reverse: bool = False) -> np.ndarray:
+        """一次取出多個節點的所有出邊（reverse=True 為入邊），回傳 edge id 陣列"""
+        indptr, eids = self.in_csr if reverse else self.out_csr
+        starts = indptr[nodes]
+        lens = indptr[np.asarray(nodes) + 1] - starts
+        total = int(lens.sum())
+        if total == 0:
+            return np.zeros(0, dtype=np.int64)
+        offsets = np.repeat(starts - (np.cumsum(lens) - lens), lens)
+        return eids[offsets + np.arange(total)]
+
+    def reachable(self, sources: np.ndarray, reverse: bool = False) -> np.ndarray:
+        """
+        多源 BFS（每層整批展開），回傳 bool 遮罩：可由 sources 沿出邊到達的節點
+        （reverse=True 則沿入邊，即所有祖先）；sources 本身也包含在內。
+        """
+        visited = np.zeros(self.number_of_nodes(), dtype=bool)
+        frontier = np.unique(np.asarray(sources, dtype=np.int64))
+        visited[frontier] = True
+        ends = self.edge_src if reverse else self.edge_dst
+        while len(frontier):
+            nbrs = np.asarray(ends[self.gather_edges(frontier, reverse)])
+            nbrs = np.unique(nbrs[~visited[nbrs]])
+            visited[nbrs] = True
+            frontier = nbrs
+        return visited
+
+    def in_degree(self) -> np.ndarray:
+        return np.bincount(self.edge_dst, minlength=self.number_of_nodes())
+
+    def out_degree(self) -> np.ndarray:
+        return np.bincount(self.edge_src, minlength=self.number_of_nodes())
+
+    # ---------------------------------------------------------------- 屬性
+
+    def edge_label_mask(self, pred) -> np.ndarray:
+        """pred 只對每個不同的 label 字串呼叫一次，再展開成每條邊的 bool 陣列"""
+        lookup = np.fromiter((bool(pred(s)) for s in self.edge_labels),
+                             dtype=bool, count=len(self.edge_labels))
+        if len(lookup) == 0:
+            return np.zeros(self.number_of_edges(), dtype=bool)
+        return lookup[self.edge_label]
+
+    def attack_edge_mask(self) -> np.ndarray:
+        """label 不是 benign（不分大小寫）的邊，同 node_score 的判斷"""
+        return self.edge_label_mask(lambda s: s.lower() != "benign")
+
+    def edges_by_time(self) -> np.ndarray:
+        """依 timestamp 穩定排序的 edge id；缺 timestamp 的邊排最後"""
+        ts = self.edge_timestamp
+        key = np.where(ts == NO_TIMESTAMP, np.iinfo(np.int64).max, ts)
+        return np.argsort(key, kind="stable")
+
+    def edge_attrs(self, e: int) -> dict:
+        attrs = {"relation": self.relations[self.edge_relation[e]]}
+        ts = int(self.edge_timestamp[e])
+        if ts != NO_TIMESTAMP:
+            attrs["timestamp"] = ts
+        attrs["label"] = self.edge_labels[self.edge_label[e]]
+        return attrs
+
+    # ---------------------------------------------------------------- 轉換
+
+    def to_networkx(self) -> nx.MultiDiGraph:
+        """轉回與 build_provenance_graph 相同內容、相同順序的 nx.MultiDiGraph"""
+        G = nx.MultiDiGraph()
+        labels, types, ids = self.labels.to_list(), self.types.to_list(), self.node_ids.to_list()
+        G.add_nodes_from(
+            (ids[i], {"label": labels[l], "type": types[t]})
+            for i, (l, t) in enumerate(zip(self.node_label.tolist(), self.node_type.tolist()))
+        )
+        rel, elab = self.relations.to_list(), self.edge_labels.to_list()
+        for u, v, r, lab, ts in zip(self.edge_src.tolist(), self.edge_dst.tolist(),
+                                    self.edge_relation.tolist(), self.edge_label.tolist(),
+                                    self.edge_timestamp.tolist()):
+            if ts == NO_TIMESTAMP:
+                G.add_edge(ids[u], ids[v], relation=rel[r], label=elab[lab])
+            else:
+                G.add_edge(ids[u], ids[v], relation=rel[r], timestamp=ts, label=elab[lab])
+        return G
+
+    @classmethod
+    def from_networkx(cls, G: nx.Graph) -> "CompactProvenanceGraph":
+        b = CompactGraphBuilder()
+        for n, d in G.nodes(data=True):
+            b.add_node(n, str(d.get("label", n)), str(d.get("type", "Unknown")))
+        for u, v, d in G.edges(data=True):
+            b.add_edge(u, v, str(d.get("relation", "")), d.get("timestamp"), str(d.get("label", "")))
+        return b.build()
+
+    @classmethod
+    def from_tsv(cls, txt_path: str) -> "CompactProvenanceGraph":
+        """直接從 campaign_to_txt 產生的 TSV 建圖，規則同 build_provenance_graph"""
+        with open(txt_path, "r", encoding="utf-8") as f:
+            return cls.from_rows(line.strip().split('\t') for line in f)
+
+    @classmethod
+    def from_rows(cls, rows) -> "CompactProvenanceGraph":
+        """由已拆好的 TSV 欄位（9 個字串）建圖，欄位數不符的列略過"""
+        b = CompactGraphBuilder()
+        for fields in rows:
+            if len(fields) != 9:
+                continue
+            b.add_row(*fields)
+        return b.build()
+
+
+class CompactGraphBuilder:
+    """逐筆累積節點與邊（append 到 Python list），最後一次轉成 numpy 陣列"""
+
+    def __init__(self):
+        self.node_ids = StringTable()
+        self.labels = StringTable()
+        self.types = StringTable()
+        self.relations = StringTable()
+        self.edge_labels = StringTable()
+        self.node_label = []
+        self.node_type = []
+        self.src, self.dst, self.rel, self.lab, self.ts = [], [], [], [], []
+
+    def add_node(self, uuid: str, label: str, ntype: str) -> int:
+        i = self.node_ids.get_code(uuid)
+        if i < 0:
+            i = self.node_ids.intern(uuid)
+            self.node_label.append(self.labels.intern(label))
+            self.node_type.append(self.types.intern(ntype))
+        return i
+
+    def add_edge(self, src_uuid: str, dst_uuid: str, relation: str, timestamp, label: str):
+        ids = self.node_ids
+        self.src.append(ids.get_code(src_uuid))
+        self.dst.append(ids.get_code(dst_uuid))
+        self.rel.append(self.relations.intern(relation))
+        self.lab.append(self.edge_labels.intern(label))
+        if isinstance(timestamp, int):
+            self.ts.append(timestamp)
+        elif isinstance(timestamp, str) and timestamp.isdigit():
+            self.ts.append(int(timestamp))
+        else:
+            self.ts.append(parse_timestamp(timestamp))
+
+    def add_row(self, src_uuid, src_label, src_type, dst_uuid, dst_label, dst_type,
+                relation, timestamp, label):
+        """一列 TSV（9 個字串欄位）"""
+        self.add_node(src_uuid, src_label, src_type)
+        if dst_uuid != "None":
+            self.add_node(dst_uuid, dst_label, dst_type)
+            self.add_edge(src_uuid, dst_uuid, relation, timestamp, label)
+
+    def build(self) -> CompactProvenanceGraph:
+        return CompactProvenanceGraph(
+            node_ids=self.node_ids,
+            node_label=np.array(self.node_label, dtype=np.int32),
+            node_type=np.array(self.node_type, dtype=np.int32),
+            labels=self.labels,
+            types=self.types,
+            edge_src=np.array(self.src, dtype=np.int32),
+            edge_dst=np.array(self.dst, dtype=np.int32),
+            edge_relation=np.array(self.rel, dtype=np.int32),
+            edge_label=np.array(self.lab, dtype=np.int32),
+            edge_timestamp=np.array(self.ts, dtype=np.int64),
+            relations=self.relations,
+            edge_labels=self.edge_labels,
+        )
+
+
+def as_compact(G) -> CompactProvenanceGraph:
+    """nx 圖轉成 CompactProvenanceGraph；已經是的話原樣回傳"""
+    if isinstance(G, CompactProvenanceGraph):
+        return G
+    return CompactProvenanceGraph.from_networkx(G)
+
+
+def as_networkx(G) -> nx.Graph:
+    if isinstance(G, CompactProvenanceGraph):
+        return G.to_networkx()
+    return G
+
+
+_ARRAYS = ["node_label", "node_type", "edge_src", "edge_dst",
+           "edge_relation", "edge_label", "edge_timestamp"]
+_TABLES = ["node_ids", "labels", "types", "relations", "edge_labels"]
+
+
+def save_graph_dir(G, dir_path: str):
+    """
+    把圖寫成可 memmap 的目錄格式：
+      meta.json                 格式名稱、版本、節點/邊數、陣列 dtype
+      <array>.npy               節點/邊屬性陣列與 out/in CSR
+      <table>.strings.bin       字串表 UTF-8 blob
+      <table>.offsets.npy       字串表 offsets（int64，長度 n+1）
+    """
+    G = as_compact(G)
+    os.makedirs(dir_path, exist_ok=True)
+    arrays = {name: getattr(G, name) for name in _ARRAYS}
+    arrays["out_indptr"], arrays["out_eids"] = G.out_csr
+    arrays["in_indptr"], arrays["in_eids"] = G.in_csr
+    for name, arr in arrays.items():
+        np.save(os.path.join(dir_path, f"{name}.npy"), np.ascontiguousarray(arr))
+    for name in _TABLES:
+        encoded = [x.encode("utf-8") for x in getattr(G, name).to_list()]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        with open(os.path.join(dir_path, f"{name}.strings.bin"), "wb") as f:
+            f.write(b"".join(encoded))
+        np.save(os.path.join(dir_path, f"{name}.offsets.npy"), offsets)
+
+    meta = {
+        "format": GRAPH_FORMAT,
+        "version": GRAPH_FORMAT_VERSION,
+        "nodes": G.number_of_nodes(),
+        "edges": G.number_of_edges(),
+        "arrays": {name: str(arr.dtype) for name, arr in arrays.items()},
+        "tables": _TABLES,
+    }
+    # meta.json 最後寫，作為目錄完整寫入的標記
+    with open(os.path.join(dir_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+
+
+def open_graph_dir(dir_path: str, mmap: bool = True) -> CompactProvenanceGraph:
+    """
+    開啟 save_graph_dir 寫出的目錄。mmap=True 時所有陣列以 numpy memmap 唯讀開啟，
+    開檔為 O(1)，實際用到的分頁才會讀進記憶體，多個階段可共用同一份 mapping。
+    """
+    with open(os.path.join(dir_path, "meta.json"), "r", encoding="utf-8") as f:
+        meta = json.load(f)
+    if meta.get("format") != GRAPH_FORMAT:
+        raise ValueError(f"{dir_path} is not a {GRAPH_FORMAT} directory")
+    if meta.get("version") != GRAPH_FORMAT_VERSION:
+        raise ValueError(f"Unsupported graph format version {meta.get('version')} "
+                         f"(expected {GRAPH_FORMAT_VERSION})")
+
+    mode = "r" if mmap else None
+
+    def arr(name):
+        return np.load(os.path.join(dir_path, f"{name}.npy"), mmap_mode=mode)
+
+    def table(name):
+        blob_path = os.path.join(dir_path, f"{name}.strings.bin")
+        if os.path.getsize(blob_path) == 0:
+            blob = np.zeros(0, dtype=np.uint8)
+        elif mmap:
+            blob = np.memmap(blob_path, dtype=np.uint8, mode="r")
+        else:
+            blob = np.fromfile(blob_path, dtype=np.uint8)
+        return MappedStringTable(blob, arr(f"{name}.offsets"))
+
+    G = CompactProvenanceGraph(
+        node_ids=table("node_ids"),
+        node_label=arr("node_label"),
+        node_type=arr("node_type"),
+        labels=table("labels"),
+        types=table("types"),
+        edge_src=arr("edge_src"),
+        edge_dst=arr("edge_dst"),
+        edge_relation=arr("edge_relation"),
+        edge_label=arr("edge_label"),
+        edge_timestamp=arr("edge_timestamp"),
+        relations=table("relations"),
+        edge_labels=table("edge_labels"),
+    )
+    G._out = (arr("out_indptr"), arr("out_eids"))
+    G._in = (arr("in_indptr"), arr("in_eids"))
+    return G
+
+
+def load_graph(graph):
+    """
+    取得圖物件（不做格式轉換）：
+      - 已載入的圖（nx 或 CompactProvenanceGraph）：原樣回傳，讓多個階段共用
+      - 目錄：open_graph_dir（memmap）
+      - 其它路徑：pickle（nx 或 compact）
+    """
+    if not isinstance(graph, (str, os.PathLike)):
+        return graph
+    if os.path.isdir(graph):
+        return open_graph_dir(graph)
+    with open(graph, "rb") as f:
+        return pickle.load(f)
@@ -0,0 +1,202 @@
+# utils/isolation_forest.py
+"""
+向量化、批次計分的 Isolation Forest（Liu et al., 2008）。
+
+每棵樹以完全二元樹（heap 編號）的扁平陣列儲存（feature / split / 最底層的路徑長度），
+整座森林串接成同一組陣列；建樹以明確的 stack 迭代，計分時一批資料點同時逐層往下走，
+皆不使用遞迴。提早結束的葉節點一律往左走到最底層，因此固定走 max_depth 層即可，不需分支。
+每棵樹有 2 ** (max_depth + 1) - 1 個節點槽位，預設 ψ = 256 時為 511。
+
+    forest = IsolationForest(n_trees=100, sample_size=256, seed=0).fit(X)
+    scores = forest.score_samples(X)      # s(x) = 2 ** (-E[h(x)] / c(ψ))，越接近 1 越異常
+
+X 可以是 numpy.memmap（例如 embedding_service 寫出的 .emb.npy），fit 只讀取抽樣到的列，
+score_samples 分塊讀取，百萬筆資料的記憶體用量只與 chunk_size 有關。
+"""
+
+import os
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+EULER_GAMMA = 0.5772156649015329
+
+
+def average_path_length(n) -> np.ndarray:
+    """c(n)：n 個點的 BST 不成功搜尋平均路徑長度，用於正規化與葉節點的路徑補正"""
+    n = np.asarray(n, dtype=np.float64)
+    out = np.zeros_like(n)
+    out[n == 2] = 1.0
+    big = n > 2
+    out[big] = 2.0 * (np.log(n[big] - 1.0) + EULER_GAMMA) - 2.0 * (n[big] - 1.0) / n[big]
+    return out
+
+
+def _build_tree(X: np.ndarray, rng: np.random.Generator, max_depth: int):
+    """
+    以 stack 迭代建一棵樹，節點依完全二元樹（heap）編號：k 的子節點為 2k+1 / 2k+2。
+    每個節點負責 order[start:end] 這段資料列，分割時只重排這一段，不複製子集合。
+    提早結束的葉節點 split 為 +inf（一律往左走），其路徑長度記在一直往左走到最底層的位置，
+    所以計分時每個點都固定走 max_depth 層。
+    回傳 (feature, split, path)，path 只有最底層有值：葉節點深度 + c(葉大小)。
+    """
+    n = X.shape[0]
+    nodes = 2 ** (max_depth + 1) - 1
+    feature = np.zeros(nodes, dtype=np.intp)
+    split = np.full(nodes, np.inf)
+    path = np.zeros(nodes, dtype=np.float64)
+    order = np.arange(n)
+    stack = [(0, 0, n, 0)]    # (節點, start, end, 深度)
+    while stack:
+        node, start, end, depth = stack.pop()
+        size = end - start
+        if size > 1 and depth < max_depth:
+            rows = X[order[start:end]]
+            lo, hi = rows.min(axis=0), rows.max(axis=0)
+            splittable = np.flatnonzero(hi > lo)
+        else:
+            splittable = ()
+        if len(splittable) == 0:
+            bottom = (node + 1) * 2 ** (max_depth - depth) - 1
+            path[bottom] = depth + average_path_length(size)
+            continue
+        q = splittable[rng.integers(len(splittable))]
+        p = rng.uniform(lo[q], hi[q])
+        mask = rows[:, q] < p
+        segment = order[start:end]
+        order[start:end] = np.concatenate([segment[mask], segment[~mask]])
+        mid = start + int(mask.sum())
+        feature[node], split[node] = q, p
+        stack.append((2 * node + 2, mid, end, depth + 1))
+        stack.append((2 * node + 1, start, mid, depth + 1))
+    return feature, split, path
+
+
+def _fit_trees(samples: list, seeds: list, max_depth: int) -> list:
+    """process pool 的工作單位：一批樹（只傳抽樣後的小矩陣，不傳整份 X）"""
+    return [_build_tree(sample, np.random.default_rng(seed), max_depth)
+            for sample, seed in zip(samples, seeds)]
+
+
+class IsolationForest:
+    """
+    n_trees     : 樹的數量
+    sample_size : 每棵樹抽樣的資料列數 ψ（不放回；資料不足時取全部）
+    max_depth   : 樹高上限，預設 ceil(log2(ψ))
+    seed        : 抽樣與分割的亂數種子；每棵樹有獨立的子種子，平行與否結果相同
+    n_jobs      : 建樹的 process 數，None = CPU 數，1 = 在目前 process 內建樹
+    """
+
+    def __init__(self, n_trees: int = 100, sample_size: int = 256, max_depth: int = None,
+                 seed: int = None, n_jobs: int = None):
+        self.n_trees = n_trees
+        self.sample_size = sample_size
+        self.max_depth = max_depth
+        self.seed = seed
+        self.n_jobs = n_jobs
+        self.threshold = 0.5
+
+    def fit(self, X, contamination: float = None):
+        """
+        建樹。contamination（預期異常比例）有給時，以訓練資料分數的
+        (1 - contamination) 分位數作為 predict 的門檻，否則門檻為 0.5。
+        """
+        X = X if isinstance(X, np.ndarray) else np.asarray(X)
+        if X.ndim != 2 or X.shape[0] == 0:
+            raise ValueError(f"X must be a non-empty 2-D array, got shape {X.shape}")
+        n = X.shape[0]
+        psi = min(self.sample_size, n)
+        depth = self.max_depth if self.max_depth is not None else max(int(np.ceil(np.log2(max(psi, 2)))), 1)
+        rng = np.random.default_rng(self.seed)
+        seeds = np.random.SeedSequence(self.seed).spawn(self.n_trees)
+        # 排序後的索引對 memmap 是循序讀取
+        samples = [np.ascontiguousarray(X[np.sort(rng.choice(n, size=psi, replace=False))])
+                   for _ in range(self.n_trees)]
+
+        workers = min(self.n_jobs or os.cpu_count() or 1, self.n_trees)
+        if workers <= 1:
+            trees = _fit_trees(samples, seeds, depth)
+        else:
+            bounds = np.linspace(0, self.n_trees, workers + 1).astype(int)
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(_fit_trees, samples[a:b], seeds[a:b], depth)
+                           for a, b in zip(bounds[:-1], bounds[1:])]
+                trees = [tree for f in futures for tree in f.result()]
+
+        self._pack(trees)
+        self.n_features = X.shape[1]
+        self.psi = psi
+        self.depth = depth
+        if contamination is not None:
+            self.threshold = float(np.quantile(self.score_samples(X), 1.0 - contamination))
+        return self
+
+    def _pack(self, trees: list):
+        """把各棵樹的節點陣列串接成一組，第 t 棵樹的節點 k 位於 roots[t] + k"""
+        nodes = len(trees[0][0])
+        self.roots = np.arange(len(trees), dtype=np.intp) * nodes
+        self.feature = np.concatenate([t[0] for t in trees])
+        self.split_value = np.concatenate([t[1] for t in trees])
+        self.path = np.concatenate([t[2] for t in trees])
+
+    def path_length(self, X, chunk_size: int = 8192) -> np.ndarray:
+        """
+        每個資料點在所有樹上的平均路徑長度 E[h(x)]。
+        一個 chunk 的點同時走一棵樹：每層以 take 取出各點目前節點的 feature / split，
+        比較後 node = 2 * node + 1 + (x >= split)，不需要 left / right 陣列，也沒有分支；
+        chunk_size 讓 chunk 與單棵樹的節點表都留在 cache 內。
+        """
+        if not hasattr(self, "roots"):
+            raise RuntimeError("IsolationForest is not fitted; call fit() first")
+        X = X if isinstance(X, np.ndarray) else np.asarray(X)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"X must have shape (n, {self.n_features}), got {X.shape}")
+        n, d = X.shape
+        out = np.empty(n, dtype=np.float64)
+        node = np.empty(min(chunk_size, n), dtype=np.intp)
+        index = np.empty_like(node)
+        for start in range(0, n, chunk_size):
+            block = np.ascontiguousarray(X[start:start + chunk_size])
+            b = len(block)
+            flat = block.ravel()
+            row_offset = np.arange(b, dtype=np.intp) * d
+            total = np.zeros(b, dtype=np.float64)
+            for root in self.roots:
+                local = node[:b]
+                local.fill(0)
+                for _ in range(self.depth):
+                    at = np.add(local, root, out=index[:b])
+                    go_right = flat.take(self.feature.take(at) + row_offset) >= self.split_value.take(at)
+                    local *= 2
+                    local += 1
+                    local += go_right
+                total += self.path.take(np.add(local, root, out=index[:b]))
+            out[start:start + b] = total / len(self.roots)
+        return out
+
+    def score_samples(self, X, chunk_size: int = 8192) -> np.ndarray:
+        """標準異常分數 s(x) = 2 ** (-E[h(x)] / c(ψ))，範圍 (0, 1]，越高越異常"""
+        norm = average_path_length(self.psi)
+        if norm == 0:    # ψ = 1：所有點路徑長度皆為 0
+            return np.full(len(X), 0.5)
+        return np.exp2(-self.path_length(X, chunk_size) / norm)
+
+    def predict(self, X, threshold: float = None, chunk_size: int = 8192) -> np.ndarray:
+        """分數 >= 門檻的點為異常（bool 陣列）；門檻預設為 fit 時決定的 self.threshold"""
+        return self.score_samples(X, chunk_size) >= (self.threshold if threshold is None else threshold)
+
+    def save(self, path: str):
+        """以 .npz 儲存森林（扁平陣列），之後用 IsolationForest.load 讀回"""
+        np.savez(path, roots=self.roots, feature=self.feature, split_value=self.split_value,
+                 path=self.path,
+                 meta=np.array([self.n_features, self.psi, self.depth, self.threshold]))
+
+    @classmethod
+    def load(cls, path: str) -> "IsolationForest":
+        data = np.load(path)
+        n_features, psi, depth, threshold = data["meta"]
+        forest = cls(n_trees=len(data["roots"]), sample_size=int(psi), max_depth=int(depth))
+        for key in ("roots", "feature", "split_value", "path"):
+            setattr(forest, key, data[key])
+        forest.n_features, forest.psi, forest.depth = int(n_features), int(psi), int(depth)
+        forest.threshold = float(threshold)
+        return forest
@@ -2,13 +2,28 @@
 
 import networkx as nx
 import pickle
+from graph_store import CompactProvenanceGraph, save_graph_dir
 
-def build_provenance_graph(txt_path, pkl_path):
+def build_provenance_graph(txt_path, pkl_path, backend: str = "networkx"):
     """
     從 .txt 建立 provenance graph 並儲存為 .pkl。
     :param txt_path: 輸入檔案路徑（tab 分隔格式）
     :param pkl_path: 輸出圖檔路徑（pickle）
+    :param backend: 'networkx'（nx.MultiDiGraph）或 'compact'（CompactProvenanceGraph，
+                    整數陣列儲存，記憶體與建圖時間都小很多）；
+                    'mmap' 則把 compact 圖寫成 pkl_path 目錄（見 graph_store.save_graph_dir）
     """
+    if backend in ("compact", "mmap"):
+        G = CompactProvenanceGraph.from_tsv(txt_path)
+        if backend == "mmap":
+            save_graph_dir(G, pkl_path)
+        else:
+            with open(pkl_path, "wb") as f:
+                pickle.dump(G, f, protocol=pickle.HIGHEST_PROTOCOL)
+        print(f" Graph saved: {pkl_path}")
+        print(f"節點數量: {G.number_of_nodes()}，邊數量: {G.number_of_edges()}")
+        return
+
     G = nx.MultiDiGraph()
 
     with open(txt_path, "r", encoding="utf-8") as f:
@@ -1,80 +1,97 @@
 # utils/node_score.py
 
-import networkx as nx
+import numpy as np
 import pandas as pd
-import pickle
-import os
+from graph_store import load_graph, CompactProvenanceGraph
+from score_engine import compute_scores
 
-def compute_node_scores(graph_pkl_path, output_csv_path):
+def _edge_arrays(G):
     """
-    計算 provenance graph 中每個節點的分數：
-      1. base_score = indegree + outdegree
-      2. 將 base_score 正規化到 [0, 1] 之間
-      3. 如果有攻擊關聯（非 benign），最終分數再 +1
-    並輸出為 CSV。
+    取出計分需要的陣列：節點 id/label/type 清單、邊的 src/dst 節點索引，
+    以及每條邊是否為攻擊邊（label 不是 benign，不分大小寫）。
     """
-    # 1. 載入圖
-    with open(graph_pkl_path, "rb") as f:
-        G = pickle.load(f)
+    if isinstance(G, CompactProvenanceGraph):
+        labels, types = G.labels.to_list(), G.types.to_list()
+        return (G.node_ids.to_list(),
+                [labels[c] for c in G.node_label.tolist()],
+                [types[c] for c in G.node_type.tolist()],
+                np.asarray(G.edge_src), np.asarray(G.edge_dst),
+                G.attack_edge_mask())
 
-    # --- 第一階段：計算所有節點的 base_score 和 has_attack ---
-    node_info = []
-    max_base_score = 0
-    for node in G.nodes():
-        indeg = G.in_degree(node)
-        outdeg = G.out_degree(node)
-        base_score = indeg + outdeg
+    nodes = list(G.nodes())
+    index = {n: i for i, n in enumerate(nodes)}
+    m = G.number_of_edges()
+    src = np.empty(m, dtype=np.int64)
+    dst = np.empty(m, dtype=np.int64)
+    attack = np.empty(m, dtype=bool)
+    is_attack = {}    # 同一個 label 字串只判斷一次
+    for k, (u, v, lab) in enumerate(G.edges(data="label", default="")):
+        src[k] = index[u]
+        dst[k] = index[v]
+        flag = is_attack.get(lab)
+        if flag is None:
+            flag = is_attack[lab] = lab.lower() != "benign"
+        attack[k] = flag
+    node_label = [d.get("label", "Unknown") for _, d in G.nodes(data=True)]
+    node_type = [d.get("type", "Unknown") for _, d in G.nodes(data=True)]
+    return nodes, node_label, node_type, src, dst, attack
+
+
+def score_nodes(G, extra_scores=(), score_params: dict = None) -> pd.DataFrame:
+    """
+    向量化計分（結果與逐節點計算相同）：
+      1. indegree / outdegree 以 bincount 一次算出所有節點
+      2. has_attack：攻擊邊的兩端節點
+      3. final_score = base_score / max(base_score) (+1 若 has_attack)
+    extra_scores 為 score_engine 註冊的計分名稱（例如 "pagerank"、"decay_degree"、
+    "relation_rarity"、"isolation_forest"），會以同名欄位附加在 final_score 之後。
+    """
+    nodes, node_label, node_type, src, dst, attack = _edge_arrays(G)
+    n = len(nodes)
+    if n == 0:
+        return pd.DataFrame([])
 
-        if base_score > max_base_score:
-            max_base_score = base_score
+    indeg = np.bincount(dst, minlength=n)
+    outdeg = np.bincount(src, minlength=n)
+    base_score = indeg + outdeg
 
-        has_attack = any(
-            d.get("label", "").lower() != "benign"
-            for _, _, d in G.in_edges(node, data=True)
-        ) or any(
-            d.get("label", "").lower() != "benign"
-            for _, _, d in G.out_edges(node, data=True)
-        )
-        
-        node_info.append({
-            "node_uuid": node,
-            "indegree": indeg,
-            "outdegree": outdeg,
-            "base_score": base_score,
-            "has_attack": has_attack
-        })
+    has_attack = np.zeros(n, dtype=bool)
+    has_attack[src[attack]] = True
+    has_attack[dst[attack]] = True
 
-    # --- 第二階段：正規化並計算 final_score ---
-    node_scores = []
     # 防止 max_base_score 為 0 導致除錯
-    if max_base_score == 0:
-        max_base_score = 1
+    max_base_score = int(base_score.max()) or 1
+    final_score = base_score / max_base_score + has_attack
 
-    for info in node_info:
-        # 將 base_score 正規化到 [0, 1]
-        normalized_score = info["base_score"] / max_base_score
-        
-        # 如果是攻擊節點，分數 +1
-        final_score = normalized_score + 1 if info["has_attack"] else normalized_score
-        
-        # 取出節點屬性
-        node_uuid = info["node_uuid"]
-        label = G.nodes[node_uuid].get("label", "Unknown")
-        ntype = G.nodes[node_uuid].get("type", "Unknown")
+    df = pd.DataFrame({
+        "node_uuid": nodes,
+        "node_label": node_label,
+        "node_type": node_type,
+        "indegree": indeg,
+        "outdegree": outdeg,
+        "base_score": base_score,
+        "final_score": final_score,
+    })
+    if extra_scores:
+        for name, values in compute_scores(G, extra_scores, score_params).items():
+            df[name] = values
+    return df
 
-        node_scores.append({
-            "node_uuid": node_uuid,
-            "node_label": label,
-            "node_type": ntype,
-            "indegree": info["indegree"],
-            "outdegree": info["outdegree"],
-            "base_score": info["base_score"],
-            "final_score": final_score
-        })
 
-    # 5. 輸出 CSV
-    df = pd.DataFrame(node_scores)
-    output_csv_path = os.path.join(output_csv_path)
+def compute_node_scores(graph_pkl_path, output_csv_path, extra_scores=(), score_params: dict = None):
+    """
+    計算 provenance graph 中每個節點的分數：
+      1. base_score = indegree + outdegree
+      2. 將 base_score 正規化到 [0, 1] 之間
+      3. 如果有攻擊關聯（非 benign），最終分數再 +1
+    並輸出為 CSV。
+    graph_pkl_path 可以是 pickle 路徑、memmap 圖目錄，或已載入的圖物件。
+    extra_scores / score_params 見 score_nodes。
+    """
+    G = load_graph(graph_pkl_path)
+    df = score_nodes(G, extra_scores, score_params)
+
+    # 輸出 CSV
     df.to_csv(output_csv_path, index=False, encoding="utf-8")
     print(f"✅ Final node scores saved to {output_csv_path}")
     # ... (計算完 node_scores 之後)
@@ -1,101 +1,33 @@
 import os
-from campaign_to_txt import convert_json_to_txt
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+import pickle
+from campaign_to_txt import convert_json_to_txt, iter_campaign_rows, iter_tsv_fields, tsv_writer
 from log_to_prov import build_provenance_graph
-from node_score import compute_node_scores
-from generate_graph import generate_full_graph, generate_attack_graph
+from node_score import compute_node_scores, score_nodes
+from generate_graph import generate_full_graph, generate_attack_graph, cytoscape_file_name
+from graph_lod import generate_lod_graph
+from graph_layout import default_layout_cache
+from graph_store import load_graph, save_graph_dir, CompactProvenanceGraph
+from graph_reduction import StreamReducer
+from stage_cache import StageCache, file_digest, code_version, stage_key
+import campaign_to_txt
+import graph_reduction
+import log_to_prov
+import graph_store
+import node_score
+import score_engine
+import isolation_forest
+import generate_graph
+import graph_lod
+import graph_layout
 
 
 # utils/pipeline.py
 
-import copy
-
-def reduce_cpr(graph_json):
-    out   = copy.deepcopy(graph_json)
-    edges = sorted(out["edges"],
-                   key=lambda e: e["data"].get("timestamp", float("inf")))
-
-    new_edges      = []
-    last_for_pair  = {}           # (src,tgt,label) ➜ {"edge":…, "idx":…}
-    last_write_src = {}           # node ➜ idx (edge.target == node)
-    last_send_tgt  = {}           # node ➜ idx (edge.source == node)
-
-    for idx, e in enumerate(edges):
-        d   = e["data"]
-        src, tgt, lab = d["source"], d["target"], d["label"]
-        ts  = d.get("timestamp")
-        key = (src, tgt, lab)
-
-        info = last_for_pair.get(key)
-        can_merge = False
-        if info:
-            prev_idx = info["idx"]
-            # 若兩種「干擾事件」的最近位置都在 prev_idx 之前 ➜ 安全合併
-            can_merge = (
-                last_write_src.get(src,  -1) < prev_idx and
-                last_send_tgt.get(tgt,  -1) < prev_idx
-            )
-        if can_merge:
-            prev_edge = info["edge"]
-            pdata = prev_edge["data"]
-            if ts is not None:
-                pdata.setdefault("timestamps", [pdata["timestamp"]])
-                pdata["timestamps"].append(ts)
-                pdata["timestamp"] = min(pdata["timestamps"])
-        else:
-            # 新開一條邊
-            new_edge = {"data": dict(d)}  # 若還要保留其他欄位可改 copy.deepcopy(e)
-            if ts is not None:
-                new_edge["data"]["timestamps"] = [ts]
-            new_edges.append(new_edge)
-            last_for_pair[key] = {"edge": new_edge, "idx": idx}
-
-        # 無論合併與否，都要更新「最後一次發生位置」索引
-        last_write_src[tgt]  = idx     # 這條邊寫入了 tgt
-        last_send_tgt[src]   = idx     # 這條邊來自  src
-
-    out["edges"] = new_edges
-    return out
-
-
-
-def reduce_fd(graph_json):
-    out = copy.deepcopy(graph_json)
-    sorted_edges = sorted(
-        out['edges'],
-        key=lambda e: e['data'].get('timestamp', float('inf'))
-    )
-
-    def is_reachable(adj, start, end):
-        if start == end:
-            return True
-        visited = set()
-        stack = [start]
-        while stack:
-            node = stack.pop()
-            for nbr in adj.get(node, []):
-                if nbr == end:
-                    return True
-                if nbr not in visited:
-                    visited.add(nbr)
-                    stack.append(nbr)
-        return False
-
-    adjacency = {}
-    new_edges = []
-
-    for e in sorted_edges:
-        src = e['data']['source']
-        tgt = e['data']['target']
-
-        # 仅当此边引入新的前向依赖时保留
-        if not is_reachable(adjacency, src, tgt):
-            new_edges.append(copy.deepcopy(e))
-            adjacency.setdefault(src, set()).add(tgt)
-
-    out['edges'] = new_edges
-    return out
-
-
+# 圖簡化（CPR / FD）實作在 graph_reduction，這裡保留原本的匯入位置
+from graph_reduction import reduce_cpr, reduce_fd
 
 
 def run_full_pipeline(
@@ -106,23 +38,71 @@ def run_full_pipeline(
     dirCsv: str = "csv",
     dirJson: str = "json",
     analysisType: str = 'source',
-    fileName: str = "file"
+    fileName: str = "file",
+    graphBackend: str = "networkx",
+    extraScores: tuple = (),
+    rankBy: str = "final_score",
+    reduce: str = None,
+    topK: int = 5,
+    useCache: bool = True,
+    cacheDir: str = None,
+    cacheMaxBytes: int = 2 << 30,
+    inMemory: bool = False,
+    debugIntermediates: bool = False,
+    exportCompact: bool = False,
+    exportCompress: str = None,
+    exportEncoding: str = "cytoscape",
+    lodClusterBy: str = "process_tree",
+    lodMaxClusterNodes: int = 500,
+    exportPositions: bool = False
 ) -> str:
     """
     主流程：上傳 JSON -> 轉 TXT -> 建立 provenance graph -> 計算分數 -> 輸出 Cytoscape JSON
     可以選擇分析類型：
       - 'source': 系統來源完整圖 (呼叫 generate_full_graph)
       - 'ttp':   攻擊子圖 (呼叫 generate_attack_graph)
+      - 'lod':   多解析度輸出 (呼叫 graph_lod.generate_lod_graph)：cluster 總覽加上各 cluster 的細節 tile，
+                 輸出到 <dirJson>/<fileName>lod/，回傳其中 index.json 的路徑
+
+    每個階段都經過 StageCache（見 stage_cache.py）：key 由輸入內容雜湊（下游階段用
+    上游的 key）、階段參數與程式碼版本組成，命中就直接取回產物。例如只改 topK，
+    只有最後的輸出階段會重跑。每次執行會寫出 <pathOutput>/<fileName>manifest.json，
+    記錄各階段的 key、是否命中與耗時。
 
     Args:
         json_path: 用戶上傳的 JSON 檔案絕對路徑
         temp_dir: 中間檔案資料夾，預設 backend/uploads
         output_dir: 最終輸出資料夾，預設 static/output
         analysis_type: 分析類型 'source' 或 'ttp'
+        graphBackend: 'networkx'、'compact'（見 graph_store.CompactProvenanceGraph）
+                      或 'mmap'（目錄格式，各階段共用同一份 memmap）
+        extraScores: 額外計分（score_engine，例如 ("pagerank",) 或 ("isolation_forest",)），寫入分數 CSV
+        rankBy: 'ttp' 模式 top-k benign 擴散所依據的分數欄位
+        reduce: 'cpr' 或 'fd' 時在 JSON -> TXT 階段做串流簡化，多餘的邊不會進圖
+        topK: 'ttp' 模式擴散的 benign 節點數
+        useCache: False 時每個階段都重跑
+        cacheDir: 快取目錄，預設 <pathOutput>/.cache（多個 run 可共用）
+        cacheMaxBytes: 快取上限，超過時依 LRU 淘汰
+        inMemory: True 時改走 run_in_memory_pipeline（不寫中間檔、不經快取）
+        debugIntermediates: inMemory 模式下仍把 TXT / pkl / CSV 寫出供除錯
+        exportCompact: 輸出不縮排的 JSON
+        exportCompress: None、'gzip' 或 'deflate'，輸出檔名加上 .gz / .deflate
+        exportEncoding: 'cytoscape' 或 'columnar'（欄式 NDJSON，副檔名 .ndjson）
+        lodClusterBy: 'lod' 模式的分群方式：'process_tree'、'directory' 或 'type'
+        lodMaxClusterNodes: 'lod' 模式 cluster 的節點數上限（超過就往下一層拆開）
+        exportPositions: 預先排版，節點座標寫進 Cytoscape JSON 的 position（見 graph_layout）；
+                         座標快取在圖檔旁的 <graph>.layouts/，圖沒變時重新匯出直接沿用
 
     Returns:
         json_out: 輸出的 Cytoscape JSON 完整絕對路徑
     """
+    if inMemory:
+        return run_in_memory_pipeline(
+            pathInput, pathOutput, dirTxt, dirPkl, dirCsv, dirJson, analysisType, fileName,
+            graphBackend, extraScores, rankBy, reduce, topK, debugIntermediates,
+            exportCompact, exportCompress, exportEncoding, lodClusterBy, lodMaxClusterNodes,
+            exportPositions)
+
     pathDirTxt=os.path.join(pathOutput,dirTxt)
     pathDirPkl=os.path.join(pathOutput,dirPkl)
     pathDirJson=os.path.join(pathOutput,dirJson)
@@ -134,40 +114,269 @@ def run_full_pipeline(
     os.makedirs(pathDirCsv, exist_ok=True)
     os.makedirs(pathDirJson, exist_ok=True)
 
+    cache = StageCache(cacheDir or os.path.join(pathOutput, ".cache") if useCache else None,
+                       max_bytes=cacheMaxBytes)
+    records = []
+    started = time.time()
+
     # 1) JSON -> TXT
-    txt_path = os.path.join(pathDirTxt, f"{fileName}.txt")
-    if not os.path.exists(txt_path):
-        convert_json_to_txt(pathInput, txt_path)
+    txt_path = os.path.join(pathDirTxt, f"{fileName}_{reduce}.txt" if reduce else f"{fileName}.txt")
+    input_hash = file_digest(pathInput)
+    txt_params = {"reduce": reduce}
+    txt_key = stage_key("txt", [input_hash], txt_params, code_version(campaign_to_txt, graph_reduction))
+    records.append(cache.run("txt", txt_key, txt_path,
+                             lambda: convert_json_to_txt(pathInput, txt_path, reduce=reduce),
+                             {"params": txt_params}))
 
     # 2) TXT -> provenance graph (pickle)
-    graph_pkl = os.path.join(pathDirPkl, f"{fileName}graph.pkl")
-    if not os.path.exists(f"{fileName}graph.pkl"):
-        build_provenance_graph(txt_path, graph_pkl)
-    
+    graph_name = f"{fileName}graph" if graphBackend == "mmap" else f"{fileName}graph.pkl"
+    graph_pkl = os.path.join(pathDirPkl, graph_name)
+    graph_params = {"backend": graphBackend}
+    graph_key = stage_key("graph", [txt_key], graph_params, code_version(log_to_prov, graph_store))
+    records.append(cache.run("graph", graph_key, graph_pkl,
+                             lambda: build_provenance_graph(txt_path, graph_pkl, backend=graphBackend),
+                             {"params": graph_params}))
+
+    # 圖只載入一次，之後各階段共用（mmap 格式為 O(1) 開檔）；後面全部命中快取時不載入
+    loaded = {}
+
+    def graph():
+        if "graph" not in loaded:
+            loaded["graph"] = load_graph(graph_pkl)
+        return loaded["graph"]
+
     # 3) 計算節點分數 -> CSV
     score_csv = os.path.join(pathDirCsv, f"{fileName}node_scores.csv")
-    if not os.path.exists(f"{fileName}node_scores.csv"):
-        compute_node_scores(graph_pkl, score_csv)
+    score_params = {"extra_scores": list(extraScores)}
+    score_key = stage_key("scores", [graph_key], score_params,
+                          code_version(node_score, score_engine, isolation_forest, graph_store))
+    records.append(cache.run("scores", score_key, score_csv,
+                             lambda: compute_node_scores(graph(), score_csv, extra_scores=extraScores),
+                             {"params": score_params}))
 
     # 4) 根據分析類型輸出不同 JSON
+    export_format = {"compact": exportCompact, "compress": exportCompress, "encoding": exportEncoding}
+    layout_options = {"positions": exportPositions, "layout_cache": default_layout_cache(graph_pkl)}
     if analysisType == 'ttp':
         json_out = os.path.join(pathDirJson
-                                , f"{fileName}latest_attack.json")
-        generate_attack_graph(
-            graph_pkl_path=graph_pkl,
+                                , cytoscape_file_name(f"{fileName}latest_attack", exportEncoding, exportCompress))
+        export_path = json_out
+        export_params = {"analysis": "ttp", "top_k": topK, "layout": "dot", "rank_by": rankBy,
+                         "positions": exportPositions, **export_format}
+        export_inputs = [graph_key, score_key]
+        # TTP 名稱對照表也會影響輸出
+        ttp_csv = os.path.join(os.path.dirname(generate_graph.__file__), os.pardir, "enterprise_techniques.csv")
+        if os.path.exists(ttp_csv):
+            export_inputs.append(file_digest(ttp_csv))
+        export = lambda: generate_attack_graph(
+            graph_pkl_path=graph(),
             score_csv_path=score_csv,
             json_out=json_out,
             image_out=None,
-            top_k=5,
-            layout="dot"
+            top_k=topK,
+            layout="dot",
+            rank_by=rankBy,
+            **export_format,
+            **layout_options
+        )
+    elif analysisType == 'lod':
+        export_path = os.path.join(pathDirJson, f"{fileName}lod")
+        json_out = os.path.join(export_path, "index.json")
+        export_params = {"analysis": "lod", "cluster_by": lodClusterBy,
+                         "max_cluster_nodes": lodMaxClusterNodes, "positions": exportPositions, **export_format}
+        export_inputs = [graph_key]
+        export = lambda: generate_lod_graph(
+            graph_pkl_path=graph(),
+            out_dir=export_path,
+            cluster_by=lodClusterBy,
+            max_cluster_nodes=lodMaxClusterNodes,
+            positions=exportPositions,
+            **export_format
         )
     else:
-        json_out = os.path.join(pathDirJson, f"{fileName}latest_graph.json")
-        generate_full_graph(
-            graph_pkl_path=graph_pkl,
+        json_out = os.path.join(pathDirJson, cytoscape_file_name(f"{fileName}latest_graph", exportEncoding, exportCompress))
+        export_path = json_out
+        export_params = {"analysis": "source", "layout": "dot", "positions": exportPositions, **export_format}
+        export_inputs = [graph_key]
+        export = lambda: generate_full_graph(
+            graph_pkl_path=graph(),
             json_out=json_out,
             image_out=None,
-            layout="dot"
+            layout="dot",
+            **export_format,
+            **layout_options
         )
+    export_key = stage_key("export", export_inputs, export_params,
+                           code_version(generate_graph, graph_lod, graph_layout, graph_store))
+    records.append(cache.run("export", export_key, export_path, export, {"params": export_params}))
+
+    evicted = cache.evict()
+    if evicted:
+        print(f"Stage cache: evicted {len(evicted)} stale artifact(s)")
+
+    manifest = {
+        "input": os.path.abspath(pathInput),
+        "input_sha256": input_hash,
+        "started": started,
+        "seconds": round(time.time() - started, 6),
+        "stages": records,
+        "evicted": evicted,
+        "output": json_out,
+    }
+    with open(os.path.join(pathOutput, f"{fileName}manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+
+    return json_out
+
+
+def _tee_tsv(rows, path):
+    """邊產生列邊寫出 TSV（除錯用），格式同 convert_json_to_txt"""
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        writer = tsv_writer(f)
+        for row in rows:
+            writer.writerow(row)
+            yield row
+
+
+def _write_debug_graph(graph: CompactProvenanceGraph, pkl_path: str, backend: str):
+    """以 build_provenance_graph 對應 backend 的格式寫出圖檔（networkx 為 nx.MultiDiGraph 的 pickle）"""
+    if backend == "mmap":
+        save_graph_dir(graph, pkl_path)
+    elif backend == "compact":
+        with open(pkl_path, "wb") as f:
+            pickle.dump(graph, f, protocol=pickle.HIGHEST_PROTOCOL)
+    else:
+        with open(pkl_path, "wb") as f:
+            pickle.dump(graph.to_networkx(), f)
+
+
+def run_in_memory_pipeline(
+    pathInput: str,
+    pathOutput: str,
+    dirTxt: str = "txt",
+    dirPkl: str = "pkl",
+    dirCsv: str = "csv",
+    dirJson: str = "json",
+    analysisType: str = 'source',
+    fileName: str = "file",
+    graphBackend: str = "networkx",
+    extraScores: tuple = (),
+    rankBy: str = "final_score",
+    reduce: str = None,
+    topK: int = 5,
+    debugIntermediates: bool = False,
+    exportCompact: bool = False,
+    exportCompress: str = None,
+    exportEncoding: str = "cytoscape",
+    lodClusterBy: str = "process_tree",
+    lodMaxClusterNodes: int = 500,
+    exportPositions: bool = False
+) -> str:
+    """
+    記憶體內的完整流程：JSON 事件串流直接建成 CompactProvenanceGraph，
+    分數以 DataFrame 交給輸出階段，不寫 TXT / pkl / CSV 也不再讀回，
+    延遲只剩解析與計算本身。輸出的 Cytoscape JSON 與 run_full_pipeline 相同
+    （iter_tsv_fields 重現 TSV 往返的欄位處理）。
+    debugIntermediates=True 時仍把中間檔寫到原本的位置，方便比對：TXT / CSV 與檔案模式
+    逐位元組相同；圖檔依 graphBackend 寫成相同格式（預設 nx.MultiDiGraph 的 pickle），
+    compact / mmap 逐位元組相同，networkx 則是節點、邊、屬性與順序相同
+    （字串物件共用方式不同，pickle 位元組可能不同）。
+    """
+    pathDirJson = os.path.join(pathOutput, dirJson)
+    os.makedirs(pathDirJson, exist_ok=True)
+    if debugIntermediates:
+        for d in (dirTxt, dirPkl, dirCsv):
+            os.makedirs(os.path.join(pathOutput, d), exist_ok=True)
+
+    # 圖檔名稱與 run_full_pipeline 相同（mmap 為目錄）
+    graph_name = f"{fileName}graph" if graphBackend == "mmap" else f"{fileName}graph.pkl"
+    graph_path = os.path.join(pathOutput, dirPkl, graph_name)
 
+    t0 = time.perf_counter()
+    # 1) JSON 事件 -> 列（可選串流簡化）
+    rows = iter_campaign_rows(pathInput)
+    reducer = StreamReducer(reduce) if reduce else None
+    if reducer:
+        rows = reducer.filter_rows(rows)
+    if debugIntermediates:
+        txt_name = f"{fileName}_{reduce}.txt" if reduce else f"{fileName}.txt"
+        rows = _tee_tsv(rows, os.path.join(pathOutput, dirTxt, txt_name))
+
+    # 2) 列 -> 圖
+    graph = CompactProvenanceGraph.from_rows(iter_tsv_fields(rows))
+    if reducer:
+        print(f"✅ {reducer.summary()}")
+    if debugIntermediates:
+        _write_debug_graph(graph, graph_path, graphBackend)
+    t1 = time.perf_counter()
+
+    # 3) 分數
+    scores = score_nodes(graph, extraScores)
+    if debugIntermediates:
+        scores.to_csv(os.path.join(pathOutput, dirCsv, f"{fileName}node_scores.csv"),
+                      index=False, encoding="utf-8")
+    t2 = time.perf_counter()
+
+    # 4) 輸出（座標快取放在 pkl 目錄，與 run_full_pipeline 相同位置）
+    export_format = {"compact": exportCompact, "compress": exportCompress, "encoding": exportEncoding}
+    layout_options = {"positions": exportPositions,
+                      "layout_cache": default_layout_cache(graph_path)}
+    if analysisType == 'ttp':
+        json_out = os.path.join(pathDirJson, cytoscape_file_name(f"{fileName}latest_attack", exportEncoding, exportCompress))
+        generate_attack_graph(
+            graph_pkl_path=graph,
+            score_csv_path=scores,
+            json_out=json_out,
+            image_out=None,
+            top_k=topK,
+            layout="dot",
+            rank_by=rankBy,
+            **export_format,
+            **layout_options
+        )
+    elif analysisType == 'lod':
+        json_out = generate_lod_graph(
+            graph_pkl_path=graph,
+            out_dir=os.path.join(pathDirJson, f"{fileName}lod"),
+            cluster_by=lodClusterBy,
+            max_cluster_nodes=lodMaxClusterNodes,
+            positions=exportPositions,
+            **export_format
+        )
+    else:
+        json_out = os.path.join(pathDirJson, cytoscape_file_name(f"{fileName}latest_graph", exportEncoding, exportCompress))
+        generate_full_graph(
+            graph_pkl_path=graph,
+            json_out=json_out,
+            image_out=None,
+            layout="dot",
+            **export_format,
+            **layout_options
+        )
+    t3 = time.perf_counter()
+    print(f"In-memory pipeline: {graph.number_of_nodes()} nodes, {graph.number_of_edges()} edges "
+          f"(parse+build {t1 - t0:.2f}s, score {t2 - t1:.2f}s, export {t3 - t2:.2f}s)")
     return json_out
+
+
+def _run_pipeline_task(kwargs):
+    return run_full_pipeline(**kwargs)
+
+
+def run_batch_pipeline(
+    pathInputs: list,
+    pathOutput: str,
+    workers: int = None,
+    **kwargs
+) -> list:
+    """
+    以 process pool 對多個輸入檔平行執行 run_full_pipeline。
+    每個檔案的 fileName 取自輸入檔名（不含副檔名），輸出順序與 pathInputs 相同。
+    其餘參數（analysisType、dirTxt…）原樣傳給 run_full_pipeline。
+    """
+    tasks = []
+    for pathInput in pathInputs:
+        fileName = os.path.splitext(os.path.basename(pathInput))[0]
+        tasks.append(dict(kwargs, pathInput=pathInput, pathOutput=pathOutput, fileName=fileName))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(_run_pipeline_task, tasks))
@@ -1,73 +1,241 @@
 import re
-import pandas as pd
 import networkx as nx
 import pickle
 import os
 import argparse
-from collections import defaultdict
-import shlex
+import heapq
+from graph_reduction import StreamReducer
+from campaign_to_txt import write_tsv_rows
 
 # Regular expression to parse the header of an audit log line
 AUDIT_MSG_REGEX = re.compile(r'type=([^ ]+) msg=audit\((\d+\.\d+:\d+)\):(.*)')
 
-def parse_audit_log(input_path: str):
+# key=value pairs inside a record; values may be "double" or 'single' quoted
+AUDIT_FIELD_REGEX = re.compile(r"""([^\s=]+)=("[^"]*"|'[^']*'|\S*)""")
+HEX_VALUE_REGEX = re.compile(r'^(?:[0-9A-F]{2})+$')
+
+# Fields that auditd hex-encodes (unquoted) when the value contains spaces or
+# other special characters, e.g. name=2F746D70 -> "/tmp"
+HEX_ENCODED_FIELDS = frozenset({
+    'name', 'exe', 'comm', 'cwd', 'proctitle', 'path', 'key',
+    'acct', 'cmd', 'data', 'old', 'new', 'dir', 'file',
+})
+EXECVE_ARG_REGEX = re.compile(r'^a\d+$')
+
+def decode_audit_value(value: str) -> str:
+    """
+    Decodes a hex-encoded audit value. NUL separators (used by proctitle for
+    argv) become spaces. Values that are not valid hex are returned unchanged.
+    """
+    if not HEX_VALUE_REGEX.match(value):
+        return value
+    try:
+        raw = bytes.fromhex(value)
+    except ValueError:
+        return value
+    return raw.decode('utf-8', errors='replace').replace('\x00', ' ').strip()
+
+def parse_audit_record(data_str: str, msg_type: str = None) -> dict:
+    """
+    Tokenizes the key=value payload of a single audit record in one pass.
+    Quotes are stripped, and unquoted hex values of string fields (see
+    HEX_ENCODED_FIELDS, plus the argv fields of EXECVE records) are decoded.
+    """
+    fields = {}
+    hex_args = msg_type == 'EXECVE'
+    for key, value in AUDIT_FIELD_REGEX.findall(data_str):
+        if value[:1] in ('"', "'"):
+            value = value[1:-1]
+        elif key in HEX_ENCODED_FIELDS or (hex_args and EXECVE_ARG_REGEX.match(key)):
+            value = decode_audit_value(value)
+        fields[key] = value
+    return fields
+
+def new_event_group(msg_id: str) -> dict:
+    return {'msg_id': msg_id, 'type': None, 'records': []}
+
+def add_record(event_group: dict, msg_type: str, data_str: str):
+    """
+    Tokenizes a record once and caches the parsed fields on the event group.
+    """
+    event_group['type'] = msg_type
+    event_group['records'].append((msg_type, parse_audit_record(data_str, msg_type)))
+
+def parse_msg_id(msg_id: str) -> tuple:
+    """
+    Splits an audit msg id "1700000000.123:456" into (timestamp, serial).
+    """
+    ts, serial = msg_id.split(':', 1)
+    return float(ts), int(serial)
+
+class AuditEventAssembler:
+    """
+    Streaming reassembly of multi-record audit events with bounded memory.
+
+    An in-flight event is closed when
+      - its EOE record arrives,
+      - a new SYSCALL record reuses its msg_id,
+      - it is more than `time_window` seconds or `serial_window` serials
+        behind the newest record seen, or
+      - more than `max_pending` events are in flight (oldest first).
+
+    Closed events are released in (timestamp, serial) order as soon as no
+    older event is still pending, so output is incremental and ordered.
+    """
+
+    def __init__(self, time_window: float = 5.0, serial_window: int = 10000,
+                 max_pending: int = 10000):
+        self.time_window = time_window
+        self.serial_window = serial_window
+        self.max_pending = max_pending
+        self.pending = {}           # msg_id -> event group
+        self._pending_heap = []     # (key, msg_id); stale entries skipped lazily
+        self._closed_heap = []      # (key, seq, event group)
+        self._seq = 0               # tie-breaker for reused msg_ids
+        self._newest = (float('-inf'), -1)
+
+    def add(self, msg_type: str, msg_id: str, data_str: str) -> list:
+        """
+        Adds one record and returns the event groups released by it.
+        """
+        key = parse_msg_id(msg_id)
+        if key > self._newest:
+            self._newest = key
+
+        if msg_type == 'SYSCALL' and msg_id in self.pending:
+            self._close(msg_id)
+
+        if msg_type == 'EOE':
+            if msg_id in self.pending:
+                self._close(msg_id)
+        else:
+            group = self.pending.get(msg_id)
+            if group is None:
+                group = self.pending[msg_id] = new_event_group(msg_id)
+                group['key'] = key
+                heapq.heappush(self._pending_heap, (key, msg_id))
+            add_record(group, msg_type, data_str)
+
+        self._expire()
+        return self._release()
+
+    def flush(self) -> list:
+        """
+        Closes every pending event and returns all remaining groups in order.
+        """
+        for msg_id in list(self.pending):
+            self._close(msg_id)
+        return self._release()
+
+    def opens_group(self, msg_type: str, msg_id: str) -> bool:
+        """
+        Returns True if adding this record would start a new event group.
+        """
+        return msg_type != 'EOE' and (msg_type == 'SYSCALL' or msg_id not in self.pending)
+
+    def get_state(self) -> dict:
+        """
+        Returns the in-flight events (open, and closed but not yet released)
+        as plain data, so a checkpoint can resume without re-reading them.
+        """
+        return {'pending': list(self.pending.values()),
+                'closed': list(self._closed_heap),
+                'seq': self._seq,
+                'newest': self._newest}
+
+    def set_state(self, state: dict):
+        """
+        Restores the in-flight events saved by get_state.
+        """
+        self.pending = {group['msg_id']: group for group in state['pending']}
+        self._pending_heap = [(group['key'], msg_id) for msg_id, group in self.pending.items()]
+        heapq.heapify(self._pending_heap)
+        self._closed_heap = [tuple(item) for item in state['closed']]
+        heapq.heapify(self._closed_heap)
+        self._seq = state['seq']
+        self._newest = tuple(state['newest'])
+
+    def _close(self, msg_id: str):
+        group = self.pending.pop(msg_id)
+        self._seq += 1
+        heapq.heappush(self._closed_heap, (group['key'], self._seq, group))
+
+    def _oldest_pending(self):
+        heap = self._pending_heap
+        while heap:
+            key, msg_id = heap[0]
+            group = self.pending.get(msg_id)
+            if group is not None and group['key'] == key:
+                return key, msg_id
+            heapq.heappop(heap)
+        return None
+
+    def _expire(self):
+        newest_ts, newest_serial = self._newest
+        while True:
+            oldest = self._oldest_pending()
+            if oldest is None:
+                return
+            (ts, serial), msg_id = oldest
+            if (len(self.pending) > self.max_pending
+                    or ts < newest_ts - self.time_window
+                    or serial < newest_serial - self.serial_window):
+                heapq.heappop(self._pending_heap)
+                self._close(msg_id)
+            else:
+                return
+
+    def _release(self) -> list:
+        oldest = self._oldest_pending()
+        released = []
+        closed = self._closed_heap
+        while closed and (oldest is None or closed[0][0] < oldest[0]):
+            released.append(heapq.heappop(closed)[2])
+        return released
+
+def iter_audit_records(lines):
+    """
+    Yields (msg_type, msg_id, data_str) for every audit line in `lines`.
+    """
+    for line in lines:
+        match = AUDIT_MSG_REGEX.match(line)
+        if match:
+            yield match.groups()
+
+def parse_audit_log(input_path: str, time_window: float = 5.0,
+                    serial_window: int = 10000, max_pending: int = 10000):
     """
     Parses a Linux audit log file and yields structured event data.
+    Events are yielded incrementally in timestamp order; see
+    AuditEventAssembler for the window parameters.
     """
-    events = defaultdict(dict)
+    assembler = AuditEventAssembler(time_window, serial_window, max_pending)
     with open(input_path, 'r', encoding='utf-8') as f:
-        for line in f:
-            match = AUDIT_MSG_REGEX.match(line)
-            if not match:
-                continue
-
-            msg_type, msg_id, data_str = match.groups()
-            
-            # The event with the SYSCALL type is the root of the event
-            if msg_type == 'SYSCALL':
-                if msg_id in events:
-                    # Process the completed event before starting a new one
-                    yield process_event_group(events[msg_id])
-                    del events[msg_id]
-            
-            events[msg_id]['type'] = msg_type
-            
-            # Store the data for the current message
-            if 'data' not in events[msg_id]:
-                events[msg_id]['data'] = []
-            events[msg_id]['data'].append(data_str.strip())
+        for msg_type, msg_id, data_str in iter_audit_records(f):
+            for group in assembler.add(msg_type, msg_id, data_str):
+                yield process_event_group(group)
 
     # Process any remaining events
-    for event_id in events:
-        yield process_event_group(events[event_id])
+    for group in assembler.flush():
+        yield process_event_group(group)
 
 def process_event_group(event_group):
     """
     Processes a group of log lines that belong to the same event.
     """
     event_data = {'srcNode': None, 'dstNode': None, 'relation': None, 'timestamp': None, 'label': 'Unknown'}
-    
-    # Simple parsing of key-value pairs from the data string
-    parsed_data = {}
-    if 'data' in event_group:
-        for item in event_group['data']:
-            try:
-                # This is a simplification; a more robust parser would be needed for all cases
-                parts = shlex.split(item)
-                for part in parts:
-                    if '=' in part:
-                        key, value = part.split('=', 1)
-                        parsed_data[key] = value.strip('"')
-            except ValueError:
-                pass # Ignore lines that cannot be parsed
-
-    # Extract timestamp from the message id
-    if 'type' in event_group and event_group.get('type') == 'SYSCALL':
+
+    # Records were tokenized once when they were added to the group
+    syscall_info = None
+    path_info = None
+    for msg_type, fields in event_group.get('records', ()):
+        if syscall_info is None and msg_type == 'SYSCALL' and 'syscall' in fields:
+            syscall_info = fields
+        elif path_info is None and 'name' in fields and 'nametype' in fields:
+            path_info = fields
+
+    if syscall_info is not None:
         try:
-            syscall_data = [d for d in event_group['data'] if 'syscall=' in d][0]
-            syscall_parts = shlex.split(syscall_data)
-            syscall_info = {p.split('=', 1)[0]: p.split('=', 1)[1].strip('"') for p in syscall_parts if '=' in p}
-            
             event_data['timestamp'] = int(float(event_group['msg_id'].split(':')[0]))
             event_data['relation'] = syscall_info.get('syscall')
             event_data['label'] = syscall_info.get('key', 'Unknown')
@@ -81,13 +249,8 @@ def process_event_group(event_group):
                 'ppid': syscall_info.get('ppid'),
             }
 
-            # Find associated PATH data to create the destination node (file)
-            path_data_list = [d for d in event_group['data'] if ' name=' in d and 'nametype=' in d]
-            if path_data_list:
-                path_data = path_data_list[0]
-                path_parts = shlex.split(path_data)
-                path_info = {p.split('=', 1)[0]: p.split('=', 1)[1].strip('"') for p in path_parts if '=' in p}
-                
+            # Associated PATH data becomes the destination node (file)
+            if path_info is not None:
                 event_data['dstNode'] = {
                     'UUID': f"file-{path_info.get('inode')}",
                     'Type': 'file',
@@ -95,7 +258,7 @@ def process_event_group(event_group):
                     'inode': path_info.get('inode'),
                 }
 
-        except (ValueError, IndexError) as e:
+        except (ValueError, IndexError, KeyError) as e:
             # Not all syscalls will have the expected structure
             # print(f"Could not parse event group: {event_group}. Error: {e}")
             pass
@@ -126,31 +289,49 @@ def get_node_type(node_dict: dict) -> str:
         return None
     return node_dict.get("Type", "Unknown")
 
-def convert_events_to_tsv(events_iterator, output_path: str):
-    rows = []
+def iter_event_rows(events_iterator, reducer: StreamReducer = None):
+    """
+    Yields one TSV row (campaign_to_txt.TSV_COLUMNS order) per event that has
+    a source node.
+    With a reducer, rows whose edge is redundant are dropped inline.
+    """
     for event in events_iterator:
         if not event or not event.get("srcNode"):
             continue
-            
+
         src_node = event.get("srcNode")
         dst_node = event.get("dstNode")
-        
-        row = {
-            "src_uuid": get_node_uuid(src_node),
-            "src_label": get_node_label(src_node),
-            "src_type": get_node_type(src_node),
-            "dst_uuid": get_node_uuid(dst_node),
-            "dst_label": get_node_label(dst_node),
-            "dst_type": get_node_type(dst_node),
-            "relation": event.get("relation"),
-            "timestamp": event.get("timestamp"),
-            "label": event.get("label")
-        }
-        rows.append(row)
-
-    df = pd.DataFrame(rows)
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
-    df.to_csv(output_path, sep="\t", index=False, header=False, encoding="utf-8")
+        row = [
+            get_node_uuid(src_node),
+            get_node_label(src_node),
+            get_node_type(src_node),
+            get_node_uuid(dst_node),
+            get_node_label(dst_node),
+            get_node_type(dst_node),
+            event.get("relation"),
+            event.get("timestamp"),
+            event.get("label"),
+        ]
+        if reducer and not reducer.keep_event(row[0], row[3], row[6], row[8]):
+            continue
+        yield row
+
+def convert_events_to_tsv(events_iterator, output_path: str, reduce: str = None,
+                          chunk_size: int = 10000):
+    """
+    Streams parsed events to a TSV file, keeping only `chunk_size` rows in
+    memory (see campaign_to_txt.write_tsv_rows; the output is the same as the
+    former DataFrame.to_csv). With reduce='cpr' or 'fd', redundant edges are
+    dropped while streaming (see graph_reduction.StreamReducer).
+    """
+    reducer = StreamReducer(reduce) if reduce else None
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8", newline="") as f:
+        write_tsv_rows(iter_event_rows(events_iterator, reducer), f, chunk_size)
+    if reducer:
+        print(f"✅ {reducer.summary()}")
     print(f"✅ Converted to TSV: {output_path}")
 
 def build_provenance_graph(txt_path, pkl_path):
@@ -188,15 +369,33 @@ def build_provenance_graph(txt_path, pkl_path):
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Process Linux audit logs to generate a provenance graph.")
     parser.add_argument("input_log", help="Path to the input audit log file.")
-    parser.add_argument("-t", "--tsv", help="Path to the output TSV file.", required=True)
+    parser.add_argument("-t", "--tsv", help="Path to the output TSV file (not used with --follow).")
     parser.add_argument("-p", "--pkl", help="Path to the output pickle file for the graph.", required=True)
+    parser.add_argument("-f", "--follow", action="store_true",
+                        help="Tail the growing log and keep checkpointing the graph to --pkl.")
+    parser.add_argument("--checkpoint-interval", type=float, default=10.0,
+                        help="Seconds between graph checkpoints in follow mode.")
+    parser.add_argument("--poll-interval", type=float, default=0.5,
+                        help="Seconds between polls for new lines in follow mode.")
+    parser.add_argument("--reduce", choices=["cpr", "fd"], default=None,
+                        help="Drop redundant edges (CPR or FD reduction) before they reach the graph.")
     args = parser.parse_args()
 
-    print(f"Starting to parse log file: {args.input_log}")
-    events_iterator = parse_audit_log(args.input_log)
-    
-    convert_events_to_tsv(events_iterator, args.tsv)
-    
-    build_provenance_graph(args.tsv, args.pkl)
+    if args.follow:
+        from audit_follow import follow_audit_log
+        print(f"Following log file: {args.input_log} (Ctrl+C to stop)")
+        follow_audit_log(args.input_log, args.pkl,
+                         checkpoint_interval=args.checkpoint_interval,
+                         poll_interval=args.poll_interval,
+                         reduce=args.reduce)
+    else:
+        if not args.tsv:
+            parser.error("--tsv is required unless --follow is given")
+        print(f"Starting to parse log file: {args.input_log}")
+        events_iterator = parse_audit_log(args.input_log)
+
+        convert_events_to_tsv(events_iterator, args.tsv, reduce=args.reduce)
+
+        build_provenance_graph(args.tsv, args.pkl)
 
     print("✅ Processing complete.")
@@ -0,0 +1,147 @@
+# utils/provenance_trace.py
+
+import heapq
+from collections import namedtuple
+
+import numpy as np
+import networkx as nx
+
+from graph_store import as_compact, NO_TIMESTAMP
+
+# 追蹤結果的一條邊；hops 為與起點（point of interest）的最短距離，直接相連為 1；
+# reached 為這條邊遠離起點的一端（backward 為 source，forward 為 target）
+TraceEdge = namedtuple("TraceEdge", "edge source target relation timestamp label hops reached")
+
+
+def _reference_time(G, poi: int, backward: bool):
+    """沒有指定 until/since 時，以 POI 相連邊中最晚（backward）或最早（forward）的時間為基準"""
+    eids = G.in_edges(poi) if backward else G.out_edges(poi)
+    ts = np.asarray(G.edge_timestamp)[eids]
+    ts = ts[ts != NO_TIMESTAMP]
+    if len(ts) == 0:
+        return None
+    return int(ts.max() if backward else ts.min())
+
+
+def _trace(G, poi, backward: bool, max_hops, time_window, ref_time, include_untimed):
+    G = as_compact(G)
+    start = G.node_index(poi)
+    if start < 0:
+        raise KeyError(f"Node {poi} not in graph")
+
+    if ref_time is None and time_window is not None:
+        ref_time = _reference_time(G, start, backward)
+        if ref_time is None:
+            raise ValueError(f"time_window needs a reference time, but node {poi} has no timed "
+                             f"{'in' if backward else 'out'}-edges; pass {'until' if backward else 'since'}")
+    # backward：邊的時間必須 <= 節點的 bound；forward：>= bound
+    # 依步數由少到多展開（同步數時 bound 越晚（backward）/ 越早（forward）越先），
+    # 所以每條邊第一次產生時的 hops 就是最短距離
+    sign = -1 if backward else 1
+    inf = float("inf")
+    bound0 = ref_time if ref_time is not None else -sign * inf
+    limit = None
+    if time_window is not None and ref_time is not None:
+        limit = ref_time - time_window if backward else ref_time + time_window
+
+    ts_all = np.asarray(G.edge_timestamp)
+    ends = np.asarray(G.edge_src if backward else G.edge_dst)
+    src_arr, dst_arr = G.edge_src, G.edge_dst
+    ids, rel, lab = G.node_ids, G.relations, G.edge_labels
+    yielded = set()
+    labels = {start: [(bound0, 0)]}          # 節點 -> 非支配的 (bound, hops) 標籤
+    heap = [(0, sign * bound0, start)]
+
+    def dominated(node, bound, hops):
+        for b, h in labels.get(node, ()):
+            if (b >= bound if backward else b <= bound) and h <= hops:
+                return True
+        return False
+
+    def walk():
+        while heap:
+            hops, key, node = heapq.heappop(heap)
+            bound = sign * key
+            # 已被更好的標籤取代，或已達步數上限
+            if (bound, hops) not in labels[node] or (max_hops is not None and hops >= max_hops):
+                continue
+            yield from expand(node, bound, hops)
+
+    def expand(node, bound, hops):
+        eids = G.in_edges(node) if backward else G.out_edges(node)
+        ts = ts_all[eids]
+        timed = ts != NO_TIMESTAMP
+        ok = timed & ((ts <= bound) if backward else (ts >= bound))
+        if limit is not None:
+            ok &= (ts >= limit) if backward else (ts <= limit)
+        if include_untimed:
+            ok |= ~timed
+        for e, t in zip(eids[ok].tolist(), ts[ok].tolist()):
+            if e not in yielded:
+                yielded.add(e)
+                yield TraceEdge(e, ids[src_arr[e]], ids[dst_arr[e]], rel[G.edge_relation[e]],
+                                None if t == NO_TIMESTAMP else t, lab[G.edge_label[e]], hops + 1,
+                                ids[ends[e]])
+            nxt = int(ends[e])
+            nb = bound if t == NO_TIMESTAMP else t
+            if not dominated(nxt, nb, hops + 1):
+                labels[nxt] = [(b, h) for b, h in labels.get(nxt, ())
+                               if not ((nb >= b if backward else nb <= b) and hops + 1 <= h)]
+                labels[nxt].append((nb, hops + 1))
+                heapq.heappush(heap, (hops + 1, sign * nb, nxt))
+
+    return walk()
+
+
+def trace_backward(G, poi, max_hops: int = None, time_window=None, until=None,
+                   include_untimed: bool = False):
+    """
+    由 poi 往回追溯（誰影響了它），依時間因果關係逐條 lazily 產生 TraceEdge：
+    邊 u -> v（時間 t）只有在 t <= v 的時間上限時才算，u 的時間上限隨之變成 t，
+    因此不會納入「發生在影響之後」的祖先。
+      - max_hops：最多往回幾步
+      - until：poi 的時間上限（預設不限）
+      - time_window：只看 [基準時間 - time_window, …] 內的邊；基準為 until，
+        未指定時為 poi 最晚的入邊時間（poi 沒有帶時間的入邊時丟出 ValueError）
+      - include_untimed：沒有 timestamp 的邊是否也納入（不改變時間上限）
+    結果依 hops 由小到大產生，每條邊只會產生一次，hops 為該邊與 poi 的最短距離；
+    G 可為 nx 圖或 CompactProvenanceGraph（建議後者，避免轉換）。
+    """
+    return _trace(G, poi, True, max_hops, time_window, until, include_untimed)
+
+
+def trace_forward(G, poi, max_hops: int = None, time_window=None, since=None,
+                  include_untimed: bool = False):
+    """
+    由 poi 往後追蹤（它影響了誰），規則與 trace_backward 對稱：
+    邊 u -> v 的時間必須 >= u 的時間下限，v 的時間下限隨之變成該邊的時間。
+    time_window 以 since（未指定時為 poi 最早的出邊時間，沒有帶時間的出邊時丟出 ValueError）
+    為起點往後計算。
+    """
+    return _trace(G, poi, False, max_hops, time_window, since, include_untimed)
+
+
+def trace_to_networkx(G, steps) -> nx.MultiDiGraph:
+    """
+    把 trace 結果（可只取前幾條）組成 nx.MultiDiGraph，可直接交給 export_cytoscape_json。
+    節點屬性 hops 為其與 poi 的最短距離（poi 為 0）。
+    """
+    C = as_compact(G)
+    shapes = {"process": "ellipse", "file": "rectangle", "registry": "pentagon", "network": "diamond"}
+    H = nx.MultiDiGraph()
+    for step in steps:
+        # reached 一端的距離為 hops，另一端（靠近 poi）為 hops - 1
+        near = step.target if step.reached == step.source else step.source
+        for uuid, hops in ((near, step.hops - 1), (step.reached, step.hops)):
+            if H.has_node(uuid):
+                H.nodes[uuid]["hops"] = min(H.nodes[uuid]["hops"], hops)
+                continue
+            i = C.node_index(uuid)
+            ntype = C.node_type_of(i)
+            H.add_node(uuid, label=C.node_label_of(i), type=ntype,
+                       shape=shapes.get(ntype.lower(), "ellipse"), hops=hops)
+        attrs = {"relation": step.relation, "label": step.label}
+        if step.timestamp is not None:
+            attrs["timestamp"] = step.timestamp
+        H.add_edge(step.source, step.target, **attrs)
+    return H
@@ -0,0 +1,162 @@
+# utils/score_engine.py
+
+import numpy as np
+import scipy.sparse as sp
+from graph_store import as_compact, NO_TIMESTAMP
+from isolation_forest import IsolationForest
+
+# 名稱 -> 計分函式 fn(ctx, **params) -> np.ndarray（長度 = 節點數）
+SCORERS = {}
+
+
+def register_scorer(name: str):
+    """註冊一個計分函式，之後可在 compute_scores / compute_node_scores 以名稱使用"""
+    def decorator(fn):
+        SCORERS[name] = fn
+        return fn
+    return decorator
+
+
+class ScoreContext:
+    """
+    多個計分共用的圖資料。邊陣列直接取自 CompactProvenanceGraph，
+    稀疏鄰接矩陣等衍生結構第一次用到時才建立，之後所有計分共用。
+    """
+
+    def __init__(self, G):
+        self.G = as_compact(G)
+        self.n = self.G.number_of_nodes()
+        self.src = np.asarray(self.G.edge_src)
+        self.dst = np.asarray(self.G.edge_dst)
+        self._adjacency = None
+
+    @property
+    def adjacency(self) -> sp.csr_matrix:
+        """n x n CSR，A[u, v] = u -> v 的邊數（多重邊累加成權重）"""
+        if self._adjacency is None:
+            data = np.ones(len(self.src), dtype=np.float64)
+            self._adjacency = sp.csr_matrix((data, (self.src, self.dst)), shape=(self.n, self.n))
+        return self._adjacency
+
+    def incident_sum(self, edge_weights: np.ndarray) -> np.ndarray:
+        """每個節點所有入邊與出邊的權重和"""
+        return (np.bincount(self.src, weights=edge_weights, minlength=self.n)
+                + np.bincount(self.dst, weights=edge_weights, minlength=self.n))
+
+    def incident_max(self, edge_weights: np.ndarray) -> np.ndarray:
+        """每個節點所有入邊與出邊的權重最大值（沒有邊為 0）"""
+        out = np.zeros(self.n, dtype=np.float64)
+        np.maximum.at(out, self.src, edge_weights)
+        np.maximum.at(out, self.dst, edge_weights)
+        return out
+
+
+@register_scorer("pagerank")
+def pagerank(ctx: ScoreContext, alpha: float = 0.85, tol: float = 1e-10, max_iter: int = 100) -> np.ndarray:
+    """稀疏矩陣 power iteration；多重邊視為權重，dangling 節點平均分配"""
+    n = ctx.n
+    if n == 0:
+        return np.zeros(0)
+    A = ctx.adjacency
+    out_w = np.asarray(A.sum(axis=1)).ravel()
+    dangling = out_w == 0
+    inv_out = np.divide(1.0, out_w, out=np.zeros(n), where=~dangling)
+    AT = A.T.tocsr()
+    r = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        r_new = alpha * (AT @ (r * inv_out))
+        r_new += (alpha * r[dangling].sum() + (1.0 - alpha)) / n
+        if np.abs(r_new - r).sum() < n * tol:
+            return r_new
+        r = r_new
+    return r
+
+
+@register_scorer("decay_degree")
+def decay_degree(ctx: ScoreContext, half_life: float = 3600.0) -> np.ndarray:
+    """
+    時間衰減度數：每條相連邊的權重為 0.5 ** ((t_latest - t) / half_life)，
+    越接近圖中最新事件的邊權重越高；沒有 timestamp 的邊權重為 0。
+    """
+    ts = np.asarray(ctx.G.edge_timestamp)
+    valid = ts != NO_TIMESTAMP
+    if not valid.any():
+        return np.zeros(ctx.n)
+    # 只對有 timestamp 的邊計算：NO_TIMESTAMP（int64 最小值）相減會溢位
+    weights = np.zeros(len(ts), dtype=np.float64)
+    age = (ts[valid].max() - ts[valid]).astype(np.float64)
+    weights[valid] = np.exp2(-age / half_life)
+    return ctx.incident_sum(weights)
+
+
+@register_scorer("relation_rarity")
+def relation_rarity(ctx: ScoreContext) -> np.ndarray:
+    """
+    關係稀有度（IDF）：idf(r) = log(邊數 / 關係 r 的邊數)，
+    節點分數為其相連邊中最稀有關係的 idf。
+    """
+    rel = np.asarray(ctx.G.edge_relation)
+    m = len(rel)
+    if m == 0:
+        return np.zeros(ctx.n)
+    counts = np.bincount(rel)
+    idf = np.log(m / np.maximum(counts, 1))
+    return ctx.incident_max(idf[rel])
+
+
+def node_features(ctx: ScoreContext) -> np.ndarray:
+    """
+    每個節點的結構特徵矩陣（n x k，float32），不含攻擊標記：
+    log 入度 / 出度、相連邊的關係分布（各關係佔該節點邊數的比例）、
+    節點類型 one-hot、相連邊的活動時間跨度 log(1 + 最晚 - 最早)（沒有 timestamp 為 0）。
+    """
+    n = ctx.n
+    rel = np.asarray(ctx.G.edge_relation)
+    node_type = np.asarray(ctx.G.node_type)
+    n_rel, n_type = len(ctx.G.relations), len(ctx.G.types)
+    indeg = np.bincount(ctx.dst, minlength=n)
+    outdeg = np.bincount(ctx.src, minlength=n)
+
+    mix = (np.bincount(ctx.src * n_rel + rel, minlength=n * n_rel)
+           + np.bincount(ctx.dst * n_rel + rel, minlength=n * n_rel)).reshape(n, n_rel)
+    mix = mix / np.maximum(indeg + outdeg, 1)[:, None]
+    onehot = np.zeros((n, n_type))
+    onehot[np.arange(n), node_type] = 1.0
+
+    ts = np.asarray(ctx.G.edge_timestamp)
+    valid = ts != NO_TIMESTAMP
+    first = np.full(n, np.iinfo(np.int64).max, dtype=np.int64)
+    last = np.full(n, np.iinfo(np.int64).min, dtype=np.int64)
+    for ends in (ctx.src, ctx.dst):
+        np.minimum.at(first, ends[valid], ts[valid])
+        np.maximum.at(last, ends[valid], ts[valid])
+    span = np.where(last >= first, (last - first).astype(np.float64), 0.0)
+
+    return np.column_stack([np.log1p(indeg), np.log1p(outdeg), mix, onehot, np.log1p(span)]).astype(np.float32)
+
+
+@register_scorer("isolation_forest")
+def isolation_forest(ctx: ScoreContext, n_trees: int = 100, sample_size: int = 256,
+                     seed: int = 0, n_jobs: int = 1) -> np.ndarray:
+    """
+    node_features 上的 Isolation Forest 異常分數，範圍 (0, 1]，越高越異常。
+    seed 固定讓階段快取的結果可重現；n_jobs 預設 1，避免在 run_batch_pipeline 的 worker 內再開 process pool。
+    """
+    if ctx.n == 0:
+        return np.zeros(0)
+    X = node_features(ctx)
+    forest = IsolationForest(n_trees=n_trees, sample_size=sample_size, seed=seed, n_jobs=n_jobs).fit(X)
+    return forest.score_samples(X)
+
+
+def compute_scores(G, names, params: dict = None) -> dict:
+    """
+    以同一個 ScoreContext 計算多個分數，回傳 {名稱: 陣列}（節點順序同圖）。
+    params 可針對個別計分傳參數，例如 {"decay_degree": {"half_life": 600}}。
+    """
+    params = params or {}
+    unknown = [name for name in names if name not in SCORERS]
+    if unknown:
+        raise ValueError(f"Unknown scorer(s): {unknown}; available: {sorted(SCORERS)}")
+    ctx = ScoreContext(G)
+    return {name: SCORERS[name](ctx, **params.get(name, {})) for name in names}
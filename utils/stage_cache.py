@@ -0,0 +1,197 @@
+# utils/stage_cache.py
+
+import os
+import json
+import time
+import shutil
+import hashlib
+
+CACHE_FORMAT_VERSION = 1
+
+
+def file_digest(path: str, chunk_size: int = 1 << 20) -> str:
+    """檔案內容的 sha256；目錄則依相對路徑排序後逐檔雜湊（mmap 圖目錄）"""
+    h = hashlib.sha256()
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                full = os.path.join(root, name)
+                h.update(os.path.relpath(full, path).replace(os.sep, "/").encode("utf-8") + b"\0")
+                h.update(file_digest(full, chunk_size).encode("ascii"))
+        return h.hexdigest()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def code_version(*modules) -> str:
+    """實作該階段的模組原始碼雜湊；改了程式碼，快取自然失效"""
+    h = hashlib.sha256()
+    for module in modules:
+        with open(module.__file__, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()[:16]
+
+
+def stage_key(stage: str, inputs: list, params: dict, code: str) -> str:
+    """
+    階段的 content address：階段名稱、輸入（檔案雜湊或上游階段的 key）、
+    參數與程式碼版本，任何一項改變都會得到不同的 key。
+    """
+    payload = json.dumps({
+        "format": CACHE_FORMAT_VERSION,
+        "stage": stage,
+        "inputs": list(inputs),
+        "params": params,
+        "code": code,
+    }, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def _remove(path: str):
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.remove(path)
+
+
+def _materialize(src: str, dst: str):
+    """
+    複製（不用 hard link）：各階段的寫入端會就地覆寫輸出檔，
+    若與快取共用 inode，快取內容會被悄悄改掉。
+    """
+    _remove(dst)
+    os.makedirs(os.path.dirname(dst) or ".", exist_ok=True)
+    if os.path.isdir(src):
+        shutil.copytree(src, dst)
+    else:
+        shutil.copy2(src, dst)
+
+
+def _size(path: str) -> int:
+    if os.path.isdir(path):
+        return sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, files in os.walk(path) for name in files)
+    return os.path.getsize(path)
+
+
+class StageCache:
+    """
+    以內容定址的階段快取：<root>/objects/<key[:2]>/<key>/ 底下放該階段的產物
+    （檔案或目錄）與 meta.json。命中時把產物複製回原本的輸出路徑。
+    超過 max_bytes 時依最後使用時間（LRU）淘汰。root=None 表示停用：每個階段都直接執行。
+
+    寫入與命中都是複製，輸出檔與快取不共用 inode，之後就地改寫輸出檔（例如直接呼叫
+    convert_json_to_txt 或各階段的 CLI）不會影響快取內容。
+    """
+
+    def __init__(self, root: str = None, max_bytes: int = 2 << 30):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.used = set()           # 本次執行用到（命中或寫入）的 key，淘汰時略過
+
+    def _entry(self, key: str) -> str:
+        return os.path.join(self.root, "objects", key[:2], key)
+
+    def _touch(self, entry: str):
+        marker = os.path.join(entry, "last_used")
+        with open(marker, "a"):
+            pass
+        os.utime(marker)
+
+    def get(self, key: str, out_path: str) -> bool:
+        """命中時把產物放到 out_path 並回傳 True"""
+        if self.root is None:
+            return False
+        entry = self._entry(key)
+        try:
+            with open(os.path.join(entry, "meta.json"), "r", encoding="utf-8") as f:
+                artifact = os.path.join(entry, json.load(f)["artifact"])
+            _materialize(artifact, out_path)
+            self._touch(entry)
+        except (OSError, KeyError, ValueError):
+            return False
+        self.used.add(key)
+        return True
+
+    def put(self, key: str, out_path: str, meta: dict = None):
+        """把剛產生的 out_path 收進快取（先寫暫存目錄再 rename，多個 process 同時寫也安全）"""
+        if self.root is None:
+            return
+        entry = self._entry(key)
+        if os.path.exists(entry):
+            self.used.add(key)
+            return
+        tmp = f"{entry}.tmp{os.getpid()}"
+        _remove(tmp)
+        os.makedirs(tmp)
+        name = os.path.basename(os.path.normpath(out_path))
+        _materialize(out_path, os.path.join(tmp, name))
+        info = dict(meta or {}, key=key, artifact=name, size=_size(out_path), created=time.time())
+        with open(os.path.join(tmp, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(info, f, ensure_ascii=False, indent=2, default=str)
+        self._touch(tmp)
+        try:
+            os.rename(tmp, entry)
+        except OSError:             # 其他 process 已寫入同一個 key
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.used.add(key)
+
+    def run(self, stage: str, key: str, out_path: str, fn, meta: dict = None) -> dict:
+        """
+        執行一個階段：命中快取就略過 fn，否則先清掉舊輸出、執行 fn() 產生 out_path 再寫入快取。
+        回傳這個階段的 manifest 紀錄。
+        """
+        t0 = time.perf_counter()
+        cached = self.get(key, out_path)
+        if not cached:
+            _remove(out_path)
+            fn()
+            self.put(key, out_path, dict(meta or {}, stage=stage))
+        record = {
+            "stage": stage,
+            "key": key,
+            "cached": cached,
+            "seconds": round(time.perf_counter() - t0, 6),
+            "artifact": out_path,
+        }
+        if meta:
+            record["params"] = meta.get("params")
+        return record
+
+    def entries(self) -> list:
+        """[(last_used, size, key, entry_path)]"""
+        result = []
+        objects = os.path.join(self.root, "objects")
+        if not os.path.isdir(objects):
+            return result
+        for prefix in os.listdir(objects):
+            for key in os.listdir(os.path.join(objects, prefix)):
+                entry = os.path.join(objects, prefix, key)
+                try:
+                    with open(os.path.join(entry, "meta.json"), "r", encoding="utf-8") as f:
+                        size = json.load(f)["size"]
+                    last_used = os.path.getmtime(os.path.join(entry, "last_used"))
+                except (OSError, KeyError, ValueError):
+                    continue        # 寫入中的暫存目錄或損毀的項目
+                result.append((last_used, size, key, entry))
+        return result
+
+    def evict(self) -> list:
+        """總大小超過 max_bytes 時，從最久沒用到的項目開始刪除（本次執行用到的不刪），回傳被刪的 key"""
+        if self.root is None or self.max_bytes is None:
+            return []
+        entries = sorted(self.entries())
+        total = sum(size for _, size, _, _ in entries)
+        evicted = []
+        for _, size, key, entry in entries:
+            if total <= self.max_bytes:
+                break
+            if key in self.used:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+            evicted.append(key)
+        return evicted